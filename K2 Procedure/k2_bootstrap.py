@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import k2_core
+from k2_core import EncodedDataset, FamilyScoreCache, adjacency_matrix, k2_algorithm
+from k2_parallel import worker_pool, worker_state
+
+BOOTSTRAP_METHODS = ("multinomial", "poisson")
+
+def bootstrap_weights(n_rows, rng, method="multinomial"):
+    """
+    Draws the row weights of a bootstrap replicate: weights[t] is how many times row t is in the replicate.
+
+    Parameters:
+        n_rows (int): The number of rows of the dataset.
+        rng (np.random.Generator): The random generator.
+        method (str): "multinomial", n_rows draws with replacement (the classic bootstrap, same size as the data),
+            or "poisson", an independent Poisson(1) weight per row (the size of the replicate varies).
+
+    Returns:
+        np.ndarray: The int64 weight of each row.
+    """
+    if method == "multinomial":
+        return np.bincount(rng.integers(0, n_rows, size=n_rows), minlength=n_rows).astype(np.int64)
+    if method == "poisson":
+        return rng.poisson(1.0, size=n_rows).astype(np.int64)
+    raise ValueError(f"Unknown bootstrap method {method!r}, expected one of {BOOTSTRAP_METHODS}")
+
+
+def _run_replicate(upper_bound, nodes, seed, method):
+    """
+    Task of a worker process: one bootstrap replicate.
+    """
+    return _replicate(upper_bound, nodes, worker_state["data"], worker_state["r"], worker_state["V"], worker_state["backend"],
+                      seed, method)
+
+
+def _replicate(upper_bound, nodes, data, r, V, backend, seed, method):
+    """
+    Runs K2 on the replicate drawn from the seed, as a weighted view of the encoded data (no rows are copied).
+
+    Returns:
+        np.ndarray: The adjacency matrix of the learned network.
+    """
+    weights = bootstrap_weights(len(data), np.random.default_rng(seed), method)
+    nodes = [{"id": node["id"], "parents": list(node["parents"])} for node in nodes]
+    # ? A fresh cache per replicate: the scores of a replicate are not valid for the others
+    k2_algorithm(upper_bound, nodes, data.with_weights(weights), r, V, backend=backend, cache=FamilyScoreCache())
+    return adjacency_matrix(nodes)
+
+
+def k2_bootstrap(upper_bound, nodes, data, r, V, n_replicates=100, method="multinomial", n_jobs=None, seed=None,
+                 backend=None):
+    """
+    Estimates how stable every edge learned by K2 is, over bootstrap replicates of the dataset.
+    A replicate is not a resampled copy of the data: it is a vector of row weights over the shared encoded
+    codes, and every count of the search is a weighted bincount. The replicates run in parallel processes,
+    each drawing its weights from its own seed.
+
+    Parameters:
+        upper_bound (int): The maximum number of parents allowed for any node.
+        nodes (list of dict): The nodes of the network, whose IDs are 0..n-1 (not modified).
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        n_replicates (int): The number of bootstrap replicates.
+        method (str): How the row weights are drawn, "multinomial" or "poisson" (see bootstrap_weights).
+        n_jobs (int): The number of worker processes, defaults to the number of CPUs.
+            With a single job the replicates run in the calling process.
+        seed (int): Seed of the replicates; the result does not depend on n_jobs.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+
+    Returns:
+        np.ndarray: The (n x n) edge frequencies, entry [z, i] is the share of the replicates with the edge z -> i.
+    """
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError(f"Unknown bootstrap method {method!r}, expected one of {BOOTSTRAP_METHODS}")
+    if not isinstance(data, EncodedDataset):
+        data = EncodedDataset(data, V) # Encoded once, every replicate weights the same codes
+    if backend is None:
+        backend = k2_core.SCORE_BACKEND # Resolved here, the workers may not share the setting of this process
+    seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    if n_jobs == 1:
+        matrices = [_replicate(upper_bound, nodes, data, r, V, backend, replicate_seed, method) for replicate_seed in seeds]
+    else:
+        with worker_pool(data, r, V, backend, n_jobs) as executor:
+            futures = [executor.submit(_run_replicate, upper_bound, nodes, replicate_seed, method) for replicate_seed in seeds]
+            matrices = [future.result() for future in futures]
+    return np.mean(matrices, axis=0)
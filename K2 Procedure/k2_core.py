@@ -1,7 +1,100 @@
+import heapq
+import math
+import os
+import sys
+import weakref
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
-from mpmath import mp, loggamma
-mp.dps = 200
+from k2_dataset import EncodedDataset
+
+# ? Backend used by cooper_herkovits_score when none is given explicitly:
+# ? "mpmath" is the arbitrary precision reference, "float" is the vectorized float64 implementation.
+# ? Setting K2_SCORE_BACKEND=float before importing this module never loads mpmath at all.
+SCORE_BACKENDS = ("mpmath", "float")
+SCORE_BACKEND = os.environ.get("K2_SCORE_BACKEND", "mpmath")
+
+_mp = None # mpmath context, loaded on first use by the mpmath backend
+_gammaln = None # Vectorized float64 log-gamma, resolved on first use by the float backend
+_log_factorials = np.zeros(1) # Shared table of log(n!), grown by log_factorial_table
+_mp_log_factorials = {} # Memoized mpmath values of log(n!)
+
+CODE_LIMIT = 2**62 # Largest range of the mixed-radix parent codes, safely inside int64
+DENSE_TABLE_LIMIT = 2**20 # Largest table of counts (in cells) indexed directly by the mixed-radix codes
+
+CONFIGURATION_INDEX_CAPACITY = 32 # Recently used ParentConfigurationIndex of encoded datasets kept by parent_configuration_index
+PAIRWISE_TABLE_LIMIT = 2**22 # Largest pairwise count matrix (in cells) built automatically by the searches
+BOUND_TOLERANCE = 1e-9 # Relative margin kept by the pruning, so rounding errors never prune a candidate that could win
+MAX_EXACT_PARENT_SETS = 2**16 # Largest number of parent sets of a node enumerated by exact_parents
+_configuration_indices = OrderedDict() # (id of an encoded dataset, sorted parents) -> ParentConfigurationIndex
+_configuration_finalizers = {} # id of an encoded dataset with indices -> the finalizer that drops them
+
+
+def set_score_backend(backend):
+    """
+    Selects the backend used by cooper_herkovits_score when no backend is passed explicitly.
+
+    Parameters:
+        backend (str): Either "mpmath" (arbitrary precision reference) or "float" (vectorized float64).
+
+    Returns:
+        None
+    """
+    global SCORE_BACKEND
+    if backend not in SCORE_BACKENDS:
+        raise ValueError(f"Unknown score backend {backend!r}, expected one of {SCORE_BACKENDS}")
+    SCORE_BACKEND = backend
+
+
+def _load_mpmath():
+    """
+    Imports mpmath with 200 digits of precision, only when the mpmath backend is actually used.
+    """
+    global _mp
+    if _mp is None:
+        from mpmath import mp
+        mp.dps = 200
+        _mp = mp
+    return _mp
+
+
+def log_gamma(values):
+    """
+    Computes the natural logarithm of the gamma function element-wise in float64.
+    scipy.special.gammaln is used when scipy is installed, otherwise math.lgamma is applied to each element.
+
+    Parameters:
+        values (np.ndarray): The (positive) arguments of the log-gamma function.
+
+    Returns:
+        np.ndarray: The float64 values of log(Gamma(values)).
+    """
+    global _gammaln
+    if _gammaln is None:
+        try:
+            from scipy.special import gammaln as _gammaln
+        except ImportError:
+            _gammaln = np.vectorize(math.lgamma, otypes=[np.float64])
+    return _gammaln(np.asarray(values, dtype=np.float64))
+
+def dataset_identity(data):
+    """
+    Returns the object identifying the dataset behind data, used by the caches to detect a change of dataset:
+    an EncodedDataset is the same dataset as the DataFrame it was encoded from, unless it is weighted.
+    """
+    if isinstance(data, EncodedDataset) and data.weights is None and data.source is not None:
+        return data.source
+    return data
+
+
+def _parent_frame(parents_xi, data):
+    """
+    The original values of the parent columns, as a DataFrame.
+    """
+    if isinstance(data, EncodedDataset):
+        return data.decode(parents_xi)
+    return data.iloc[:, parents_xi]
+
 
 def unique_instantiations(xi, parents_xi, data):
     """
@@ -10,7 +103,7 @@ def unique_instantiations(xi, parents_xi, data):
     Parameters:
         xi (int): The ID of the node for which parent instantiations are needed.
         parents_xi (list of int): The IDs of the parent nodes of xi.
-        data (pd.DataFrame): The dataset containing the values of the nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
         
     Returns:
         np.ndarray: An array of unique combinations of the values of the parents of xi.
@@ -19,12 +112,8 @@ def unique_instantiations(xi, parents_xi, data):
     if not parents_xi:
         return np.array([[]]) 
     
-    parents_xi = sorted(parents_xi)  
-    parent_data = data.iloc[:, parents_xi]  
-
-    unique_combinations = parent_data.drop_duplicates().values  # Removes duplicate combinations
-
-    return unique_combinations
+    # ? The index holds the unique combinations in order of first appearance, as drop_duplicates would return them
+    return parent_configuration_index(parents_xi, data).configurations
 
 
 def j_th_unque_instantiation(xi, parents_xi, j, data):
@@ -43,8 +132,771 @@ def j_th_unque_instantiation(xi, parents_xi, j, data):
         ? This function doesn't require a test case, as it's a helper function for other functions.
     """
 
-    unique_combinations = unique_instantiations(xi, parents_xi, data) 
-    return unique_combinations[j] 
+    return parent_configuration_index(parents_xi, data).instantiation(j)
+
+class ParentCodeCache:
+    """
+    Byte-budgeted cache of the per-row instantiation codes of parent sets, as returned by parent_configurations.
+    The code vector of a parent set is what lets a one-variable extension of it be encoded with a single
+    pass over the rows, so the K2 greedy step keeps the codes of the current parent set around.
+    When the total size of the stored vectors exceeds the budget the least recently used ones are evicted.
+
+    Like FamilyScoreCache, a cache refers to a single dataset and is cleared when used with another one.
+
+    Parameters:
+        max_bytes (int): The maximum total size, in bytes, of the cached code vectors.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._codes = OrderedDict()
+        self._data = None
+
+    def bind(self, data):
+        """
+        Ties the cache to a dataset, dropping every code vector computed on a different one.
+        """
+        data = dataset_identity(data)
+        if data is not self._data:
+            self._codes.clear()
+            self.n_bytes = 0
+            self._data = data
+
+    def get(self, parents_key):
+        """
+        Returns the (codes, q) pair of a sorted tuple of parents, or None if it is not cached.
+        """
+        entry = self._codes.get(parents_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._codes.move_to_end(parents_key)
+        self.hits += 1
+        return entry
+
+    def peek(self, parents_key):
+        """
+        Like get, but without updating the recency or the counters.
+        """
+        return self._codes.get(parents_key)
+
+    def put(self, parents_key, codes, q):
+        """
+        Stores the codes of a parent set, evicting the least recently used ones to stay within the budget.
+        """
+        if codes.nbytes > self.max_bytes:
+            return # A single vector larger than the whole budget is never cached
+        previous = self._codes.pop(parents_key, None)
+        if previous is not None:
+            self.n_bytes -= previous[0].nbytes
+        self._codes[parents_key] = (codes, q)
+        self.n_bytes += codes.nbytes
+        while self.n_bytes > self.max_bytes:
+            _, (evicted, _) = self._codes.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: hits, misses, evictions, number of vectors and bytes used by the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._codes),
+            "bytes": self.n_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def __len__(self):
+        return len(self._codes)
+
+
+def extend_configurations(codes, q, parent_codes, parent_q):
+    """
+    Derives the instantiation codes of a parent set extended by one variable from the codes of the set.
+    Each row gets code * parent_q + parent_code, renumbered by first appearance, so the cost is a single
+    pass over the rows whatever the size of the parent set.
+
+    Parameters:
+        codes (np.ndarray): The per-row instantiation codes of the current parent set.
+        q (int): The number of unique instantiations of the current parent set.
+        parent_codes (np.ndarray): The per-row codes of the added variable.
+        parent_q (int): The number of distinct values of the added variable.
+
+    Returns:
+        tuple: (codes, q) of the extended parent set.
+    """
+    # ? codes < q and parent_codes < parent_q, so the combined code is below q * parent_q <= m * parent_q
+    combined = codes.astype(np.int64, copy=False) * parent_q + parent_codes
+    combined, instantiations = pd.factorize(combined)
+    return combined, len(instantiations)
+
+
+def _column_configurations(parent, data):
+    """
+    The codes of a single column, numbered by first appearance of its values.
+    """
+    if isinstance(data, EncodedDataset):
+        column = data.column(parent)
+    else:
+        column = data.iloc[:, parent].to_numpy()
+    parent_codes, parent_values = pd.factorize(column, use_na_sentinel=False)
+    return parent_codes, len(parent_values)
+
+
+def _column_codes(parent, data):
+    """
+    Codes of a single column in any order (only their partition of the rows matters), with their number.
+    The codes of an EncodedDataset are used as they are, a DataFrame column is factorized.
+    """
+    if isinstance(data, EncodedDataset):
+        return data.column(parent), int(data.cardinalities[parent])
+    return _column_configurations(parent, data)
+
+
+def _row_weights(data):
+    """
+    The weight of each row of a weighted EncodedDataset, None if every row counts once.
+    """
+    return data.weights if isinstance(data, EncodedDataset) else None
+
+
+def weighted_bincount(cells, weights, minlength):
+    """
+    np.bincount of integer cells where each one counts weights[t] times (once if weights is None).
+    The weights are integers, so the float64 sums are exact and are returned as int64.
+    """
+    if weights is None:
+        return np.bincount(cells, minlength=minlength)
+    return np.rint(np.bincount(cells, weights=weights, minlength=minlength)).astype(np.int64)
+
+
+def _value_codes(xi, data, values):
+    """
+    The position of each row's value of xi in values, -1 where the value is not in values.
+    """
+    if not isinstance(data, EncodedDataset):
+        return pd.Index(values).get_indexer(data.iloc[:, xi])
+
+    column = data.column(xi)
+    if list(values) == data.V[xi]:
+        # ? Codes 0..r_i - 1 are already the positions in V, the codes of the values missing from V are dropped
+        value_codes = column.astype(np.int64)
+        value_codes[value_codes >= len(values)] = -1
+        return value_codes
+    lookup = np.full(data.cardinalities[xi], -1, dtype=np.int64) # Code of the column -> position in values
+    for k, value in enumerate(values):
+        code = data.code_of(xi, value)
+        if code >= 0:
+            lookup[code] = k
+    return lookup[column]
+
+
+def parent_configurations(parents_xi, data, code_cache=None):
+    """
+    Encodes, for every row of the dataset, which unique instantiation of the parents of a node it takes.
+    The values of each parent column are mapped to 0..(distinct values - 1) and combined into a single
+    mixed-radix code per row, which is then renumbered in order of first appearance.
+
+    Parameters:
+        parents_xi (list of int): The IDs of the parent nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        code_cache (ParentCodeCache): Optional cache of code vectors. When the codes of the parent set without
+            one of its variables are cached, only that variable is combined with them.
+
+    Returns:
+        tuple: (codes, q) where codes (np.ndarray) holds, for each row, the index j of the unique
+               instantiation taken by the parents, and q (int) is the number of unique instantiations.
+               The indices j follow the same order as unique_instantiations.
+    """
+    n_rows = len(data)
+    if not parents_xi:
+        return np.zeros(n_rows, dtype=np.int64), 1 # A single (empty) instantiation shared by every row
+
+    parents_key = tuple(sorted(int(parent) for parent in parents_xi))
+    if code_cache is not None:
+        return _cached_configurations(parents_key, data, code_cache)
+
+    codes, _ = mixed_radix_codes(parents_key, data)
+    # ? factorize numbers the codes by first appearance, which is the same order used by drop_duplicates
+    codes, instantiations = pd.factorize(codes)
+    return codes, len(instantiations)
+
+
+def mixed_radix_codes(parents_xi, data, code_limit=CODE_LIMIT):
+    """
+    Combines the parent columns into a single integer code per row, without overflowing.
+    The codes are built as code * r_p + code_p, one parent at a time. When the next parent would push the codes
+    beyond code_limit, the codes of the parents combined so far are first re-factorized into 0..(observed
+    instantiations - 1), which are at most as many as the rows. So the codes never overflow and their range
+    grows with min(m, prod(r)) instead of prod(r).
+
+    Parameters:
+        parents_xi (list of int): The IDs of the parent nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        code_limit (int): The largest code range allowed before re-factorizing.
+
+    Returns:
+        tuple: (codes, size) where codes (np.ndarray) are the per-row codes, all below size. If the codes were
+               never re-factorized, size is the product of the cardinalities of the parents.
+    """
+    codes = np.zeros(len(data), dtype=np.int64)
+    size = 1
+    for parent in parents_xi:
+        parent_codes, parent_q = _column_codes(parent, data)
+        if size * parent_q > code_limit:
+            codes, instantiations = pd.factorize(codes) # Keep only the instantiations actually observed
+            size = len(instantiations)
+        codes = codes * parent_q + parent_codes # Mixed-radix code of the parent values seen so far
+        size *= parent_q
+    return codes, size
+
+
+def _cached_configurations(parents_key, data, code_cache):
+    """
+    parent_configurations through a ParentCodeCache, extending a cached subset by one variable when possible.
+    """
+    code_cache.bind(data)
+    entry = code_cache.get(parents_key)
+    if entry is not None:
+        return entry
+
+    if len(parents_key) == 1:
+        codes, q = _column_configurations(parents_key[0], data)
+    else:
+        # ? The renumbering by first appearance only depends on the partition of the rows, not on the order in
+        # ? which the variables were combined, so any cached subset missing one variable can be extended.
+        # ? In the greedy step the subset is the current parent set and the missing variable the candidate
+        base_key = None
+        for position in reversed(range(len(parents_key))):
+            candidate_key = parents_key[:position] + parents_key[position + 1:]
+            if code_cache.peek(candidate_key) is not None:
+                base_key, added = candidate_key, parents_key[position]
+                break
+        if base_key is None:
+            base_key, added = parents_key[:-1], parents_key[-1]
+        codes, q = _cached_configurations(base_key, data, code_cache)
+        added_codes, added_q = _cached_configurations((added,), data, code_cache)
+        codes, q = extend_configurations(codes, q, added_codes, added_q)
+
+    code_cache.put(parents_key, codes, q)
+    return codes, q
+
+
+class ParentConfigurationIndex:
+    """
+    Index of the unique instantiations of a parent set. It is built with a single pass over the rows and holds:
+    the per-row inverse index (row -> j), the number of rows of each instantiation and the rows grouped by
+    instantiation, so the j-th instantiation, its number of rows and the list of its rows are found without
+    scanning the dataset again. The instantiations are numbered by first appearance, as in unique_instantiations.
+    On a weighted dataset, n_ij counts the samples (the weights of the rows) rather than the rows.
+
+    Parameters:
+        parents_xi (list of int): The IDs of the parent nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+    """
+
+    def __init__(self, parents_xi, data):
+        self.parents = sorted(parents_xi)
+        self.inverse, self.q = parent_configurations(self.parents, data)
+        self.counts = np.bincount(self.inverse, minlength=self.q) # Rows of each instantiation
+        self.samples = weighted_bincount(self.inverse, _row_weights(data), self.q) # Samples of each instantiation
+        self._order = np.argsort(self.inverse, kind="stable") # Rows grouped by instantiation, in row order
+        self._offsets = np.concatenate(([0], np.cumsum(self.counts)))
+        if self.parents:
+            first_rows = self._order[self._offsets[:-1]] # The first row of each group is its first appearance
+            self.configurations = _parent_frame(self.parents, data).iloc[first_rows].values # Values of each instantiation
+        else:
+            self.configurations = np.array([[]]) # The empty instantiation
+
+    def __len__(self):
+        return self.q
+
+    def _check(self, j):
+        if not -self.q <= j < self.q:
+            raise IndexError(f"Instantiation {j} is out of range, the parents have {self.q} unique instantiations")
+        return j % self.q
+
+    def instantiation(self, j):
+        """
+        Returns the j-th unique instantiation of the parents.
+        """
+        return self.configurations[self._check(j)]
+
+    def n_ij(self, j):
+        """
+        Returns the number of samples in which the parents take their j-th instantiation.
+        """
+        return self.samples[self._check(j)]
+
+    def rows(self, j):
+        """
+        Returns the indices of the rows in which the parents take their j-th instantiation.
+        """
+        j = self._check(j)
+        return self._order[self._offsets[j]:self._offsets[j + 1]]
+
+    def row_instantiation(self, row):
+        """
+        Returns the index j of the instantiation taken by the parents in a row.
+        """
+        return self.inverse[row]
+
+
+def _drop_configuration_indices(data_id):
+    """
+    Finalizer of an encoded dataset: drops its ParentConfigurationIndex entries once it no longer exists.
+    """
+    _configuration_finalizers.pop(data_id, None)
+    for key in [key for key in _configuration_indices if key[0] == data_id]:
+        del _configuration_indices[key]
+
+
+def parent_configuration_index(parents_xi, data):
+    """
+    Returns the ParentConfigurationIndex of a parent set. On an EncodedDataset, whose codes never change, the
+    index is built only if it is not among the recently used ones. The indices of a dataset are dropped as
+    soon as it is collected, so they never outlive it.
+    A DataFrame can be modified in place, so its index is always built again.
+
+    Parameters:
+        parents_xi (list of int): The IDs of the parent nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+
+    Returns:
+        ParentConfigurationIndex: The index of the parent set.
+    """
+    if not isinstance(data, EncodedDataset):
+        return ParentConfigurationIndex(parents_xi, data)
+
+    key = (id(data), tuple(sorted(int(parent) for parent in parents_xi)))
+    index = _configuration_indices.get(key)
+    if index is not None:
+        _configuration_indices.move_to_end(key)
+        return index
+
+    index = ParentConfigurationIndex(parents_xi, data)
+    if id(data) not in _configuration_finalizers:
+        # ? The entries are dropped when the dataset is collected, before its id can be given to another object
+        finalizer = weakref.finalize(data, _drop_configuration_indices, id(data))
+        finalizer.atexit = False
+        _configuration_finalizers[id(data)] = finalizer
+    _configuration_indices[key] = index
+    while len(_configuration_indices) > CONFIGURATION_INDEX_CAPACITY:
+        _configuration_indices.popitem(last=False)
+    return index
+
+
+def contingency_table(xi, parents_xi, data, values, code_cache=None, ordered=True, dense_limit=DENSE_TABLE_LIMIT):
+    """
+    Computes the whole table of counts N_ijk for node xi and its parents with a single pass over the rows.
+
+    Parameters:
+        xi (int): The ID of the node.
+        parents_xi (list of int): The IDs of the parent nodes of xi.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        values (list): The values of xi to count, the k-th column of the table counts values[k].
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        ordered (bool): If False, the rows of the table may come in any order and include unobserved
+            instantiations (all zeros), which is enough for the score and allows the dense mode.
+        dense_limit (int): The largest table, in cells, counted in dense mode.
+
+    Returns:
+        np.ndarray: A (q x len(values)) array where entry [j, k] is the number of rows in which xi equals
+                    values[k] and the parents of xi take their j-th unique instantiation.
+    """
+    r_xi = len(values)
+    if code_cache is not None or ordered:
+        codes, q = parent_configurations(parents_xi, data, code_cache)
+    else:
+        # ? The table size is predicted from the cardinalities: when every possible instantiation fits in
+        # ? dense_limit cells, the mixed-radix codes index the table directly (dense mode). Otherwise only the
+        # ? observed instantiations get a row (sparse mode), so the table never exceeds m rows
+        codes, q = mixed_radix_codes(sorted(parents_xi), data)
+        if q * r_xi > dense_limit:
+            codes, instantiations = pd.factorize(codes)
+            q = len(instantiations)
+
+    value_codes = _value_codes(xi, data, values) # Position of each row's value in values, -1 if absent
+    mask = value_codes >= 0 # Rows where xi takes a value outside of values are not counted
+
+    # ? Each (j, k) cell is flattened into j * r_xi + k, so one bincount fills the whole table
+    cells = codes[mask] * r_xi + value_codes[mask]
+    weights = _row_weights(data)
+    return weighted_bincount(cells, weights[mask] if weights is not None else None, q * r_xi).reshape(q, r_xi)
+
+
+def candidate_tables(xi, parents_xi, candidates, data, values, code_cache=None, block_rows=2**16, max_cells=2**24):
+    """
+    Computes the tables of counts of the families (xi, parents_xi + [z]) for every candidate z with a single
+    sweep over the rows. All the tables live in one combined count array indexed by
+    (candidate, instantiation of parents_xi, value of z, value of xi), filled block by block with one bincount.
+
+    Parameters:
+        xi (int): The ID of the node.
+        parents_xi (list of int): The IDs of the current parent nodes of xi.
+        candidates (list of int): The IDs of the candidate parents.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        values (list): The values of xi to count.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        block_rows (int): The number of rows processed at once, bounding the temporary memory.
+        max_cells (int): The largest combined count array built; above it every candidate is counted on its own.
+
+    Returns:
+        list of np.ndarray: One table per candidate. Each has len(values) columns, its rows are the possible
+                            instantiations of parents_xi + [z] (some of them possibly unobserved, hence all zero)
+                            in no particular order, which does not change the score.
+    """
+    if not candidates:
+        return []
+
+    r_xi = len(values)
+    codes, q = parent_configurations(parents_xi, data, code_cache)
+    candidate_codes = [_column_codes(z, data) for z in candidates]
+    sizes = [q * cardinality * r_xi for _, cardinality in candidate_codes]
+    if sum(sizes) > max_cells:
+        return [contingency_table(xi, list(parents_xi) + [z], data, values, code_cache, ordered=False) for z in candidates]
+
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    value_codes = _value_codes(xi, data, values)
+    weights = _row_weights(data)
+    counts = np.zeros(offsets[-1], dtype=np.int64)
+    for start in range(0, len(value_codes), block_rows):
+        block = slice(start, start + block_rows)
+        mask = value_codes[block] >= 0 # Rows where xi takes a value outside of values are not counted
+        block_codes = codes[block][mask]
+        block_values = value_codes[block][mask]
+        cells = [
+            offset + ((block_codes * cardinality + z_codes[block][mask]) * r_xi + block_values)
+            for offset, (z_codes, cardinality) in zip(offsets, candidate_codes)
+        ]
+        # ? With weights, every candidate counts the same rows, so the weights of the block are repeated for each
+        block_weights = np.tile(weights[block][mask], len(candidates)) if weights is not None else None
+        counts += weighted_bincount(np.concatenate(cells), block_weights, offsets[-1])
+
+    return [counts[offsets[c]:offsets[c + 1]].reshape(-1, r_xi) for c in range(len(candidates))]
+
+
+def pairwise_counts(data, V=None, max_cells=2**22):
+    """
+    Counts the joint occurrences of the values of every pair of columns, all at once.
+    Every column is one-hot encoded over its codes, so the counts of all the pairs are the entries of X^T X,
+    where X is the (rows x total codes) indicator matrix. The rows are processed in blocks, so at most
+    max_cells indicators are materialized at any time, and each block costs a single matrix product.
+
+    Parameters:
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        V (list of list): The possible values for each node, needed to encode a DataFrame.
+        max_cells (int): Maximum number of cells of a block of the indicator matrix.
+
+    Returns:
+        tuple: (counts, offsets). counts is a (total x total) int64 matrix, where total is the sum of the
+        cardinalities of the columns; the table of the pair (a, b) is counts[offsets[a]:offsets[a + 1], offsets[b]:offsets[b + 1]],
+        with the codes of a on the rows. The diagonal block of a column holds its marginal counts.
+        The rows of a weighted dataset count as many times as their weights.
+    """
+    if not isinstance(data, EncodedDataset):
+        data = EncodedDataset(data, V)
+
+    offsets = np.concatenate(([0], np.cumsum(data.cardinalities))).astype(np.int64)
+    total = int(offsets[-1])
+    counts = np.zeros((total, total), dtype=np.int64)
+    block_rows = max(1, max_cells // max(total, 1))
+    for start in range(0, len(data), block_rows):
+        block = data.codes[start:start + block_rows].astype(np.int64) + offsets[:-1]
+        if data.weights is None:
+            indicators = np.zeros((len(block), total), dtype=np.float32)
+            np.put_along_axis(indicators, block, 1, axis=1)
+            # ? The products are 0 or 1 and a block has less than 2^24 rows, so the float32 sums are exact
+            counts += (indicators.T @ indicators).astype(np.int64)
+        else:
+            indicators = np.zeros((len(block), total), dtype=np.float64)
+            np.put_along_axis(indicators, block, 1, axis=1)
+            weighted = indicators * data.weights[start:start + block_rows, None]
+            counts += np.rint(weighted.T @ indicators).astype(np.int64) # Integer sums, exact in float64
+    return counts, offsets
+
+
+class PairwiseTables:
+    """
+    The 2-D tables of counts of all the n(n-1)/2 pairs of columns, computed with one blocked sweep over the
+    rows (see pairwise_counts). They are all the tables needed by the first greedy step of K2, where every node
+    scores the single-parent families (xi, {z}), and by the empty parent sets (the marginal counts), so these
+    scores need no further pass over the data.
+
+    Only the blocks of the pairs a < b are kept, packed in one flat array of the smallest unsigned type that
+    holds the number of rows, together with the marginal counts of every column.
+
+    Parameters:
+        data (EncodedDataset): The encoded dataset.
+        max_cells (int): Maximum number of cells of a block of the indicator matrix (see pairwise_counts).
+    """
+
+    def __init__(self, data, max_cells=2**22):
+        counts, offsets = pairwise_counts(data, max_cells=max_cells)
+        self.V = data.V
+        self.categories = data.categories
+        self.cardinalities = np.array(data.cardinalities)
+        dtype = np.min_scalar_type(max(data.sample_size, 1)) # Unsigned, large enough for any count
+
+        n = len(self.cardinalities)
+        self.marginals = [np.diag(counts)[offsets[a]:offsets[a + 1]].astype(dtype) for a in range(n)]
+        blocks = [
+            counts[offsets[a]:offsets[a + 1], offsets[b]:offsets[b + 1]].ravel()
+            for b in range(n) for a in range(b) # Pair (a, b) is at index b(b - 1)/2 + a
+        ]
+        sizes = [len(block) for block in blocks]
+        self._starts = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        self._cells = np.concatenate(blocks).astype(dtype) if blocks else np.zeros(0, dtype=dtype)
+
+    @property
+    def nbytes(self):
+        """
+        The size in bytes of the stored counts.
+        """
+        return self._cells.nbytes + sum(marginal.nbytes for marginal in self.marginals)
+
+    def table(self, a, b):
+        """
+        Returns the joint counts of two different columns, with the codes of a on the rows and the ones of b on the columns.
+        """
+        if a == b:
+            raise ValueError("The pairwise tables only hold pairs of different columns")
+        low, high = min(a, b), max(a, b)
+        pair = high * (high - 1) // 2 + low
+        block = self._cells[self._starts[pair]:self._starts[pair + 1]].reshape(
+            self.cardinalities[low], self.cardinalities[high]
+        )
+        return block if a == low else block.T
+
+    def family_table(self, xi, parents_xi, values):
+        """
+        Returns the table of counts of xi and a parent set of at most one node, as contingency_table
+        (with ordered=False) would count it, or None if the parent set is larger.
+
+        Parameters:
+            xi (int): The ID of the node.
+            parents_xi (list of int): The IDs of the parent nodes of xi.
+            values (list): The values of xi to count, the k-th column of the table counts values[k].
+
+        Returns:
+            np.ndarray: The (q x len(values)) table of counts, or None.
+        """
+        if len(parents_xi) == 0:
+            counts = self.marginals[xi][None, :]
+        elif len(parents_xi) == 1:
+            counts = self.table(parents_xi[0], xi)
+        else:
+            return None
+
+        return _value_columns(counts, values, self.V[xi], self.categories[xi])
+
+
+def default_pairwise_tables(data):
+    """
+    The PairwiseTables built automatically for a search: the ones of the encoded dataset, or None if their
+    count matrix exceeds PAIRWISE_TABLE_LIMIT cells.
+    """
+    if int(data.cardinalities.sum()) ** 2 > PAIRWISE_TABLE_LIMIT:
+        return None
+    return PairwiseTables(data)
+
+
+def _value_columns(counts, values, V_xi, categories_xi):
+    """
+    Selects, from a table of counts indexed by the codes of xi on the columns, the columns of the given values.
+    """
+    if list(values) == V_xi:
+        return counts[:, :len(values)].astype(np.int64) # Codes 0..r_i - 1 are the positions in V
+    table = np.zeros((len(counts), len(values)), dtype=np.int64)
+    for k, value in enumerate(values):
+        for code, category in enumerate(categories_xi):
+            if category == value:
+                table[:, k] = counts[:, code]
+    return table
+
+
+class _ADNode:
+    """
+    A node of an ADTree: the count of a conjunction of (attribute = value) conditions.
+    """
+    __slots__ = ("count", "start", "rows", "vary")
+
+    def __init__(self, count, start, rows=None, vary=None):
+        self.count = count # The number of samples matching the conjunction
+        self.start = start # Only the attributes from start on can be added to the conjunction
+        self.rows = rows # Leaf lists only: the matching rows, counted directly
+        self.vary = vary # Internal nodes only: (most common value, child of each value) of every attribute from start on
+
+
+class ADTree:
+    """
+    All-dimensions tree (AD-tree) over an encoded dataset, which answers count queries without touching the rows.
+    Every node holds the count of a conjunction of conditions (attribute = value), and has one child per value
+    of every later attribute, so any conjunction is a path from the root. As in the original AD-tree, the child
+    of the most common value of each attribute is not stored: its counts are the ones of the parent minus the
+    other children. The nodes with fewer rows than leaf_threshold are leaf lists: they keep their rows and
+    count them directly, so the tree never grows below them.
+
+    The tree is built eagerly over the distinct rows of the dataset (see EncodedDataset.deduplicate), so repeated
+    rows cost nothing, and only the leaf lists keep rows: an internal node holds its count and its children.
+    The memory held by the tree is in nbytes, leaf_threshold trades it against the rows counted per query.
+
+    family_table has the interface of PairwiseTables, so an ADTree can be passed wherever the scorer takes
+    pairwise_tables, and then serves every family.
+
+    Parameters:
+        data (EncodedDataset): The encoded dataset (its weights, if any, are honored).
+        leaf_threshold (int): The nodes with fewer distinct rows are leaf lists, which bounds the size of the tree.
+        dense_limit (int): The largest table, in cells, returned by family_table (larger ones return None).
+    """
+
+    def __init__(self, data, leaf_threshold=256, dense_limit=DENSE_TABLE_LIMIT):
+        self.data = data.deduplicate()
+        self.V = data.V
+        self.categories = data.categories
+        self.cardinalities = np.array(data.cardinalities)
+        self.leaf_threshold = max(int(leaf_threshold), 1)
+        self.dense_limit = dense_limit
+        self.weights = self.data.weights
+        self.n_nodes = 0
+        self.nbytes = 0 # Bytes held by the nodes, their lists of children and the rows of the leaf lists
+        # ? The row numbers of the leaf lists take the smallest type that holds them
+        row_dtype = np.int32 if len(self.data) <= np.iinfo(np.int32).max else np.int64
+        self.root = self._build(np.arange(len(self.data), dtype=row_dtype), 0)
+
+    def _count_rows(self, rows):
+        return int(self.weights[rows].sum())
+
+    def _build(self, rows, start):
+        """
+        Builds the node of some rows, with a child for every value of every attribute from start on (except
+        the most common one), down to the leaf lists.
+        """
+        node = _ADNode(self._count_rows(rows), start)
+        self.n_nodes += 1
+        self.nbytes += sys.getsizeof(node)
+        if len(rows) < self.leaf_threshold or start == len(self.cardinalities):
+            node.rows = rows
+            self.nbytes += rows.nbytes
+            return node
+        node.vary = []
+        for attribute in range(start, len(self.cardinalities)):
+            codes = self.data.column(attribute)[rows]
+            # ? Any omitted value gives the same counts, the one of the most distinct rows leaves out the largest subtree
+            counts = np.bincount(codes, minlength=self.cardinalities[attribute])
+            mcv = int(np.argmax(counts))
+            children = [None] * len(counts)
+            for value in np.flatnonzero(counts):
+                if value != mcv:
+                    children[value] = self._build(rows[codes == value], attribute + 1)
+            node.vary.append((mcv, children))
+            self.nbytes += sys.getsizeof(children)
+        self.nbytes += sys.getsizeof(node.vary)
+        return node
+
+    def _vary(self, node, attribute):
+        """
+        The most common value of an attribute among the rows of an internal node, and the child of each value
+        (None for the most common value and for the values never taken).
+        """
+        return node.vary[attribute - node.start]
+
+    def count(self, conditions):
+        """
+        Counts the samples matching a conjunction of conditions.
+
+        Parameters:
+            conditions (dict): The code required for each column ID, e.g. {0: 1, 3: 0} counts the samples
+                where column 0 has code 1 and column 3 has code 0.
+
+        Returns:
+            int: The number of matching samples.
+        """
+        return self._count(self.root, sorted((int(a), int(v)) for a, v in conditions.items()))
+
+    def _count(self, node, conditions):
+        if not conditions:
+            return node.count
+        if node.rows is not None:
+            rows = node.rows
+            for attribute, value in conditions:
+                rows = rows[self.data.column(attribute)[rows] == value]
+            return self._count_rows(rows)
+        (attribute, value), rest = conditions[0], conditions[1:]
+        if not 0 <= value < self.cardinalities[attribute]:
+            return 0
+        mcv, children = self._vary(node, attribute)
+        if value != mcv:
+            return self._count(children[value], rest) if children[value] is not None else 0
+        # ? The most common value has no child: its count is the one without the condition, minus the other values
+        total = self._count(node, rest)
+        for child in children:
+            if child is not None:
+                total -= self._count(child, rest)
+        return total
+
+    def contingency(self, attributes):
+        """
+        The full table of counts of some columns, with one axis per column in the given order.
+
+        Parameters:
+            attributes (list of int): Different column IDs.
+
+        Returns:
+            np.ndarray: The int64 table, entry [v_1, ..., v_k] counts the samples where the k columns have these codes.
+        """
+        order = np.argsort(attributes, kind="stable")
+        table = self._table(self.root, [int(attributes[a]) for a in order])
+        return np.transpose(table, np.argsort(order)) if len(attributes) > 1 else table
+
+    def _table(self, node, attributes):
+        shape = tuple(self.cardinalities[attribute] for attribute in attributes)
+        if not attributes:
+            return np.array(node.count, dtype=np.int64)
+        if node.rows is not None:
+            cells = np.zeros(len(node.rows), dtype=np.int64)
+            for attribute in attributes:
+                cells = cells * self.cardinalities[attribute] + self.data.column(attribute)[node.rows]
+            return weighted_bincount(cells, self.weights[node.rows], math.prod(shape)).reshape(shape)
+        mcv, children = self._vary(node, attributes[0])
+        table = np.zeros(shape, dtype=np.int64)
+        # ? The slice of the most common value is the table without the first column, minus the other slices
+        table[mcv] = self._table(node, attributes[1:])
+        for value, child in enumerate(children):
+            if child is not None:
+                table[value] = self._table(child, attributes[1:])
+                table[mcv] -= table[value]
+        return table
+
+    def family_table(self, xi, parents_xi, values):
+        """
+        Returns the table of counts of xi and its parents, as contingency_table (with ordered=False) would
+        count it, or None if the table of all the possible instantiations exceeds dense_limit cells.
+
+        Parameters:
+            xi (int): The ID of the node.
+            parents_xi (list of int): The IDs of the parent nodes of xi.
+            values (list): The values of xi to count, the k-th column of the table counts values[k].
+
+        Returns:
+            np.ndarray: The (q x len(values)) table of counts, or None.
+        """
+        attributes = [int(parent) for parent in parents_xi] + [int(xi)]
+        if math.prod(int(self.cardinalities[a]) for a in attributes) > self.dense_limit:
+            return None
+        counts = self.contingency(attributes).reshape(-1, self.cardinalities[xi])
+        return _value_columns(counts, values, self.V[xi], self.categories[xi])
+
 
 def Nijk(xi, j, k, parents_xi, data):
     """
@@ -56,24 +908,19 @@ def Nijk(xi, j, k, parents_xi, data):
         j (int): The index of the unique instantiation of parent nodes.
         k (int): The value of node xi to count.
         parents_xi (list of int): The IDs of the parent nodes of xi.
-        data (pd.DataFrame): The dataset containing the values of the nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
         
     Returns:
         int: The count of occurrences where xi equals k and the parents of xi match the j-th instantiation.
     """
-    parents_xi = sorted(parents_xi) # Sort the parent IDs, to make it consistent with the topological order
-    parent_inst = j_th_unque_instantiation(xi, parents_xi, j, data) # Get the j-th unique instantiation of parents
-    
-    node_data = data.iloc[:, xi] # Select the column of node xi (its values)
-    if parents_xi: # If there are parents, select the columns of the parents
-        parent_data = data.iloc[:, parents_xi]  # Select parent columns (the values of the parents)
-        mask = (parent_data == parent_inst).all(axis=1)  # Check if parents match instantiation
-    else:
-        mask = pd.Series([True] * len(data))  # If no parents, use entire dataset
-
-    count = node_data[mask].eq(k).sum()  # Count occurrences of xi == k with given parent instantiation
-    # ? The mask is used to filter the data to only include rows where the parent nodes match the j-th instantiation
-    return count 
+    # ? Only the rows of the j-th instantiation are read, the index lists them without scanning the dataset
+    rows = parent_configuration_index(parents_xi, data).rows(j)
+    if isinstance(data, EncodedDataset):
+        matches = data.column(xi)[rows] == data.code_of(xi, k)
+        if data.weights is not None:
+            return int(data.weights[rows][matches].sum()) # Each row counts as many samples as its weight
+        return np.count_nonzero(matches)
+    return data.iloc[rows, xi].eq(k).sum()
 
 
 def Nij(xi, parents_xi, j, data, r, V):
@@ -84,21 +931,303 @@ def Nij(xi, parents_xi, j, data, r, V):
         xi (int): The ID of the node for which the count is needed.
         parents_xi (list of int): The IDs of the parent nodes of xi.
         j (int): The index of the unique instantiation.
-        data (pd.DataFrame): The dataset containing the values of the nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
         r (list of int): The number of possible values for each node.
         V (list of list of int): The possible values for each node.
         
     Returns:
         int: The total count of the j-th instantiation in the dataset.
     """
-    sum = 0 
-    for k_index in range(r[xi]): # Iterate over all possible values of xi
-        k = V[xi][k_index] # Get the k-th value of xi
-        sum += Nijk(xi, j, k, parents_xi, data) 
-    return sum 
+    rows = parent_configuration_index(parents_xi, data).rows(j)
+    counted = _value_codes(xi, data, V[xi][:r[xi]])[rows] >= 0 # N_ij is the sum of N_ijk over all the values k of xi
+    weights = _row_weights(data)
+    if weights is not None:
+        return int(weights[rows][counted].sum()) # Each row counts as many samples as its weight
+    return np.count_nonzero(counted)
+
+
+def log_factorial_table(size):
+    """
+    Returns the shared table of log(n!) for n = 0..size-1 (or more).
+    All the counts in a score are integers bounded by the number of rows m, and the largest factorial
+    needed is (N_ij + r_i - 1)!, so a table of m + max(r) entries serves every score on a dataset.
+    The table is built once and only grows when a larger size is requested.
+
+    Parameters:
+        size (int): The minimum number of entries needed.
+
+    Returns:
+        np.ndarray: float64 array where entry n is log(n!).
+    """
+    global _log_factorials
+    current = len(_log_factorials)
+    if current < size:
+        size = max(size, 2 * current) # Grow geometrically, so repeated requests do not rebuild it every time
+        extension = log_gamma(np.arange(current, size) + 1)
+        _log_factorials = np.concatenate((_log_factorials, extension))
+    return _log_factorials
+
+
+def _mpmath_log_factorial(n):
+    """
+    log(n!) with mpmath, memoized so each integer is evaluated at 200 digits only once.
+    """
+    value = _mp_log_factorials.get(n)
+    if value is None:
+        value = _load_mpmath().loggamma(n + 1)
+        _mp_log_factorials[n] = value
+    return value
+
+
+def count_histogram(counts):
+    """
+    Groups a collection of counts by value.
+
+    Parameters:
+        counts (np.ndarray): Non-negative integer counts.
+
+    Returns:
+        tuple: (values, frequencies), the distinct counts c and how many times each one occurs.
+    """
+    return np.unique(counts, return_counts=True)
 
 
-def cooper_herkovits_score(xi, parents_xi, data, r, V):
+def _mpmath_score(table, r_xi):
+    """
+    Cooper-Herskovits log score of a table of counts, computed with mpmath at 200 digits of precision.
+    """
+    mp = _load_mpmath()
+    nij = table.sum(axis=1)
+    score = mp.mpf(len(table)) * _mpmath_log_factorial(r_xi - 1)
+    for count, frequency in zip(*count_histogram(nij)):
+        score -= int(frequency) * _mpmath_log_factorial(int(count) + r_xi - 1)
+    for count, frequency in zip(*count_histogram(table)):
+        score += int(frequency) * _mpmath_log_factorial(int(count))
+    return score
+
+
+def _float_score(table, r_xi):
+    """
+    Cooper-Herskovits log score of a table of counts, computed in float64 from the shared log-factorial table.
+    """
+    nij = table.sum(axis=1)
+    nij_values, nij_frequencies = count_histogram(nij)
+    nijk_values, nijk_frequencies = count_histogram(table)
+    log_factorials = log_factorial_table(int(nij_values[-1]) + r_xi if len(nij_values) else r_xi)
+
+    terms = np.concatenate((
+        [len(table) * log_factorials[r_xi - 1]], # log((r_i - 1)!) is the same for every instantiation j
+        -nij_frequencies * log_factorials[nij_values + r_xi - 1],
+        nijk_frequencies * log_factorials[nijk_values],
+    ))
+    # ? fsum is exactly rounded, so the result does not depend on the order of the instantiations:
+    # ? two parent sets with the same counts always get the very same score, as with mpmath
+    return math.fsum(terms)
+
+
+def score_from_counts(table, r_xi, backend=None):
+    """
+    Computes the Cooper-Herskovits log score from a table of counts N_ijk.
+
+    Parameters:
+        table (np.ndarray): A (q x r_i) array of counts, as returned by contingency_table.
+        r_xi (int): The number of possible values of the node.
+        backend (str): "mpmath" or "float", defaults to SCORE_BACKEND.
+
+    Returns:
+        float: The Cooper-Herskovits (log) score of the counts.
+    """
+    # ? Instantiations that never occur (N_ij = 0) contribute log((r_i - 1)!) - log((r_i - 1)!) = 0, so they are
+    # ? dropped: the score then only depends on the observed rows of the table, whatever their order
+    table = table[table.sum(axis=1) > 0]
+
+    # ? Both backends aggregate the counts by value before evaluating any factorial:
+    # ? sum_j sum_k log(N_ijk!) = sum_c freq(c) * log(c!), where c runs over the distinct counts.
+    # ? With many parents most cells share the same small counts (0, 1, 2, ...), so only a handful of
+    # ? factorials are needed, and they are looked up instead of computed
+    backend = SCORE_BACKEND if backend is None else backend
+    r_xi = int(r_xi)
+    if backend == "mpmath":
+        return _mpmath_score(table, r_xi)
+    if backend == "float":
+        return _float_score(table, r_xi)
+    raise ValueError(f"Unknown score backend {backend!r}, expected one of {SCORE_BACKENDS}")
+
+
+def score_upper_bound(table, r_xi, floor=None):
+    """
+    Upper bound of the Cooper-Herskovits log score of every parent set that contains the one of the table.
+
+    Adding parents only splits the rows of an instantiation j into smaller groups. The score of a group is
+    largest when all its rows have the same value of the node (a "pure" group), and splitting a group never
+    scores more than keeping its cells N_ijk as separate pure groups. So every superset scores at most
+        sum_j sum_k [log((r_i - 1)!) - log((N_ijk + r_i - 1)!) + log(N_ijk!)]   (over the cells N_ijk > 0),
+    which equals the score of the table itself when all its instantiations are already pure.
+
+    The bound is the score of a node that its parents determine exactly, so it only prunes when the node is
+    nearly determined by some parent set, or when there are few samples: with many samples of a noisy node it
+    stays far above every score. Each of its terms is at least log((r_i - 1)!) - (r_i - 1) log(N_ijk + r_i - 1),
+    and by concavity of the log their sum is at least the one of as many equal cells, which only needs the
+    number of cells and of samples. When this estimate already reaches floor the bound is not computed.
+
+    Parameters:
+        table (np.ndarray): A (q x r_i) array of counts, as returned by contingency_table.
+        r_xi (int): The number of possible values of the node.
+        floor (float): Optional, the score the bound will be compared to: math.inf is returned instead of the
+            bound when the estimate shows that the bound is at least floor (so it could not prune anything).
+
+    Returns:
+        float: The bound, in float64 whatever the score backend (it is only compared, with BOUND_TOLERANCE).
+    """
+    r_xi = int(r_xi)
+    cells = table[table > 0]
+    if floor is not None and len(cells):
+        samples = int(cells.sum())
+        estimate = len(cells) * (log_factorial_table(r_xi)[r_xi - 1] - (r_xi - 1) * math.log(samples / len(cells) + r_xi - 1))
+        if estimate >= floor:
+            return math.inf
+    values, frequencies = count_histogram(cells)
+    log_factorials = log_factorial_table(int(values[-1]) + r_xi if len(values) else r_xi)
+    terms = np.concatenate((
+        frequencies * log_factorials[r_xi - 1],
+        -frequencies * log_factorials[values + r_xi - 1],
+        frequencies * log_factorials[values],
+    ))
+    return math.fsum(terms)
+
+
+def family_upper_bound(xi, parents_xi, data, r, V, code_cache=None, pairwise_tables=None, floor=None):
+    """
+    Upper bound of the score of every parent set of xi containing parents_xi (see score_upper_bound).
+
+    Parameters:
+        xi (int): The ID of the node.
+        parents_xi (list of int): The IDs of the parent nodes of xi.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        pairwise_tables (PairwiseTables or ADTree): Optional precomputed tables of the dataset.
+        floor (float): Optional, the score the bound will be compared to (see score_upper_bound).
+
+    Returns:
+        float: The upper bound.
+    """
+    table = pairwise_tables.family_table(xi, parents_xi, V[xi][:r[xi]]) if pairwise_tables is not None else None
+    if table is None:
+        table = contingency_table(xi, parents_xi, data, V[xi][:r[xi]], code_cache, ordered=False)
+    return score_upper_bound(table, r[xi], floor)
+
+
+def _can_improve(bound, score):
+    """
+    False if a score bound proves that no family can beat the score (up to BOUND_TOLERANCE).
+    """
+    return bound >= score - BOUND_TOLERANCE * max(1.0, abs(float(score)))
+
+
+class FamilyScoreCache:
+    """
+    Bounded cache of family scores, keyed by the node and its parent set.
+    The parent set is stored as a sorted tuple, so [2, 0] and [0, 2] are the same family.
+    When the cache is full the least recently used family is evicted.
+
+    A cache refers to a single dataset: it remembers the dataset it was filled from and is
+    cleared automatically when it is used with a different one.
+
+    Parameters:
+        capacity (int): The maximum number of family scores kept.
+    """
+
+    def __init__(self, capacity=100000):
+        if capacity < 1:
+            raise ValueError("The capacity of a FamilyScoreCache must be at least 1")
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._scores = OrderedDict()
+        self._data = None
+
+    @staticmethod
+    def key(xi, parents_xi, backend):
+        """
+        Canonical key of the family (xi, parents_xi) scored with the given backend.
+        """
+        return (int(xi), tuple(sorted(int(parent) for parent in parents_xi)), backend)
+
+    def bind(self, data):
+        """
+        Ties the cache to a dataset, dropping every score computed on a different one.
+        """
+        data = dataset_identity(data)
+        if data is not self._data:
+            self._scores.clear()
+            self._data = data
+
+    def get(self, key):
+        """
+        Returns the cached score of a family, or None if it is not cached.
+        """
+        score = self._scores.get(key)
+        if score is None:
+            self.misses += 1
+            return None
+        self._scores.move_to_end(key) # Most recently used families are kept at the end
+        self.hits += 1
+        return score
+
+    def put(self, key, score):
+        """
+        Stores the score of a family, evicting the least recently used one if the cache is full.
+        """
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        while len(self._scores) > self.capacity:
+            self._scores.popitem(last=False)
+            self.evictions += 1
+
+    def entries(self):
+        """
+        Returns the cached (key, score) pairs, least recently used first.
+        """
+        return list(self._scores.items())
+
+    def update(self, entries):
+        """
+        Stores many (key, score) pairs at once, e.g. the entries of another cache of the same dataset.
+        """
+        for key, score in entries:
+            self.put(key, score)
+
+    def clear(self):
+        """
+        Drops every cached score and resets the counters.
+        """
+        self._scores.clear()
+        self._data = None
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: hits, misses, evictions, current size and capacity of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._scores),
+            "capacity": self.capacity,
+        }
+
+    def __len__(self):
+        return len(self._scores)
+
+
+def cooper_herkovits_score(xi, parents_xi, data, r, V, backend=None, cache=None, code_cache=None, pairwise_tables=None):
     """
     Computes the Cooper-Herskovits score for a given node xi and its parent nodes.
     This score is used to evaluate how well a set of parents explains the data for a node.
@@ -106,12 +1235,17 @@ def cooper_herkovits_score(xi, parents_xi, data, r, V):
     Parameters:
         xi (int): The ID of the node whose score is being calculated.
         parents_xi (list of int): The IDs of the parent nodes of xi.
-        data (pd.DataFrame): The dataset containing the values of the nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
         r (list of int): The number of possible values for each node.
         V (list of list of int): The possible values for each node.
+        backend (str): "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Optional cache of family scores, looked up before counting.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        pairwise_tables (PairwiseTables or ADTree): Optional precomputed tables of the dataset, used for the
+            families they can serve (the parent sets of at most one node for PairwiseTables) instead of counting the rows.
         
     Returns:
-        float: The Cooper-Herskovits score for the node and its parent set.
+        float: The Cooper-Herskovits (log) score for the node and its parent set.
     """
     # ? The following code is the original implementation of the Cooper-Herskovits score
     # ? It uses the math library, which is not suitable for very large numbers
@@ -139,17 +1273,93 @@ def cooper_herkovits_score(xi, parents_xi, data, r, V):
 
     # ? The following code is the final implementation of the Cooper-Herskovits score (considering the above optimizations)
 
-    score = mp.mpf(0)
-    q = len(unique_instantiations(xi, parents_xi, data))
-    for j in range(q):
-        nij = Nij(xi, parents_xi, j, data, r, V)
-        log_factorial = loggamma((r[xi] - 1) + 1) - loggamma(nij + r[xi])
-        log_prod = mp.mpf(0)
-        for k in V[xi]:
-            log_prod += loggamma(Nijk(xi, j, k, parents_xi, data) + 1)
-        score += log_factorial + log_prod
+    # ? All the N_ijk are read from a single contingency table, N_ij is the sum of its j-th row
+
+    # ? The mpmath backend is kept as the reference implementation. The float backend evaluates the same
+    # ? log-domain formula over the whole table at once: log-scores stay in a range where float64 is accurate,
+    # ? only the original (non-log) product needed arbitrary precision
+
+    backend = SCORE_BACKEND if backend is None else backend
+    if cache is not None:
+        cache.bind(data)
+        key = FamilyScoreCache.key(xi, parents_xi, backend)
+        score = cache.get(key)
+        if score is not None:
+            return score
+
+    table = pairwise_tables.family_table(xi, parents_xi, V[xi][:r[xi]]) if pairwise_tables is not None else None
+    if table is None:
+        table = contingency_table(xi, parents_xi, data, V[xi][:r[xi]], code_cache, ordered=False)
+    score = score_from_counts(table, r[xi], backend)
+    if cache is not None:
+        cache.put(key, score)
     return score
 
+def cooper_herkovits_scores(xi, parents_xi, candidates, data, r, V, backend=None, cache=None, code_cache=None, bounds=None,
+                            pairwise_tables=None, bound_floor=None):
+    """
+    Computes the Cooper-Herskovits score of every one-parent extension parents_xi + [z] of the parent set of xi,
+    for all the candidates z at once. The families missing from the cache are counted together by
+    candidate_tables, with a single sweep over the rows.
+
+    Parameters:
+        xi (int): The ID of the node whose scores are being calculated.
+        parents_xi (list of int): The IDs of the current parent nodes of xi.
+        candidates (list of int): The IDs of the candidate parents.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Optional cache of family scores, looked up before counting.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        bounds (dict): Optional, filled with score_upper_bound of parents_xi + [z] for every candidate z
+            whose table is counted (the ones found in the cache are left out).
+        bound_floor (float): Optional, the score the bounds will be compared to. The bounds are then compared to
+            the best of bound_floor and of the scores of the candidates (see score_upper_bound), and the ones that
+            are sure to be above it are math.inf.
+        pairwise_tables (PairwiseTables or ADTree): Optional precomputed tables of the dataset: the tables of the
+            candidates they can serve are read from them, the other ones are counted over the rows.
+
+    Returns:
+        list: The score of parents_xi + [z] for each candidate z, in the order of candidates.
+    """
+    backend = SCORE_BACKEND if backend is None else backend
+    scores = [None] * len(candidates)
+    if cache is not None:
+        cache.bind(data)
+        for c, z in enumerate(candidates):
+            scores[c] = cache.get(FamilyScoreCache.key(xi, list(parents_xi) + [z], backend))
+
+    missing = [c for c, score in enumerate(scores) if score is None]
+    tables = [None] * len(missing)
+    if pairwise_tables is not None:
+        tables = [pairwise_tables.family_table(xi, list(parents_xi) + [candidates[c]], V[xi][:r[xi]]) for c in missing]
+    # ? The families the tables cannot serve (e.g. with more than one parent for PairwiseTables) are counted together
+    counted = [m for m, table in enumerate(tables) if table is None]
+    if counted:
+        counted_tables = candidate_tables(
+            xi, parents_xi, [candidates[missing[m]] for m in counted], data, V[xi][:r[xi]], code_cache
+        )
+        for m, table in zip(counted, counted_tables):
+            tables[m] = table
+    for c, table in zip(missing, tables):
+        scores[c] = score_from_counts(table, r[xi], backend)
+        if cache is not None:
+            cache.put(FamilyScoreCache.key(xi, list(parents_xi) + [candidates[c]], backend), scores[c])
+    if bounds is not None:
+        # ? The search keeps the best score of the batch, so a bound is only useful if it can fall below it
+        floor = max([bound_floor] + scores) if bound_floor is not None and scores else bound_floor
+        for c, table in zip(missing, tables):
+            bounds[candidates[c]] = score_upper_bound(table, r[xi], floor)
+    return scores
+
+def count_parent_sets(n_candidates, max_parents):
+    """
+    The number of parent sets of at most max_parents nodes among n_candidates (the empty set included).
+    """
+    return sum(math.comb(n_candidates, size) for size in range(min(max_parents, n_candidates) + 1))
+
+
 def Pred(xi, nodes):
     """
     Returns all precedent nodes  a node xi.
@@ -165,7 +1375,113 @@ def Pred(xi, nodes):
     temp_nodes.sort(reverse=True) # Sort in reverse order to get the topological order [xi-1, ..., 1, 0]
     return temp_nodes
 
-def k2_algorithm(upper_bound, nodes, data, r, V):
+def ordering_predecessors(xi, ordering):
+    """
+    Returns the nodes that come before xi in an ordering, closest first (as Pred does for the order of the IDs).
+
+    Parameters:
+        xi (int): The ID of the node.
+        ordering (list of int): The IDs of all the nodes, in topological order.
+
+    Returns:
+        list: The IDs of the predecessors of xi, from the closest to the first node of the ordering.
+    """
+    position = list(ordering).index(xi)
+    return [int(z) for z in reversed(ordering[:position])]
+
+
+def node_predecessors(xi, nodes, ordering=None, candidate_pools=None):
+    """
+    Returns the candidate parents of a node, in the order the search tries them: its predecessors (Pred, or
+    ordering_predecessors with an ordering), restricted to its candidate pool if it has one.
+
+    Parameters:
+        xi (int): The ID of the node.
+        nodes (list of dict): The nodes of the network.
+        ordering (list of int): The topological order of the node IDs, defaults to the order of the IDs.
+        candidate_pools (dict): Optional candidate parents of each node ID. The nodes missing from it keep all
+            their predecessors.
+
+    Returns:
+        list of int: The IDs of the candidate parents of xi.
+    """
+    predecessors = Pred(xi, nodes) if ordering is None else ordering_predecessors(xi, ordering)
+    if candidate_pools is not None and xi in candidate_pools:
+        pool = set(candidate_pools[xi])
+        predecessors = [z for z in predecessors if z in pool]
+    return predecessors
+
+
+def seed_parents(nodes, initial_parents, upper_bound, ordering=None):
+    """
+    Writes a prior parent set in the nodes, to warm-start the K2 search from it (e.g. the structure learned on
+    older data, or a graph drawn by a domain expert). Every prior set is checked first: its parents must be
+    predecessors of the node in the ordering, appear once, and be at most upper_bound.
+
+    Parameters:
+        nodes (list of dict): The nodes of the network, whose 'parents' are replaced in place.
+        initial_parents (dict): The prior parent set of each node ID. The nodes missing from it keep their parents.
+        upper_bound (int): The maximum number of parents allowed for any node.
+        ordering (list of int): The topological order of the node IDs, defaults to the order of the IDs (as Pred).
+
+    Returns:
+        None
+    """
+    ids = set(node["id"] for node in nodes)
+    unknown = set(initial_parents) - ids
+    if unknown:
+        raise ValueError(f"initial_parents refers to unknown nodes {sorted(unknown)}")
+    for node in nodes:
+        if node["id"] not in initial_parents:
+            continue
+        parents = [int(z) for z in initial_parents[node["id"]]]
+        predecessors = node_predecessors(node["id"], nodes, ordering)
+        if len(set(parents)) != len(parents):
+            raise ValueError(f"The prior parents of node {node['id']} are repeated: {parents}")
+        if len(parents) > upper_bound:
+            raise ValueError(f"Node {node['id']} has {len(parents)} prior parents, more than the upper bound {upper_bound}")
+        invalid = [z for z in parents if z not in predecessors]
+        if invalid:
+            raise ValueError(f"The prior parents {invalid} of node {node['id']} do not come before it in the ordering")
+    for node in nodes:
+        if node["id"] in initial_parents:
+            node["parents"][:] = [int(z) for z in initial_parents[node["id"]]] # Written once every set is valid
+
+
+def network_score(nodes, data, r, V, backend=None, cache=None):
+    """
+    Computes the log score of a whole network: the sum of the Cooper-Herskovits scores of its families.
+
+    Parameters:
+        nodes (list of dict): The nodes of the network, with their 'id' and 'parents'.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Optional cache of family scores; after a search all the families are in it.
+
+    Returns:
+        float: The score of the network.
+    """
+    scores = [cooper_herkovits_score(node["id"], node["parents"], data, r, V, backend, cache) for node in nodes]
+    if all(isinstance(score, float) for score in scores):
+        return math.fsum(scores)
+    return sum(scores)
+
+
+def adjacency_matrix(nodes):
+    """
+    Returns the adjacency matrix of a network whose node IDs are 0..n-1: entry [z, i] is 1 if z is a parent of i.
+    """
+    matrix = np.zeros((len(nodes), len(nodes)), dtype=np.int64)
+    for node in nodes:
+        matrix[node["parents"], node["id"]] = 1
+    return matrix
+
+
+def k2_algorithm(upper_bound, nodes, data, r, V, backend=None, cache=None, code_cache_bytes=64 * 2**20, prune=False, stats=None,
+                 candidate_pools=None, pairwise_tables=None, lazy=False, ordering=None, exact=False, deduplicate=False,
+                 initial_parents=None, removal=False, adtree=None):
     """
     Executes the K2 algorithm to find the best parent set for each node in the Bayesian network.
     The algorithm tries to maximize the Cooper-Herskovits score by adding parents until the upper bound is reached.
@@ -173,35 +1489,391 @@ def k2_algorithm(upper_bound, nodes, data, r, V):
     Parameters:
         upper_bound (int): The maximum number of parents allowed for any node.
         nodes (list of dict): A list of nodes in the Bayesian network, each represented as a dictionary with 'id' and 'parents'.
-        data (pd.DataFrame): The dataset containing the values of the nodes.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
         r (list of int): The number of possible values for each node.
         V (list of list of int): The possible values for each node.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Cache of family scores, a new one is used if not given.
+            Passing the same cache to several runs on the same dataset reuses their scores,
+            and its counters can be read with cache.stats() after the run.
+        code_cache_bytes (int): Memory budget of the per-row parent instantiation codes kept during the search.
+        prune (bool): Skip the candidates whose score upper bound cannot beat the current score (see learn_parents).
+            The learned structure is the same as without pruning. The bound only prunes the nodes that some
+            parent set nearly determines, or small samples (see score_upper_bound).
+        stats (dict): Optional, the counters "evaluated" and "pruned" of the candidate families are added to it.
+        candidate_pools (dict): Optional candidate parents of each node ID (as returned by screen_candidates),
+            which restrict its predecessors. The nodes missing from it keep all their predecessors.
+        pairwise_tables (PairwiseTables): The tables of all the pairs of nodes, which serve the first greedy step
+            of every node without passing over the data. When None they are built with one sweep over the rows,
+            if their count matrix fits in PAIRWISE_TABLE_LIMIT cells; False disables them.
+        lazy (bool): Use the lazy greedy search (learn_parents_lazy), which scores fewer candidates but is only
+            approximate for this score. stats then also gets "saved", the evaluations avoided for each node.
+        ordering (list of int): The topological order of the node IDs, defaults to the order of the IDs.
+            The candidates of a node are the nodes before it, closest first.
+        exact (bool): Find the best parent set of each node among all the subsets of its candidates of at most
+            upper_bound nodes (exact_parents) instead of the greedy search. stats then counts the subsets
+            "evaluated" and "pruned". A ValueError is raised before any search if a node has more than
+            MAX_EXACT_PARENT_SETS such subsets, or if prune, lazy, removal or initial_parents is also given:
+            they only apply to the greedy search.
+        deduplicate (bool): Count over the distinct rows of the dataset, weighted by their multiplicities
+            (EncodedDataset.deduplicate), so the cost of the search grows with the distinct rows, not the samples.
+            The learned structure is the same.
+        initial_parents (dict): Optional prior parent set of each node ID, to warm-start the search from (see
+            seed_parents). The greedy search continues from it, so a good prior needs far fewer evaluations.
+        removal (bool): Also remove the parents that lower the score (see learn_parents), e.g. the parents of a
+            warm start that the data no longer supports.
+        adtree (ADTree or bool): Count the families with an AD-tree of the dataset instead of passing over the
+            rows, in place of the pairwise tables. True builds one with the default leaf_threshold.
         
     Returns:
         None
     """
 
+    if exact:
+        greedy_options = {"prune": prune, "lazy": lazy, "removal": removal, "initial_parents": initial_parents is not None}
+        unsupported = [name for name, given in greedy_options.items() if given]
+        if unsupported:
+            raise ValueError(f"The exact search does not support {', '.join(unsupported)}")
+    if initial_parents is not None:
+        seed_parents(nodes, initial_parents, upper_bound, ordering)
+    if cache is None:
+        cache = FamilyScoreCache()
+    # ? The codes of the current parent set are kept, so scoring parents_xi + [z] costs one pass over the rows
+    code_cache = ParentCodeCache(code_cache_bytes)
+
+    if not isinstance(data, EncodedDataset):
+        data = EncodedDataset(data, V) # Encoded once, every count of the search reads the integer codes
+    if deduplicate:
+        data = data.deduplicate()
+    log_factorial_table(data.sample_size + int(max(r))) # Built once for the whole dataset, shared by every score
+    if adtree:
+        pairwise_tables = ADTree(data) if adtree is True else adtree # Serves every family, not only the first step
+    elif pairwise_tables is None:
+        pairwise_tables = default_pairwise_tables(data)
+
+    all_predecessors = [node_predecessors(node["id"], nodes, ordering, candidate_pools) for node in nodes]
+    if exact:
+        for node, predecessors in zip(nodes, all_predecessors):
+            check_exact_search(node["id"], predecessors, upper_bound) # Before any node is searched
+
     for i in range(len(nodes)):
         node = nodes[i]  # Get the current node
-        parents_xi = node["parents"] # Get the current parent set
-        xi = node["id"]  # Get the ID of the current node
-        p_old = cooper_herkovits_score(xi, parents_xi, data, r, V) 
+        predecessors = all_predecessors[i]
+        if exact:
+            exact_parents(
+                node["id"], node["parents"], predecessors, upper_bound, data, r, V, backend, cache, code_cache, stats,
+                pairwise_tables or None
+            )
+            continue
+        learn_parents(
+            node["id"], node["parents"], predecessors, upper_bound, data, r, V, backend, cache, code_cache, prune, stats,
+            pairwise_tables or None, lazy, removal
+        )
+
+
+def greedy_candidates(xi, parents_xi, predecessors):
+    """
+    The candidates of a greedy step of node xi: its predecessors that are not parents yet, in their order.
+    """
+    return [z for z in predecessors if z not in parents_xi and z != xi]
+
+
+def best_candidate(candidates, candidate_scores, p_old):
+    """
+    The candidate of a greedy step whose score improves p_old the most. Only a strictly better score replaces
+    the best one, so ties go to the first candidate, in the order of the predecessors.
+
+    Returns:
+        tuple: (best_z, p_old), the best candidate (None if no candidate improves p_old) and the best score.
+    """
+    best_z = None
+    for z, p_new in zip(candidates, candidate_scores):
+        if p_new > p_old: # If the new score is better than the old score
+            p_old = p_new
+            best_z = z
+    return best_z, p_old
+
+
+def learn_parents(xi, parents_xi, predecessors, upper_bound, data, r, V, backend=None, cache=None, code_cache=None,
+                  prune=False, stats=None, pairwise_tables=None, lazy=False, removal=False, score_families=None):
+    """
+    Runs the greedy search of the K2 algorithm for a single node: the predecessor that increases the score
+    the most is added to the parent set, until no predecessor improves it or the upper bound is reached.
+    The search of a node does not depend on the parents found for the other nodes.
+
+    Parameters:
+        xi (int): The ID of the node.
+        parents_xi (list of int): The current parent set of xi, extended in place.
+        predecessors (list of int): The candidate parents, in the order they are tried (as returned by Pred).
+        upper_bound (int): The maximum number of parents allowed.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Optional cache of family scores.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        prune (bool): Skip the candidates z whose score upper bound (score_upper_bound) is below the current score.
+            The bound of parents_xi + [z] found when z was last counted still holds for all the later, larger
+            parent sets with z, so such candidates can never be the best one and the parents found are the same.
+            The bounds that cannot fall below the best score of their step are not computed (see score_upper_bound).
+        stats (dict): Optional, the counters "evaluated" and "pruned" of the candidate families are added to it.
+        pairwise_tables (PairwiseTables or ADTree): Optional precomputed tables of the dataset, used for the
+            families they can serve (with PairwiseTables, while the parent set has at most one node).
+        lazy (bool): Run the lazy greedy search of learn_parents_lazy instead, which is approximate.
+        removal (bool): When no predecessor improves the score, also try to remove each parent, drop the one
+            that improves the score the most and resume the search. stats then also counts the parents "removed".
+        score_families (callable): Optional function that scores the families of xi in place of
+            cooper_herkovits_scores, for the learners that keep their own counts (e.g. IncrementalK2): it takes a
+            list of parent sets and returns their scores. data, cache, code_cache and pairwise_tables are then
+            not used. Pruning and the lazy search need the dataset, so they are not supported with it.
+
+    Returns:
+        list of int: parents_xi, with the parents added (and removed) by the search.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("evaluated", 0)
+    stats.setdefault("pruned", 0)
+    if removal:
+        stats.setdefault("removed", 0)
+    if score_families is not None and (prune or lazy):
+        raise ValueError("Pruning and the lazy greedy search do not support a custom score_families")
+    if lazy:
+        if prune:
+            raise ValueError("The lazy greedy search does not support pruning")
+        if removal:
+            raise ValueError("The lazy greedy search does not support the removal check")
+        return learn_parents_lazy(
+            xi, parents_xi, predecessors, upper_bound, data, r, V, backend, cache, code_cache, stats, pairwise_tables
+        )
+
+    score_sets = score_families
+    if score_sets is None:
+        def score_sets(parent_sets):
+            return [
+                cooper_herkovits_score(xi, parents, data, r, V, backend, cache, code_cache, pairwise_tables)
+                for parents in parent_sets
+            ]
+
+    p_old = score_sets([parents_xi])[0]
+    bounds = {} if prune else None # Last known bound of parents_xi + [z], for each candidate z
+    parents_bound = family_upper_bound(xi, parents_xi, data, r, V, code_cache, pairwise_tables, p_old) if prune else None
+    while True:
         OkToProceed = True 
         while OkToProceed and len(parents_xi) < upper_bound:
-            best_z = None # Initialize the best parent to None
-            predecessors = Pred(xi, nodes) # Get the predecessors of the node in the topological order
-            for z in predecessors:
-                # ? z is the candidate parent node from the predecessors in the topological order
-                if z in parents_xi or z == xi:
-                    continue
-                new_parents = parents_xi + [z] # Add z to the parent set
-                p_new = cooper_herkovits_score(xi, new_parents, data, r, V) 
-
-                if p_new > p_old: # If the new score is better than the old score 
-                    p_old = p_new 
-                    best_z = z 
+            # ? z is the candidate parent node from the predecessors in the topological order
+            candidates = greedy_candidates(xi, parents_xi, predecessors)
+            if prune:
+                # ? p_old only grows during the step, so a candidate that cannot beat it now cannot win later either
+                kept = [z for z in candidates if _can_improve(min(parents_bound, bounds.get(z, math.inf)), p_old)]
+                stats["pruned"] += len(candidates) - len(kept)
+                candidates = kept
+            stats["evaluated"] += len(candidates)
+            if score_families is None:
+                # ? All the extensions parents_xi + [z] are scored by one batched call, with a single sweep over the rows
+                candidate_scores = cooper_herkovits_scores(
+                    xi, parents_xi, candidates, data, r, V, backend, cache, code_cache, bounds, pairwise_tables,
+                    p_old if prune else None
+                )
+            else:
+                candidate_scores = score_families([parents_xi + [z] for z in candidates])
+            best_z, p_old = best_candidate(candidates, candidate_scores, p_old)
 
             if best_z is not None: # If a better parent was found
                 parents_xi.append(best_z) 
+                if prune:
+                    # ? The bound of the new parent set was computed with its score, unless the score came from the cache
+                    parents_bound = bounds[best_z] if best_z in bounds else family_upper_bound(
+                        xi, parents_xi, data, r, V, code_cache, pairwise_tables, p_old
+                    )
             else:
                 OkToProceed = False 
+
+        if not removal or not parents_xi:
+            break
+        # ? Removal check: a parent that lowers the score (e.g. one of a warm start) is dropped, then the search
+        # ? adds parents again. Every change increases the score, so the search cannot cycle
+        stats["evaluated"] += len(parents_xi)
+        reduced = [[p for p in parents_xi if p != z] for z in parents_xi]
+        worst_z, p_old = best_candidate(list(parents_xi), score_sets(reduced), p_old)
+        if worst_z is None:
+            break
+        parents_xi.remove(worst_z)
+        stats["removed"] += 1
+        if prune:
+            # ? The known bounds hold for the supersets of the old parent set only
+            bounds.clear()
+            parents_bound = family_upper_bound(xi, parents_xi, data, r, V, code_cache, pairwise_tables, p_old)
+    return parents_xi
+
+
+def learn_parents_lazy(xi, parents_xi, predecessors, upper_bound, data, r, V, backend=None, cache=None, code_cache=None,
+                       stats=None, pairwise_tables=None):
+    """
+    Lazy greedy variant of learn_parents. The gains score(parents_xi + [z]) - score(parents_xi) of the first
+    step are kept in a max-heap; at every later step only the candidate on top is scored again, until the
+    refreshed gain of the top candidate is still the largest one, and that candidate is added. The search
+    stops when the gain on top (refreshed or not) does not improve the score.
+
+    This is only approximate for the Cooper-Herskovits score: lazy evaluation is exact when the gains can only
+    shrink as the parent set grows (a submodular score), but this score is not submodular, so a stale gain is
+    not an upper bound of the current one. A candidate whose gain grew since it was last scored can be missed,
+    and the parents found may differ from the ones of learn_parents.
+
+    Parameters:
+        xi (int): The ID of the node.
+        parents_xi (list of int): The current parent set of xi, extended in place.
+        predecessors (list of int): The candidate parents, in the order they are tried (as returned by Pred).
+        upper_bound (int): The maximum number of parents allowed.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Optional cache of family scores.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        stats (dict): Optional, the counter "evaluated" is added to it, and "saved" maps xi to the number of
+            evaluations avoided with respect to rescanning every candidate at each step.
+        pairwise_tables (PairwiseTables or ADTree): Optional precomputed tables of the dataset.
+
+    Returns:
+        list of int: parents_xi, with the parents added by the search.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("evaluated", 0)
+    saved = stats.setdefault("saved", {})
+    saved[xi] = 0
+
+    p_old = cooper_herkovits_score(xi, parents_xi, data, r, V, backend, cache, code_cache, pairwise_tables)
+    candidates = greedy_candidates(xi, parents_xi, predecessors)
+    if len(parents_xi) >= upper_bound or not candidates:
+        return parents_xi
+
+    # ? The first step scores every candidate, as the exact search does
+    candidate_scores = cooper_herkovits_scores(
+        xi, parents_xi, candidates, data, r, V, backend, cache, code_cache, None, pairwise_tables
+    )
+    stats["evaluated"] += len(candidates)
+    # ? Entries (-gain, position in the candidates, z, score, step of the score): equal gains are popped in the
+    # ? order of the candidates, so ties are broken as in learn_parents
+    heap = [(-(score - p_old), c, z, score, 0) for c, (z, score) in enumerate(zip(candidates, candidate_scores))]
+    heapq.heapify(heap)
+
+    step = 0
+    while heap and len(parents_xi) < upper_bound:
+        remaining = len(heap) # The candidates a full rescan of this step would score
+        evaluated = 0
+        while True:
+            negative_gain, c, z, score, scored_at = heap[0]
+            if negative_gain >= 0 or scored_at == step:
+                break # No improvement on top, or a fresh gain still on top
+            score = cooper_herkovits_score(xi, parents_xi + [z], data, r, V, backend, cache, code_cache, pairwise_tables)
+            evaluated += 1
+            heapq.heapreplace(heap, (-(score - p_old), c, z, score, step))
+
+        if step > 0:
+            stats["evaluated"] += evaluated
+            saved[xi] += remaining - evaluated
+        if negative_gain >= 0:
+            break # The best known gain does not improve the score
+        heapq.heappop(heap)
+        parents_xi.append(z)
+        p_old = score
+        step += 1
+    return parents_xi
+
+
+def check_exact_search(xi, predecessors, upper_bound):
+    """
+    Raises a ValueError if exact_parents would enumerate more than MAX_EXACT_PARENT_SETS parent sets of xi.
+
+    Parameters:
+        xi (int): The ID of the node.
+        predecessors (list of int): The candidate parents of xi.
+        upper_bound (int): The maximum number of parents allowed.
+    """
+    n_sets = count_parent_sets(len([z for z in predecessors if z != xi]), upper_bound)
+    if n_sets > MAX_EXACT_PARENT_SETS:
+        raise ValueError(
+            f"The exact search of node {xi} would enumerate {n_sets} parent sets (more than {MAX_EXACT_PARENT_SETS}): "
+            "lower upper_bound or restrict the candidates with candidate_pools"
+        )
+
+
+def exact_parents(xi, parents_xi, predecessors, upper_bound, data, r, V, backend=None, cache=None, code_cache=None,
+                  stats=None, pairwise_tables=None):
+    """
+    Finds the highest-scoring parent set of xi among all the subsets of its predecessors of at most upper_bound
+    nodes, by branch and bound over the lattice of the parent sets, visited by increasing size.
+    Every scored set S also gets the bound score_upper_bound(S) on the score of all its supersets. A set whose
+    bound cannot beat the best score found is dead, and so are all its supersets: a set of size k + 1 is only
+    scored when all its subsets of size k are alive, so the enumeration stops as soon as the bounds allow it.
+    The bound only kills sets of nodes that are nearly determined by their parents, or on small samples (see
+    score_upper_bound): with many samples of noisy nodes almost every subset is scored, so the search refuses
+    to enumerate more than MAX_EXACT_PARENT_SETS parent sets.
+
+    Parameters:
+        xi (int): The ID of the node.
+        parents_xi (list of int): The parent set of xi, replaced in place by the best one.
+        predecessors (list of int): The candidate parents. Among equally good sets, the smallest one first
+            found in the order of predecessors is kept.
+        upper_bound (int): The maximum number of parents allowed.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Optional cache of family scores.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        stats (dict): Optional, the counters "evaluated" (subsets scored) and "pruned" (subsets of at most
+            upper_bound predecessors never scored) are added to it.
+        pairwise_tables (PairwiseTables or ADTree): Optional precomputed tables of the dataset.
+
+    Returns:
+        list of int: parents_xi, the best parent set.
+
+    Raises:
+        ValueError: If there are more than MAX_EXACT_PARENT_SETS subsets of at most upper_bound predecessors.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("evaluated", 0)
+    stats.setdefault("pruned", 0)
+    predecessors = [z for z in predecessors if z != xi]
+    check_exact_search(xi, predecessors, upper_bound)
+
+    best_score = cooper_herkovits_score(xi, [], data, r, V, backend, cache, code_cache, pairwise_tables)
+    best_set = ()
+    evaluated = 1
+    # ? The sets of a layer are tuples of positions in predecessors, increasing, so each set is generated once
+    alive = {(): family_upper_bound(xi, [], data, r, V, code_cache, pairwise_tables)}
+    for size in range(1, min(upper_bound, len(predecessors)) + 1):
+        layer = {}
+        for positions, bound in alive.items():
+            if not _can_improve(bound, best_score):
+                continue # Killed by a better score found after its layer was filtered
+            extensions = [
+                p for p in range(positions[-1] + 1 if positions else 0, len(predecessors))
+                # ? Lattice pruning: every subset of size - 1 of the new set must be alive
+                if all(positions[:i] + positions[i + 1:] + (p,) in alive for i in range(len(positions)))
+            ]
+            parents = [predecessors[p] for p in positions]
+            bounds = {}
+            scores = cooper_herkovits_scores(
+                xi, parents, [predecessors[p] for p in extensions], data, r, V, backend, cache, code_cache, bounds,
+                pairwise_tables
+            )
+            evaluated += len(extensions)
+            for p, score in zip(extensions, scores):
+                z = predecessors[p]
+                if score > best_score:
+                    best_score, best_set = score, positions + (p,)
+                # ? A score served by the cache has no table, its bound falls back to the one of its subset
+                layer[positions + (p,)] = bounds.get(z, bound)
+        alive = {positions: bound for positions, bound in layer.items() if _can_improve(bound, best_score)}
+        if not alive:
+            break
+
+    stats["evaluated"] += evaluated
+    stats["pruned"] += count_parent_sets(len(predecessors), upper_bound) - evaluated
+    parents_xi[:] = [predecessors[p] for p in best_set]
+    return parents_xi
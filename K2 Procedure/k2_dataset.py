@@ -0,0 +1,338 @@
+import atexit
+import copy
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+
+def code_dtype(cardinalities):
+    """
+    The smallest unsigned integer type that holds the codes of columns with the given cardinalities, so no code
+    ever wraps around.
+    """
+    largest = int(np.max(cardinalities, initial=0))
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if largest <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+class EncodedDataset:
+    """
+    Dictionary encoding of a dataset: every column is mapped once to small integer codes, where the code of a
+    value is its position in V (so the codes of node i go from 0 to r_i - 1). The codes are stored column-major
+    in a single uint8 matrix (uint16 or uint32 for columns with more values, see code_dtype), so selecting a
+    column is a free view and comparing values is an integer comparison instead of a float one.
+
+    Values found in the data but missing from V are not lost: they get the codes r_i, r_i + 1, ... in order of
+    first appearance, so they still form their own parent instantiations (as in the DataFrame) but are never
+    counted as a value of the node itself.
+
+    A dataset can also be weighted, where row t stands for weights[t] samples: with_weights() gives a weighted
+    view (e.g. a bootstrap replicate) and deduplicate() keeps each distinct row once, weighted by its multiplicity.
+    All the counts of k2_core honor the weights.
+
+    Parameters:
+        data (pd.DataFrame): The dataset containing the values of the nodes.
+        V (list of list): The possible values for each node.
+    """
+
+    def __init__(self, data, V):
+        if data.shape[1] != len(V):
+            raise ValueError(f"The dataset has {data.shape[1]} columns but V describes {len(V)} nodes")
+
+        self.columns = list(data.columns)
+        self.V = [list(values) for values in V]
+        self.r = np.array([len(values) for values in V])
+        self.categories = [] # Values of each column, indexed by code: V[i] followed by the values missing from V
+        self.weights = None # Number of samples each row stands for, None if every row is a single sample
+        self._source = weakref.ref(data)
+
+        columns_codes = []
+        for i in range(data.shape[1]):
+            column = data.iloc[:, i].to_numpy()
+            codes = pd.Index(self.V[i]).get_indexer(column) # Position of each value in V, -1 if missing
+            categories = list(self.V[i])
+            missing = codes < 0
+            if missing.any():
+                # ? Values outside of V get codes after the ones of V, numbered by first appearance
+                extra_codes, extra_values = pd.factorize(column[missing], use_na_sentinel=False)
+                codes[missing] = len(categories) + extra_codes
+                categories.extend(extra_values)
+            self.categories.append(categories)
+            columns_codes.append(codes)
+
+        self.cardinalities = np.array([len(categories) for categories in self.categories])
+        dtype = code_dtype(self.cardinalities)
+        self.codes = np.empty((len(data), len(self.columns)), dtype=dtype, order="F") # Column-major
+        for i, codes in enumerate(columns_codes):
+            self.codes[:, i] = codes
+
+    @classmethod
+    def from_codes(cls, codes, columns, V, categories):
+        """
+        Builds an EncodedDataset around an existing matrix of codes, without copying it.
+
+        Parameters:
+            codes (np.ndarray): The (rows x columns) matrix of codes.
+            columns (list): The names of the columns.
+            V (list of list): The possible values for each node.
+            categories (list of list): The values of each column, indexed by code.
+
+        Returns:
+            EncodedDataset: The dataset, whose codes are the given matrix.
+        """
+        dataset = cls.__new__(cls)
+        dataset.columns = list(columns)
+        dataset.V = [list(values) for values in V]
+        dataset.r = np.array([len(values) for values in V])
+        dataset.categories = [list(values) for values in categories]
+        dataset.cardinalities = np.array([len(values) for values in categories])
+        dataset.codes = codes
+        dataset.weights = None
+        dataset._source = None
+        return dataset
+
+    def with_weights(self, weights):
+        """
+        Returns a weighted view of the dataset, sharing its codes: row t stands for weights[t] samples
+        (e.g. a bootstrap replicate, where the weights are how many times each row was drawn).
+
+        Parameters:
+            weights (np.ndarray): One non-negative integer weight per row, or None for the unweighted dataset.
+
+        Returns:
+            EncodedDataset: The weighted dataset.
+        """
+        dataset = copy.copy(self)
+        if weights is not None:
+            weights = np.asarray(weights)
+            if weights.shape != (len(self),):
+                raise ValueError(f"Expected {len(self)} weights, got an array of shape {weights.shape}")
+            if not np.issubdtype(weights.dtype, np.integer) and not np.array_equal(weights, np.round(weights)):
+                raise ValueError("The weights must be integers")
+            if (weights < 0).any():
+                raise ValueError("The weights must be non-negative")
+            weights = weights.astype(np.int64)
+        dataset.weights = weights
+        return dataset
+
+    def deduplicate(self):
+        """
+        Returns the compressed form of the dataset: each distinct row once, in order of first appearance, weighted
+        by its multiplicity (the sum of the weights of its copies, if the dataset is already weighted). Every count
+        on the result is the same as on the full dataset, so the instantiations are also found in the same order.
+        Rows with weight 0 stand for no sample and are dropped.
+
+        Returns:
+            EncodedDataset: The distinct rows with their weights.
+        """
+        n_columns = self.codes.shape[1]
+        # ? Each row of codes is seen as a single opaque value of n_columns * itemsize bytes, so np.unique finds the distinct rows
+        rows = np.ascontiguousarray(self.codes).view(np.dtype((np.void, self.codes.dtype.itemsize * n_columns))).ravel()
+        _, first_rows, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        order = np.argsort(first_rows) # np.unique sorts the rows by value, they are put back in order of first appearance
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        inverse = rank[inverse.ravel()]
+
+        if self.weights is None:
+            multiplicities = np.bincount(inverse, minlength=len(order))
+        else:
+            multiplicities = np.rint(np.bincount(inverse, weights=self.weights, minlength=len(order))).astype(np.int64)
+        kept = multiplicities > 0
+        codes = np.asfortranarray(self.codes[first_rows[order]][kept])
+        dataset = EncodedDataset.from_codes(codes, self.columns, self.V, self.categories)
+        return dataset.with_weights(multiplicities[kept].astype(np.int64))
+
+    def __getstate__(self):
+        # ? The reference to the source DataFrame cannot be pickled, a copy sent to another process has no source
+        state = self.__dict__.copy()
+        state["_source"] = None
+        return state
+
+    @property
+    def source(self):
+        """
+        The DataFrame the dataset was encoded from, or None if it no longer exists.
+        """
+        return self._source() if self._source is not None else None
+
+    @property
+    def sample_size(self):
+        """
+        The number of samples in the dataset: the sum of the weights, or the number of rows if it is unweighted.
+        """
+        return len(self) if self.weights is None else int(self.weights.sum())
+
+    @property
+    def nbytes(self):
+        """
+        The size in bytes of the encoded values.
+        """
+        return self.codes.nbytes
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def column(self, i):
+        """
+        Returns the codes of the i-th column (a view, no copy is made).
+        """
+        return self.codes[:, i]
+
+    def code_of(self, i, value):
+        """
+        Returns the code of a value of the i-th column, or -1 if the value never appears in it nor in V.
+        """
+        for code, category in enumerate(self.categories[i]):
+            if category == value:
+                return code
+        return -1
+
+    def decode(self, columns):
+        """
+        Returns the original values of some columns.
+
+        Parameters:
+            columns (list of int): The IDs of the columns to decode.
+
+        Returns:
+            pd.DataFrame: The values of the selected columns, with their original names.
+        """
+        return pd.DataFrame({
+            self.columns[i]: np.asarray(self.categories[i], dtype=object)[self.column(i)] for i in columns
+        }, columns=[self.columns[i] for i in columns])
+
+
+# ? Shared memory segments attached by this process, kept open while their arrays are in use
+_attached_segments = {}
+
+
+class SharedDatasetHandle:
+    """
+    Small, picklable description of a dataset published by SharedDataset. It is what is sent to the worker
+    processes, which call attach() to get the dataset back as a view on the shared memory, without copies.
+    """
+
+    def __init__(self, name, shape, dtype, columns, V=None, categories=None, weights=None):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.columns = columns
+        self.V = V
+        self.categories = categories
+        self.weights = weights # Row weights of a weighted EncodedDataset, sent along with the handle
+
+    @property
+    def encoded(self):
+        """
+        True if the published dataset is an EncodedDataset, False if it is a raw DataFrame.
+        """
+        return self.categories is not None
+
+    def attach(self):
+        """
+        Maps the shared memory segment in this process.
+
+        Returns:
+            EncodedDataset or pd.DataFrame: The published dataset, backed by the shared memory (read-only).
+        """
+        segment = _attached_segments.get(self.name)
+        if segment is None:
+            segment = shared_memory.SharedMemory(name=self.name)
+            _attached_segments[self.name] = segment
+        values = np.ndarray(self.shape, dtype=self.dtype, buffer=segment.buf, order="F")
+        values.flags.writeable = False
+        if self.encoded:
+            return EncodedDataset.from_codes(values, self.columns, self.V, self.categories).with_weights(self.weights)
+        return pd.DataFrame(values, columns=self.columns, copy=False)
+
+    def detach(self):
+        """
+        Closes the mapping of the segment in this process. The arrays obtained from attach() must not be used afterwards.
+        """
+        segment = _attached_segments.pop(self.name, None)
+        if segment is not None:
+            _close_segment(segment)
+
+
+def _close_segment(segment):
+    try:
+        segment.close()
+    except BufferError:
+        pass # Arrays still point to the segment, the mapping is released when the process exits
+
+
+@atexit.register
+def _detach_all():
+    for segment in _attached_segments.values():
+        _close_segment(segment)
+    _attached_segments.clear()
+
+
+def _release_segment(segment):
+    _close_segment(segment)
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass # Already released
+
+
+class SharedDataset:
+    """
+    Publishes a dataset once into a multiprocessing.shared_memory segment, so that worker processes can attach
+    NumPy views of it instead of receiving a pickled copy each.
+
+    An EncodedDataset is published as its matrix of codes, its row weights (if any) travel with the handle.
+    A DataFrame is published raw, as a single column-major matrix of the common dtype of its columns
+    (so integer and float columns become float64). A DataFrame with non-numeric columns cannot be published raw,
+    since an object array only holds pointers into the memory of this process: encode it first.
+
+    The segment belongs to the SharedDataset: it is released by close(), when leaving a with block (also on
+    errors), when the object is garbage collected, or at the latest when the interpreter exits.
+
+    Parameters:
+        data (EncodedDataset or pd.DataFrame): The dataset to publish.
+    """
+
+    def __init__(self, data):
+        if isinstance(data, EncodedDataset):
+            values = data.codes
+            metadata = dict(V=data.V, categories=data.categories, weights=data.weights)
+        else:
+            values = data.to_numpy()
+            if values.dtype.hasobject:
+                raise TypeError(
+                    "A DataFrame with non-numeric columns cannot be shared raw: pass an EncodedDataset instead"
+                )
+            metadata = {}
+
+        self._segment = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self._finalizer = weakref.finalize(self, _release_segment, self._segment)
+        try:
+            shared = np.ndarray(values.shape, dtype=values.dtype, buffer=self._segment.buf, order="F")
+            shared[:] = values
+            del shared # No array may keep pointing to the buffer, or the segment could not be closed
+        except BaseException:
+            self.close()
+            raise
+        self.handle = SharedDatasetHandle(self._segment.name, values.shape, values.dtype, list(data.columns), **metadata)
+
+    @property
+    def name(self):
+        return self.handle.name
+
+    def close(self):
+        """
+        Releases the shared memory segment. Calling it more than once has no effect.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
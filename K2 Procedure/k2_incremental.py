@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+import k2_core
+from k2_core import DENSE_TABLE_LIMIT, learn_parents, log_factorial_table, node_predecessors, score_from_counts
+from k2_dataset import EncodedDataset, code_dtype
+from k2_streaming import STREAM_TABLE_CELLS, TableAccumulator
+
+
+class IncrementalK2:
+    """
+    A K2 learner for a dataset that grows over time. It keeps, between two calls of append:
+        - the sufficient statistics of the data: its distinct rows with their multiplicities (see
+          EncodedDataset.deduplicate), to which the new rows are added in O(new rows);
+        - the tables of counts of the families scored by the last search, which are updated with the new rows only.
+    The greedy search is then run again: the families it already visited are scored from their updated tables,
+    without counting the old rows again, and only the families it reaches for the first time are counted, over
+    the distinct rows. The search is replayed from the empty parent sets, so the learned structure is always the
+    one k2_algorithm would learn from all the rows seen so far.
+
+    The counters of the learner are in stats: "rows" (seen so far), "counted" (families counted over the distinct
+    rows), "updated" (stored tables updated with new rows) and "evaluated" (candidate families scored).
+
+    Parameters:
+        upper_bound (int): The maximum number of parents allowed for any node.
+        nodes (list of dict): The nodes of the network, whose parents are written in place by every append.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        ordering (list of int): The topological order of the node IDs, as in k2_algorithm.
+        candidate_pools (dict): Optional candidate parents of each node ID, as in k2_algorithm.
+        max_cells (int): Memory budget of the stored tables, in cells. The families visited once it is full are
+            counted over the distinct rows every time the search needs them.
+    """
+
+    def __init__(self, upper_bound, nodes, r, V, backend=None, ordering=None, candidate_pools=None,
+                 max_cells=STREAM_TABLE_CELLS):
+        self.upper_bound = upper_bound
+        self.nodes = nodes
+        self.r = r
+        self.V = [list(values) for values in V]
+        self.backend = k2_core.SCORE_BACKEND if backend is None else backend
+        self.max_cells = max_cells
+        self.categories = [list(values) for values in self.V]
+        self.columns = None
+        self.data = None # The distinct rows seen so far, weighted by their multiplicities
+        self.stats = {"rows": 0, "counted": 0, "updated": 0, "evaluated": 0}
+
+        self._row_index = {} # Bytes of a distinct row (as int64) -> its position in the codes
+        self._codes = np.zeros((0, len(V)), dtype=np.uint8, order="F") # Column-major, its first rows are a dataset
+        self._weights = np.zeros(0, dtype=np.int64)
+        self._n_distinct = 0
+        self._tables = {} # (xi, sorted parents) -> TableAccumulator, kept up to date by append
+        self._scores = {} # (xi, sorted parents) -> score on the current data, cleared by every append
+        self._used = set() # Families visited by the current search
+        self._cells = 0
+
+        self._predecessors = {node["id"]: node_predecessors(node["id"], nodes, ordering, candidate_pools) for node in nodes}
+
+    def _encode(self, rows):
+        """
+        Encodes new rows with the codes of the rows seen so far, giving new codes to the values never seen.
+
+        Returns:
+            tuple: (codes, changed), the codes of the rows and the columns whose cardinality grew.
+        """
+        if rows.shape[1] != len(self.V):
+            raise ValueError(f"The rows have {rows.shape[1]} columns but V describes {len(self.V)} nodes")
+        if self.columns is None:
+            self.columns = list(rows.columns)
+        codes = np.empty(rows.shape, dtype=np.int64, order="F")
+        changed = []
+        for i in range(rows.shape[1]):
+            column = rows.iloc[:, i].to_numpy()
+            column_codes = pd.Index(self.categories[i]).get_indexer(column)
+            missing = column_codes < 0
+            if missing.any():
+                # ? Values outside of V get the next codes, numbered by first appearance, as in EncodedDataset
+                extra_codes, extra_values = pd.factorize(column[missing], use_na_sentinel=False)
+                column_codes[missing] = len(self.categories[i]) + extra_codes
+                self.categories[i].extend(extra_values)
+                changed.append(i)
+            codes[:, i] = column_codes
+        dtype = code_dtype([len(categories) for categories in self.categories])
+        if np.dtype(dtype).itemsize > self._codes.dtype.itemsize:
+            self._codes = self._codes.astype(dtype, order="F") # Widened when a column outgrows the type, never wrapped around
+        return codes.astype(self._codes.dtype, order="F"), changed
+
+    def _add_distinct(self, codes):
+        """
+        Adds encoded rows to the distinct rows, with one dictionary lookup per distinct new row.
+        """
+        distinct, inverse = np.unique(codes, axis=0, return_inverse=True)
+        multiplicities = np.bincount(inverse.ravel(), minlength=len(distinct))
+        for row, multiplicity in zip(distinct, multiplicities):
+            key = row.astype(np.int64).tobytes() # Independent of the type of the codes, which may be widened
+            position = self._row_index.get(key)
+            if position is None:
+                if self._n_distinct == len(self._codes):
+                    # ? The storage doubles when full, so adding a row costs O(1) amortized
+                    grown = max(2 * len(self._codes), 1024)
+                    storage = np.zeros((grown, codes.shape[1]), dtype=self._codes.dtype, order="F")
+                    storage[:self._n_distinct] = self._codes[:self._n_distinct]
+                    self._codes = storage
+                    self._weights = np.concatenate([self._weights, np.zeros(grown - len(self._weights), np.int64)])
+                position = self._n_distinct
+                self._codes[position] = row
+                self._row_index[key] = position
+                self._n_distinct += 1
+            self._weights[position] += multiplicity
+
+    def _dataset(self, codes, weights=None):
+        # ? The codes are column-major, so the first rows of the storage are a view whose columns are contiguous
+        dataset = EncodedDataset.from_codes(codes, self.columns, self.V, self.categories)
+        dataset.weights = weights # Multiplicities, already int64: with_weights would check and copy all of them
+        return dataset
+
+    def append(self, rows):
+        """
+        Adds new rows to the data and runs the greedy search again.
+
+        Parameters:
+            rows (pd.DataFrame): The new rows, with the columns of the nodes.
+
+        Returns:
+            bool: True if the parent set of any node changed.
+        """
+        codes, changed_columns = self._encode(rows)
+        if changed_columns:
+            # ? A new value changes the cardinality of its column, so the tables where it is a parent are dropped
+            changed_columns = set(changed_columns)
+            for key in [key for key in self._tables if changed_columns.intersection(key[1])]:
+                self._drop(key)
+        self._add_distinct(codes)
+        self.data = self._dataset(self._codes[:self._n_distinct], self._weights[:self._n_distinct]) # Views, no copy
+        self.stats["rows"] += len(rows)
+
+        new_rows = self._dataset(codes)
+        for table in self._tables.values():
+            table.add(new_rows) # O(new rows) for every stored table, the old rows are never read again
+        self.stats["updated"] += len(self._tables)
+        self._cells = sum(table.cells() for table in self._tables.values()) # The sparse tables may have grown
+        while self._cells > self.max_cells:
+            self._drop(next(reversed(self._tables))) # The tables stored last are dropped first
+        # ? Every score depends on the new rows (if only through the sample size), so none of them survives an
+        # ? append: this is intended. The tables are kept up to date instead, and scoring one again is O(cells)
+        self._scores.clear()
+        log_factorial_table(self.data.sample_size + int(max(self.r)))
+
+        previous = [list(node["parents"]) for node in self.nodes]
+        self._used = set()
+        for node in self.nodes:
+            node["parents"][:] = self._learn(node["id"])
+        for key in [key for key in self._tables if key not in self._used]:
+            self._drop(key) # Families the search no longer visits are not kept up to date
+        return any(node["parents"] != parents for node, parents in zip(self.nodes, previous))
+
+    def _drop(self, key):
+        self._cells -= self._tables.pop(key).cells()
+
+    def score(self, xi, parents_xi):
+        """
+        The score of a family on the rows seen so far, from its stored table when there is one.
+        """
+        key = (int(xi), tuple(sorted(int(parent) for parent in parents_xi)))
+        score = self._scores.get(key)
+        if score is not None:
+            return score
+        self._used.add(key)
+        table = self._tables.get(key)
+        if table is None:
+            table = TableAccumulator(xi, key[1], self.data.cardinalities, int(self.r[xi]), DENSE_TABLE_LIMIT)
+            table.add(self.data) # Counted once over the distinct rows, then kept up to date by append
+            self.stats["counted"] += 1
+            # ? Once the budget is full the new tables are not kept: the search visits the families in the same
+            # ? order every time, so evicting the old ones would only make every table be counted again
+            if self._cells + table.cells() <= self.max_cells:
+                self._tables[key] = table
+                self._cells += table.cells()
+        score = score_from_counts(table.table(), self.r[xi], self.backend)
+        self._scores[key] = score
+        return score
+
+    def _learn(self, xi):
+        """
+        The greedy search of learn_parents for node xi, scoring the families with score.
+        """
+        stats = {}
+        parents_xi = learn_parents(
+            xi, [], self._predecessors[xi], self.upper_bound, self.data, self.r, self.V, self.backend, stats=stats,
+            score_families=lambda parent_sets: [self.score(xi, parents) for parents in parent_sets]
+        )
+        self.stats["evaluated"] += stats["evaluated"]
+        return parents_xi
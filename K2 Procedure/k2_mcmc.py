@@ -0,0 +1,216 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from k2_core import (
+    EncodedDataset, FamilyScoreCache, ParentCodeCache, cooper_herkovits_score, cooper_herkovits_scores, count_parent_sets,
+    default_pairwise_tables, log_factorial_table
+)
+
+MAX_PARENT_SETS = 2**20 # Largest number of local scores enumerated by order_mcmc, over all the nodes
+MAX_MCMC_NODES = 62 # The parent sets are bitmasks of the node IDs in an int64
+
+
+def local_score_table(xi, candidates, max_parents, data, r, V, backend=None, cache=None, code_cache=None,
+                      pairwise_tables=None):
+    """
+    Scores every parent set of xi made of at most max_parents candidates.
+    The sets of size k are the extensions of the sets of size k - 1 with a later candidate, so the sets that
+    share the same prefix are scored by a single batched call.
+
+    Parameters:
+        xi (int): The ID of the node.
+        candidates (list of int): The IDs of the possible parents.
+        max_parents (int): The largest parent set scored.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Optional cache of family scores.
+        code_cache (ParentCodeCache): Optional cache of the parent instantiation codes.
+        pairwise_tables (PairwiseTables): Optional precomputed tables of the dataset.
+
+    Returns:
+        tuple: (masks, scores), for every parent set its bitmask (bit z is set if z is a parent) as int64 and
+        its score as float64. The empty set comes first.
+    """
+    masks = [0]
+    scores = [float(cooper_herkovits_score(xi, [], data, r, V, backend, cache, code_cache, pairwise_tables))]
+    layer = [()] # Parent sets of the current size, as tuples of positions in candidates
+    for _ in range(max_parents):
+        next_layer = []
+        for positions in layer:
+            extensions = list(range(positions[-1] + 1 if positions else 0, len(candidates)))
+            extension_scores = cooper_herkovits_scores(
+                xi, [candidates[p] for p in positions], [candidates[p] for p in extensions], data, r, V, backend,
+                cache, code_cache, None, pairwise_tables
+            )
+            mask = sum(1 << candidates[p] for p in positions)
+            for p, score in zip(extensions, extension_scores):
+                next_layer.append(positions + (p,))
+                masks.append(mask | (1 << candidates[p]))
+                scores.append(float(score))
+        layer = next_layer
+    return np.array(masks, dtype=np.int64), np.array(scores, dtype=np.float64)
+
+
+def _logsumexp(values):
+    top = values.max()
+    return top + math.log(np.exp(values - top).sum())
+
+
+class _OrderState:
+    """
+    Per-node sums over the parent sets compatible with an ordering, updated node by node.
+    For node i with predecessors P, the log sum is log(sum over S subset of P of exp(score(i, S))),
+    and the probability of the edge z -> i is the share of that sum given by the sets containing z.
+    """
+
+    def __init__(self, tables, ordering):
+        self.tables = tables
+        self.n = len(tables)
+        self.ordering = list(ordering)
+        self.log_sums = np.zeros(self.n)
+        self.edges = np.zeros((self.n, self.n)) # edges[z, i]: probability of z -> i given the ordering
+        for position in range(self.n):
+            self.update(position)
+
+    def predecessor_mask(self, position):
+        return sum(1 << z for z in self.ordering[:position])
+
+    def node_sum(self, xi, mask):
+        """
+        The log sum of node xi over the parent sets inside mask, with the weights of those sets.
+        """
+        masks, scores, _ = self.tables[xi]
+        compatible = (masks & ~np.int64(mask)) == 0 # The empty set is always compatible
+        log_sum = _logsumexp(scores[compatible])
+        return log_sum, compatible, np.exp(scores[compatible] - log_sum)
+
+    def update(self, position):
+        xi = self.ordering[position]
+        log_sum, compatible, weights = self.node_sum(xi, self.predecessor_mask(position))
+        self.log_sums[xi] = log_sum
+        self.edges[:, xi] = weights @ self.tables[xi][2][compatible]
+
+    def swap_delta(self, position):
+        """
+        The change of the log score of the ordering if the nodes at position and position + 1 were swapped.
+        Only these two nodes change predecessors, so only their sums are computed again.
+        """
+        a, b = self.ordering[position], self.ordering[position + 1]
+        mask = self.predecessor_mask(position)
+        new_a, _, _ = self.node_sum(a, mask | (1 << b))
+        new_b, _, _ = self.node_sum(b, mask)
+        return new_a + new_b - self.log_sums[a] - self.log_sums[b]
+
+    def swap(self, position):
+        self.ordering[position], self.ordering[position + 1] = self.ordering[position + 1], self.ordering[position]
+        self.update(position)
+        self.update(position + 1)
+
+
+def _run_chain(tables, n_samples, burn_in, thin, seed):
+    """
+    Runs one chain of the order MCMC.
+
+    Returns:
+        tuple: (edges, acceptance), the edge marginals averaged over the samples and the share of accepted swaps.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(tables)
+    state = _OrderState(tables, rng.permutation(n))
+    edges = np.zeros((n, n))
+    accepted = 0
+    steps = burn_in + n_samples * thin
+    for step in range(steps):
+        if n > 1:
+            # ? Adjacent swaps are a symmetric proposal, so the acceptance ratio is the ratio of the order scores
+            position = int(rng.integers(0, n - 1))
+            delta = state.swap_delta(position)
+            if delta >= 0 or rng.random() < math.exp(delta):
+                state.swap(position)
+                accepted += 1
+        if step >= burn_in and (step - burn_in) % thin == thin - 1:
+            edges += state.edges
+    return edges / n_samples, accepted / max(steps, 1)
+
+
+def order_mcmc(upper_bound, nodes, data, r, V, n_samples=1000, burn_in=1000, thin=1, n_chains=2, n_jobs=None,
+               seed=None, backend=None, candidate_pools=None, stats=None):
+    """
+    Estimates the posterior probability of every edge with a Markov chain over the orderings of the nodes
+    (order MCMC). Given an ordering, the parent sets of the nodes are independent, so the probability of the
+    ordering is the product over the nodes of the sum of exp(score) over their parent sets of at most
+    upper_bound predecessors. The chains propose swaps of two adjacent nodes, which only changes the sums of
+    these two nodes, and average the edge probabilities of the visited orderings.
+
+    The local scores are computed once (memoized) for every node and every parent set of at most upper_bound
+    candidates, and shared by all the chains, which run in parallel processes.
+
+    Parameters:
+        upper_bound (int): The maximum number of parents of a node.
+        nodes (list of dict): The nodes of the network, whose IDs are 0..n-1.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        n_samples (int): The number of orderings averaged by each chain.
+        burn_in (int): The number of steps of each chain before the first sample.
+        thin (int): The number of steps between two samples.
+        n_chains (int): The number of independent chains, each starting from a random ordering.
+        n_jobs (int): The number of worker processes, defaults to the number of CPUs (at most n_chains).
+            With a single job the chains run in the calling process.
+        seed (int): Seed of the chains.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        candidate_pools (dict): Optional possible parents of each node ID (e.g. from screen_candidates, in any
+            order), to keep the number of parent sets small. By default every other node is a candidate.
+        stats (dict): Optional, receives "chains" (the edge marginals of each chain), "acceptance" (the share of
+            accepted swaps of each chain) and "local_scores" (the number of parent sets scored).
+
+    Returns:
+        np.ndarray: The (n x n) matrix of edge marginals averaged over the chains, entry [z, i] is the
+        posterior probability of the edge z -> i.
+    """
+    n = len(nodes)
+    if n > MAX_MCMC_NODES:
+        raise ValueError(f"order_mcmc supports at most {MAX_MCMC_NODES} nodes, got {n}")
+    candidates = {
+        node["id"]: sorted(z for z in (candidate_pools.get(node["id"], range(n)) if candidate_pools else range(n))
+                           if z != node["id"])
+        for node in nodes
+    }
+    n_sets = sum(count_parent_sets(len(candidates[xi]), upper_bound) for xi in candidates)
+    if n_sets > MAX_PARENT_SETS:
+        raise ValueError(
+            f"order_mcmc would score {n_sets} parent sets (more than {MAX_PARENT_SETS}): "
+            "lower upper_bound or restrict the candidates with candidate_pools"
+        )
+
+    if not isinstance(data, EncodedDataset):
+        data = EncodedDataset(data, V)
+    log_factorial_table(data.sample_size + int(max(r)))
+    cache = FamilyScoreCache(max(n_sets, 1))
+    code_cache = ParentCodeCache()
+    pairwise_tables = default_pairwise_tables(data)
+
+    tables = [None] * n
+    for xi in range(n):
+        masks, scores = local_score_table(xi, candidates[xi], upper_bound, data, r, V, backend, cache, code_cache,
+                                          pairwise_tables)
+        membership = ((masks[:, None] >> np.arange(n)) & 1).astype(bool) # membership[s, z]: z is in set s
+        tables[xi] = (masks, scores, membership)
+
+    seeds = np.random.SeedSequence(seed).spawn(n_chains)
+    n_jobs = min(n_jobs or os.cpu_count() or 1, n_chains)
+    if n_jobs == 1:
+        results = [_run_chain(tables, n_samples, burn_in, thin, chain_seed) for chain_seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_run_chain, tables, n_samples, burn_in, thin, chain_seed) for chain_seed in seeds]
+            results = [future.result() for future in futures]
+
+    if stats is not None:
+        stats["chains"] = [edges for edges, _ in results]
+        stats["acceptance"] = [acceptance for _, acceptance in results]
+        stats["local_scores"] = n_sets
+    return np.mean([edges for edges, _ in results], axis=0)
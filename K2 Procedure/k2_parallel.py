@@ -0,0 +1,157 @@
+import contextlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+import k2_core
+from k2_core import (
+    EncodedDataset, FamilyScoreCache, ParentCodeCache, Pred, check_exact_search, default_pairwise_tables, exact_parents,
+    learn_parents, log_factorial_table, k2_algorithm, node_predecessors
+)
+from k2_dataset import SharedDataset
+
+# ? State of a worker process of worker_pool, set once by its initializer: the dataset is attached from shared
+# ? memory, not copied, and the setup of the caller adds its own entries (caches, tables, ...)
+worker_state = {}
+
+
+def _init_worker(handle, r, V, backend, setup, setup_args):
+    """
+    Initializer of the worker processes of worker_pool: attaches the shared dataset, then runs the setup of the caller.
+    """
+    data = handle.attach()
+    worker_state["data"] = data
+    worker_state["r"] = r
+    worker_state["V"] = V
+    worker_state["backend"] = backend
+    log_factorial_table(max(len(data), data.sample_size) + int(max(r)))
+    if setup is not None:
+        setup(*setup_args)
+
+
+@contextlib.contextmanager
+def worker_pool(data, r, V, backend, n_jobs, setup=None, setup_args=()):
+    """
+    A pool of worker processes that share an encoded dataset. Its codes are published once in shared memory
+    (see SharedDataset), and every worker attaches them in worker_state, with r, V and backend, when it starts.
+    The pool is shut down and the shared memory released when the with block ends, even on errors.
+
+    Parameters:
+        data (EncodedDataset): The dataset shared by the workers.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend of the workers, resolved by the caller (the workers may not share the
+            setting of the calling process).
+        n_jobs (int): The number of worker processes.
+        setup (callable): Optional module-level function run by every worker once the dataset is attached, with
+            setup_args, e.g. to add the caches of the worker to worker_state.
+        setup_args (tuple): The arguments of setup.
+
+    Returns:
+        ProcessPoolExecutor: The executor of the pool, as the target of the with statement.
+    """
+    with SharedDataset(data) as shared, ProcessPoolExecutor(
+        max_workers=n_jobs, initializer=_init_worker, initargs=(shared.handle, r, V, backend, setup, setup_args)
+    ) as executor:
+        yield executor
+
+
+def _setup_search(code_cache_bytes, pairwise_tables):
+    """
+    Setup of the workers of k2_algorithm_parallel: the caches used by every node searched in the worker.
+    """
+    worker_state["cache"] = FamilyScoreCache()
+    worker_state["code_cache"] = ParentCodeCache(code_cache_bytes)
+    worker_state["pairwise_tables"] = pairwise_tables
+
+
+def _search_node(xi, parents_xi, predecessors, upper_bound, exact=False):
+    """
+    Task of a worker process: the parent search of a single node, greedy or exact.
+    """
+    search = exact_parents if exact else learn_parents
+    stats = {}
+    parents_xi = search(
+        xi, list(parents_xi), predecessors, upper_bound, worker_state["data"], worker_state["r"], worker_state["V"],
+        worker_state["backend"], worker_state["cache"], worker_state["code_cache"], stats=stats,
+        pairwise_tables=worker_state["pairwise_tables"]
+    )
+    return xi, parents_xi, stats
+
+
+def schedule_nodes(nodes, predecessors=None):
+    """
+    Orders the nodes for the process pool, most expensive first.
+    The cost of a node grows with the number of candidates its search tries (at every greedy step), so starting
+    from the nodes with the most candidates avoids a long tail of late, expensive nodes.
+
+    Parameters:
+        nodes (list of dict): The nodes of the network.
+        predecessors (dict): The candidate parents the search of each node ID tries (see node_predecessors),
+            defaults to Pred.
+
+    Returns:
+        list of dict: The nodes, sorted by decreasing number of candidates.
+    """
+    if predecessors is None:
+        predecessors = {node["id"]: Pred(node["id"], nodes) for node in nodes}
+    return sorted(nodes, key=lambda node: len(predecessors[node["id"]]), reverse=True)
+
+
+def k2_algorithm_parallel(upper_bound, nodes, data, r, V, n_jobs=None, backend=None, code_cache_bytes=64 * 2**20,
+                          candidate_pools=None, exact=False, stats=None):
+    """
+    Executes the K2 algorithm with the parent searches of the nodes distributed over a pool of processes.
+    With a fixed ordering the search of each node is independent of the others, so the result is the same
+    as the one of k2_algorithm.
+
+    Parameters:
+        upper_bound (int): The maximum number of parents allowed for any node.
+        nodes (list of dict): A list of nodes in the Bayesian network, each represented as a dictionary with 'id' and 'parents'.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        n_jobs (int): The number of worker processes, defaults to the number of CPUs.
+            With a single job the search runs in the calling process.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        code_cache_bytes (int): Memory budget of the parent instantiation codes kept by each worker.
+        candidate_pools (dict): Optional candidate parents of each node ID, as in k2_algorithm.
+        exact (bool): Find the best parent set of each node by branch and bound, as in k2_algorithm.
+        stats (dict): Optional, the counters "evaluated" and "pruned" of all the nodes are added to it.
+
+    Returns:
+        None
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        k2_algorithm(upper_bound, nodes, data, r, V, backend=backend, code_cache_bytes=code_cache_bytes,
+                     candidate_pools=candidate_pools, exact=exact, stats=stats)
+        return
+
+    if not isinstance(data, EncodedDataset):
+        data = EncodedDataset(data, V) # Encoded once here, the workers attach the compact codes
+    if backend is None:
+        backend = k2_core.SCORE_BACKEND # Resolved here, the workers may not share the setting of this process
+
+    predecessors = {node["id"]: node_predecessors(node["id"], nodes, candidate_pools=candidate_pools) for node in nodes}
+    if exact:
+        for node in nodes:
+            check_exact_search(node["id"], predecessors[node["id"]], upper_bound)
+    if stats is None:
+        stats = {}
+    stats.setdefault("evaluated", 0)
+    stats.setdefault("pruned", 0)
+    pairwise_tables = default_pairwise_tables(data) # Counted once here, small enough to be sent to every worker
+    parents_by_id = {}
+    with worker_pool(data, r, V, backend, n_jobs, _setup_search, (code_cache_bytes, pairwise_tables)) as executor:
+        # ? Tasks are started in submission order, so the most expensive nodes are taken first
+        futures = [
+            executor.submit(_search_node, node["id"], node["parents"], predecessors[node["id"]], upper_bound, exact)
+            for node in schedule_nodes(nodes, predecessors)
+        ]
+        for future in futures:
+            xi, parents_xi, node_stats = future.result()
+            parents_by_id[xi] = parents_xi
+            for key, value in node_stats.items():
+                stats[key] += value
+
+    for node in nodes:
+        node["parents"][:] = parents_by_id[node["id"]] # Updated in place, as k2_algorithm does
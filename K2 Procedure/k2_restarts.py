@@ -0,0 +1,218 @@
+import contextlib
+import os
+import numpy as np
+import k2_core
+from k2_core import (
+    EncodedDataset, FamilyScoreCache, default_pairwise_tables, k2_algorithm, log_factorial_table, network_score
+)
+from k2_parallel import worker_pool, worker_state
+
+RESTART_STRATEGIES = ("random", "perturb")
+
+class _RecordingCache(FamilyScoreCache):
+    """
+    The family score cache of a worker, which records the families the worker scores itself, so that only
+    these are sent back to the master.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.computed = []
+
+    def put(self, key, score):
+        if key not in self._scores:
+            self.computed.append((key, score))
+        super().put(key, score)
+
+    def merge(self, entries):
+        """
+        Adds the entries scored by the other workers, without recording them.
+        """
+        for key, score in entries:
+            FamilyScoreCache.put(self, key, score)
+
+
+def _setup_restarts(pairwise_tables):
+    """
+    Setup of the worker processes (see worker_pool): creates the family score cache shared by all the restarts
+    run in the worker.
+    """
+    worker_state["id"] = os.getpid()
+    worker_state["pairwise_tables"] = pairwise_tables
+    worker_state["cache"] = _RecordingCache()
+    worker_state["cache"].bind(worker_state["data"])
+    worker_state["synced"] = 0 # Number of entries of the list of the master already merged in the cache
+
+
+def _run_restart(upper_bound, nodes, ordering, start, shared_entries):
+    """
+    Task of a worker process: one K2 run with the given ordering.
+    shared_entries are the entries of the master from position start on: the ones the worker has not merged
+    yet are added to its cache first. The entries computed here are returned, so that the master can pass
+    them on, with the id of the worker and the number of entries of the master it has merged.
+    """
+    cache = worker_state["cache"]
+    cache.merge(shared_entries[max(worker_state["synced"] - start, 0):])
+    worker_state["synced"] = max(worker_state["synced"], start + len(shared_entries))
+    cache.computed = []
+    parents, score = _restart(upper_bound, nodes, ordering, worker_state["data"], worker_state["r"], worker_state["V"],
+                              worker_state["backend"], cache, worker_state["pairwise_tables"])
+    return parents, score, cache.computed, worker_state["id"], worker_state["synced"]
+
+
+def _restart(upper_bound, nodes, ordering, data, r, V, backend, cache, pairwise_tables):
+    """
+    Runs K2 on a copy of the nodes with the given ordering.
+
+    Returns:
+        tuple: (parents, score), the parent set of each node (in the order of nodes) and the score of the network.
+    """
+    nodes = [{"id": node["id"], "parents": list(node["parents"])} for node in nodes]
+    k2_algorithm(upper_bound, nodes, data, r, V, backend=backend, cache=cache, pairwise_tables=pairwise_tables,
+                 ordering=ordering)
+    return [node["parents"] for node in nodes], network_score(nodes, data, r, V, backend, cache)
+
+
+def perturb_ordering(ordering, rng, n_swaps=None):
+    """
+    Perturbs an ordering with random swaps of adjacent nodes.
+
+    Parameters:
+        ordering (list of int): The ordering to perturb.
+        rng (np.random.Generator): The random generator.
+        n_swaps (int): The number of swaps, defaults to about a tenth of the number of nodes (at least one).
+
+    Returns:
+        list of int: The perturbed ordering (the given one is not modified).
+    """
+    ordering = list(ordering)
+    if len(ordering) < 2:
+        return ordering
+    if n_swaps is None:
+        n_swaps = max(1, len(ordering) // 10)
+    for position in rng.integers(0, len(ordering) - 1, size=n_swaps):
+        ordering[position], ordering[position + 1] = ordering[position + 1], ordering[position]
+    return ordering
+
+
+def _next_orderings(count, orderings, ids, strategy, best_ordering, rng):
+    """
+    The orderings of the next round: the supplied ones first, then random or perturbed ones.
+    """
+    batch = []
+    while len(batch) < count:
+        if orderings:
+            batch.append([int(z) for z in orderings.pop(0)])
+        elif strategy == "perturb" and best_ordering is not None:
+            batch.append(perturb_ordering(best_ordering, rng))
+        else:
+            batch.append([int(z) for z in rng.permutation(ids)])
+    return batch
+
+
+def k2_restarts(upper_bound, nodes, data, r, V, n_restarts=10, orderings=None, strategy="random", n_jobs=None,
+                seed=None, backend=None, cache=None, round_size=None, stats=None):
+    """
+    Runs K2 over many orderings of the nodes and keeps the network with the highest score.
+    The restarts run in rounds of round_size orderings, each round in parallel. The orderings are:
+        - the supplied orderings, first;
+        - then, with strategy "random", random permutations of the nodes;
+        - or, with strategy "perturb", random adjacent swaps of the best ordering found so far
+          (a random permutation while none has been found).
+
+    All the restarts share one family score cache: the orderings overlap heavily, so many families are
+    scored by several of them. With several jobs every worker keeps its own cache, and every entry computed
+    by a worker reaches the other ones with their next restarts (each worker only receives the entries it
+    has not merged yet).
+
+    Parameters:
+        upper_bound (int): The maximum number of parents allowed for any node.
+        nodes (list of dict): The nodes of the network, the parents of the best network are written in place.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        n_restarts (int): The total number of K2 runs (at least the number of supplied orderings).
+        orderings (list of list of int): Optional orderings to try first.
+        strategy (str): How the other orderings are generated, "random" or "perturb".
+        n_jobs (int): The number of worker processes, defaults to the number of CPUs.
+            With a single job the restarts run in the calling process.
+        seed (int): Seed of the random orderings.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): The shared cache, a new one is used if not given.
+        round_size (int): The number of restarts per round, defaults to n_jobs. With "perturb", the best
+            ordering is updated between rounds, so the orderings depend on it.
+        stats (dict): Optional, receives "scores" (the score of every restart, in order), "computed" (the number
+            of families each restart scored, the other ones came from the cache) and "cache" (the counters of
+            the shared cache).
+
+    Returns:
+        tuple: (ordering, score), the ordering of the best network and its score.
+    """
+    if strategy not in RESTART_STRATEGIES:
+        raise ValueError(f"Unknown restart strategy {strategy!r}, expected one of {RESTART_STRATEGIES}")
+    n_jobs = n_jobs or os.cpu_count() or 1
+    round_size = round_size or n_jobs
+    orderings = [list(ordering) for ordering in orderings] if orderings is not None else []
+    n_restarts = max(n_restarts, len(orderings))
+    rng = np.random.default_rng(seed)
+    ids = [node["id"] for node in nodes]
+
+    if not isinstance(data, EncodedDataset):
+        data = EncodedDataset(data, V) # Encoded once for every restart
+    if backend is None:
+        backend = k2_core.SCORE_BACKEND # Resolved here, the workers may not share the setting of this process
+    if cache is None:
+        cache = FamilyScoreCache()
+    cache.bind(data)
+    log_factorial_table(data.sample_size + int(max(r)))
+    pairwise_tables = default_pairwise_tables(data) # Counted once, shared by every restart
+
+    best_ordering, best_parents, best_score = None, None, None
+    scores = []
+    computed = []
+    with contextlib.ExitStack() as stack:
+        executor = None
+        if n_jobs > 1:
+            executor = stack.enter_context(worker_pool(data, r, V, backend, n_jobs, _setup_restarts, (pairwise_tables,)))
+
+        # ? Every entry the workers computed, in order, and how many of them each worker has merged: a task only
+        # ? carries the entries after the ones that every worker already has
+        shared_entries = cache.entries()
+        synced = {}
+        while len(scores) < n_restarts:
+            batch = _next_orderings(min(round_size, n_restarts - len(scores)), orderings, ids, strategy, best_ordering, rng)
+            if executor is None:
+                results = []
+                for ordering in batch:
+                    misses = cache.misses
+                    results.append(_restart(upper_bound, nodes, ordering, data, r, V, backend, cache, pairwise_tables))
+                    computed.append(cache.misses - misses)
+            else:
+                start = min(synced.values()) if len(synced) == n_jobs else 0
+                futures = [
+                    executor.submit(_run_restart, upper_bound, nodes, ordering, start, shared_entries[start:])
+                    for ordering in batch
+                ]
+                results = []
+                for future in futures:
+                    parents, score, entries, worker, worker_synced = future.result()
+                    cache.update(entries)
+                    shared_entries.extend(entries) # Sent to the restarts of the next rounds
+                    synced[worker] = max(synced.get(worker, 0), worker_synced)
+                    computed.append(len(entries))
+                    results.append((parents, score))
+
+            # ? Results are examined in the order of the orderings, the first best network is kept
+            for ordering, (parents, score) in zip(batch, results):
+                scores.append(score)
+                if best_score is None or score > best_score:
+                    best_ordering, best_parents, best_score = ordering, parents, score
+
+    for node, parents in zip(nodes, best_parents):
+        node["parents"][:] = parents # Updated in place, as k2_algorithm does
+    if stats is not None:
+        stats["scores"] = scores
+        stats["computed"] = computed
+        stats["cache"] = cache.stats()
+    return best_ordering, best_score
+
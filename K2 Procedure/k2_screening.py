@@ -0,0 +1,148 @@
+import math
+import time
+import numpy as np
+from k2_core import Pred, pairwise_counts
+from k2_dataset import EncodedDataset
+
+# ? Lazily resolved quantile function of the chi-squared distribution, from scipy when installed
+_chi2_quantile = None
+
+
+def mutual_information_matrix(counts, offsets, max_cells=2**22):
+    """
+    Computes the mutual information (in nats) of every pair of columns from their joint counts.
+
+    Parameters:
+        counts (np.ndarray): The joint counts, as returned by pairwise_counts.
+        offsets (np.ndarray): The offsets of the columns in counts.
+        max_cells (int): Maximum number of cells of counts processed at once. The terms of the mutual
+            information are computed for a group of columns at a time, so the float64 temporaries stay
+            around max_cells cells instead of several matrices as large as counts.
+
+    Returns:
+        tuple: (mi, df), two (columns x columns) matrices: the empirical mutual information of each pair and the
+        degrees of freedom of its independence test, (k_a - 1)(k_b - 1) with k the number of observed values.
+    """
+    marginals = np.diag(counts).astype(np.float64)
+    m = marginals[offsets[0]:offsets[1]].sum() if len(offsets) > 1 else 0.0
+    n_columns = len(offsets) - 1
+    total = int(offsets[-1])
+    starts = offsets[:-1]
+
+    mi = np.zeros((n_columns, n_columns))
+    first = 0
+    while first < n_columns:
+        # ? The group of columns grows while its rows of counts fit in max_cells (a single column at least)
+        last = first + 1
+        while last < n_columns and (offsets[last + 1] - offsets[first]) * total <= max_cells:
+            last += 1
+        rows = slice(offsets[first], offsets[last])
+        # ? N_ab * log(m N_ab / (N_a N_b)) for every cell of every pair, the empty cells contribute 0
+        joint = counts[rows].astype(np.float64)
+        expected = np.outer(marginals[rows], marginals)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = np.where(joint > 0, joint * np.log(joint * m / expected), 0.0)
+        mi[first:last] = np.add.reduceat(np.add.reduceat(terms, starts[first:last] - offsets[first], axis=0), starts, axis=1)
+        first = last
+    mi /= max(m, 1.0)
+
+    observed = np.add.reduceat(marginals > 0, starts).astype(np.int64)
+    df = np.outer(observed - 1, observed - 1)
+    return mi, df
+
+
+def greedy_families(n_candidates, upper_bound):
+    """
+    The largest number of families the greedy search of a node can score: n_candidates - t at step t,
+    for at most upper_bound steps.
+    """
+    return sum(n_candidates - step for step in range(min(upper_bound, n_candidates)))
+
+
+def g_test_critical_values(df, alpha):
+    """
+    Critical values of the G-test of independence: the (1 - alpha) quantiles of the chi-squared distribution.
+    scipy.stats.chi2 is used when scipy is installed, otherwise the Wilson-Hilferty approximation.
+
+    Parameters:
+        df (np.ndarray): The degrees of freedom of each test.
+        alpha (float): The significance level.
+
+    Returns:
+        np.ndarray: The critical values, +inf where df is 0 (a constant column is never dependent).
+    """
+    global _chi2_quantile
+    if _chi2_quantile is None:
+        try:
+            from scipy.stats import chi2
+            _chi2_quantile = lambda p, k: chi2.ppf(p, k)
+        except ImportError:
+            from statistics import NormalDist
+            def _chi2_quantile(p, k):
+                z = NormalDist().inv_cdf(p)
+                return k * (1 - 2 / (9 * k) + z * np.sqrt(2 / (9 * k))) ** 3
+
+    df = np.asarray(df)
+    critical = np.full(df.shape, math.inf)
+    tested = df > 0
+    critical[tested] = _chi2_quantile(1 - alpha, df[tested].astype(np.float64))
+    return critical
+
+
+def screen_candidates(nodes, data, V, top_k=None, alpha=None, stats=None, upper_bound=None):
+    """
+    Restricts the candidate parents of every node before running K2. The mutual information of all the pairs
+    of nodes is computed once, then each node keeps only the predecessors that pass the screening:
+        - with alpha, the predecessors dependent on it by a G-test (G = 2 m MI) at significance level alpha;
+        - with top_k, at most the k predecessors with the highest mutual information.
+    With both, the top_k are taken among the significant ones; with neither, every predecessor is kept.
+
+    Parameters:
+        nodes (list of dict): The nodes of the network.
+        data (pd.DataFrame or EncodedDataset): The dataset containing the values of the nodes.
+        V (list of list of int): The possible values for each node.
+        top_k (int): Maximum number of candidates per node.
+        alpha (float): Significance level of the G-test.
+        stats (dict): Optional, receives "seconds" (the cost of the screening), "candidates" (the number of
+            predecessors of all the nodes), "kept" (the candidates left after the screening) and "removed"
+            (the other ones). With upper_bound, also "families" and "screened_families": the most families
+            the greedy search of all the nodes can score (see greedy_families) without and with the screening,
+            to be compared with the "evaluated" counter of k2_algorithm.
+        upper_bound (int): The maximum number of parents of the search, only used for the stats.
+
+    Returns:
+        dict: The candidate parents of each node ID, in the order of Pred, to be passed as candidate_pools to k2_algorithm.
+    """
+    start = time.perf_counter()
+    if not isinstance(data, EncodedDataset):
+        data = EncodedDataset(data, V)
+    counts, offsets = pairwise_counts(data)
+    mi, df = mutual_information_matrix(counts, offsets)
+    significant = 2 * data.sample_size * mi > g_test_critical_values(df, alpha) if alpha is not None else np.ones_like(mi, dtype=bool)
+
+    pools = {}
+    n_candidates = 0
+    families = screened_families = 0
+    for node in nodes:
+        xi = node["id"]
+        predecessors = Pred(xi, nodes)
+        n_candidates += len(predecessors)
+        kept = [z for z in predecessors if significant[xi, z]]
+        if top_k is not None and len(kept) > top_k:
+            # ? Stable sort: ties in the mutual information keep the order of Pred
+            best = set(sorted(kept, key=lambda z: -mi[xi, z])[:top_k])
+            kept = [z for z in kept if z in best]
+        pools[xi] = kept # Still in the order of Pred, which decides the ties of the greedy search
+        if upper_bound is not None:
+            families += greedy_families(len(predecessors), upper_bound)
+            screened_families += greedy_families(len(kept), upper_bound)
+
+    if stats is not None:
+        stats["seconds"] = time.perf_counter() - start
+        stats["candidates"] = n_candidates
+        stats["kept"] = sum(len(pool) for pool in pools.values())
+        stats["removed"] = n_candidates - stats["kept"]
+        if upper_bound is not None:
+            stats["families"] = families
+            stats["screened_families"] = screened_families
+    return pools
@@ -0,0 +1,312 @@
+import math
+import os
+import numpy as np
+import pandas as pd
+import k2_core
+from k2_core import (
+    CODE_LIMIT, DENSE_TABLE_LIMIT, FamilyScoreCache, best_candidate, greedy_candidates, log_factorial_table,
+    node_predecessors, score_from_counts, weighted_bincount
+)
+from k2_dataset import EncodedDataset, code_dtype
+
+STREAM_CHUNK_ROWS = 2**16 # Default number of rows read at once from a streamed source
+STREAM_TABLE_CELLS = 2**24 # Default largest number of cells counted in a single pass over the source
+
+
+class StreamingDataset:
+    """
+    A dataset too large for memory, read one chunk of rows at a time. The source can be:
+        - the path of a CSV file, read with pd.read_csv in chunks of chunk_rows rows;
+        - a function taking no arguments that returns an iterable of DataFrames (e.g. a generator function),
+          called once for every pass over the data;
+        - a list of DataFrames.
+    A generator object can only be read once, while the search passes over the data many times, so it is
+    not accepted: pass the generator function instead.
+
+    The codes of the values are fixed by a first pass over the source, as in EncodedDataset (V first, then the
+    values missing from V in order of first appearance), so every chunk is encoded the same way. Only the
+    number of rows and the values of each column are kept, never the rows themselves.
+
+    Parameters:
+        source (str, os.PathLike, callable or list): The source of the chunks of rows.
+        V (list of list): The possible values for each node.
+        chunk_rows (int): The number of rows read at once from a CSV file.
+    """
+
+    def __init__(self, source, V, chunk_rows=STREAM_CHUNK_ROWS):
+        if not isinstance(source, (str, os.PathLike, list)) and not callable(source):
+            raise TypeError(
+                "The source must be a CSV path, a list of DataFrames or a function returning the chunks "
+                "(a generator can only be read once)"
+            )
+        self.source = source
+        self.chunk_rows = chunk_rows
+        self.V = [list(values) for values in V]
+        self.r = np.array([len(values) for values in V])
+        self.categories = [list(values) for values in self.V]
+        self.columns = None
+        self.sample_size = 0
+        self.passes = 0 # Number of passes over the source, the first one included
+
+        for chunk in self._read():
+            if self.columns is None:
+                self.columns = list(chunk.columns)
+            for i in range(chunk.shape[1]):
+                column = chunk.iloc[:, i].to_numpy()
+                missing = pd.Index(self.categories[i]).get_indexer(column) < 0
+                if missing.any():
+                    # ? Values outside of V get the next codes, numbered by first appearance over the whole stream
+                    _, extra_values = pd.factorize(column[missing], use_na_sentinel=False)
+                    self.categories[i].extend(extra_values)
+            self.sample_size += len(chunk)
+        if self.columns is None:
+            raise ValueError("The source has no rows")
+        self.cardinalities = np.array([len(categories) for categories in self.categories])
+
+    def _read(self):
+        """
+        Reads the chunks of the source as DataFrames, once.
+        """
+        self.passes += 1
+        if isinstance(self.source, (str, os.PathLike)):
+            chunks = pd.read_csv(self.source, chunksize=self.chunk_rows)
+        elif isinstance(self.source, list):
+            chunks = self.source
+        else:
+            chunks = self.source()
+        for chunk in chunks:
+            if len(self.V) != chunk.shape[1]:
+                raise ValueError(f"A chunk has {chunk.shape[1]} columns but V describes {len(self.V)} nodes")
+            yield chunk
+
+    def chunks(self):
+        """
+        Reads the source once, chunk by chunk.
+
+        Yields:
+            EncodedDataset: The encoded rows of each chunk, with the codes of the whole stream.
+        """
+        dtype = code_dtype(self.cardinalities)
+        for chunk in self._read():
+            codes = np.empty(chunk.shape, dtype=dtype, order="F")
+            for i in range(chunk.shape[1]):
+                column_codes = pd.Index(self.categories[i]).get_indexer(chunk.iloc[:, i].to_numpy())
+                if (column_codes < 0).any():
+                    raise ValueError(f"Column {i} has values that were not in the source during the first pass")
+                codes[:, i] = column_codes
+            yield EncodedDataset.from_codes(codes, self.columns, self.V, self.categories)
+
+    def __len__(self):
+        return self.sample_size
+
+
+class TableAccumulator:
+    """
+    The table of counts of a family (xi, parents), filled chunk by chunk (the weights of a weighted chunk are honored).
+    Every cell is identified by the mixed-radix code of (parent values, value of xi) over the cardinalities of the
+    whole stream. When all the cells fit in dense_limit, the codes index the table directly. Otherwise only the
+    observed cells are kept, as their sorted codes with their counts, merged after every chunk; if even the codes
+    would not fit in CODE_LIMIT, the cells are kept as rows of (parent codes, value code) instead.
+    """
+
+    def __init__(self, xi, parents, cardinalities, r_xi, dense_limit):
+        self.xi = xi
+        self.parents = sorted(parents)
+        self.r_xi = r_xi
+        self.radices = [int(cardinalities[parent]) for parent in self.parents]
+        self.size = math.prod(self.radices)
+        self.dense = self.size * r_xi <= dense_limit
+        self.coded = self.size * r_xi <= CODE_LIMIT
+        if self.dense:
+            self.counts = np.zeros(self.size * r_xi, dtype=np.int64)
+        else:
+            self.keys = np.zeros(0 if self.coded else (0, len(self.parents) + 1), dtype=np.int64)
+            self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, chunk):
+        value_codes = chunk.column(self.xi).astype(np.int64)
+        mask = value_codes < self.r_xi # Codes of the values missing from V are not counted
+        weights = chunk.weights[mask] if chunk.weights is not None else None
+        if self.coded:
+            cells = np.zeros(int(mask.sum()), dtype=np.int64)
+            for parent, radix in zip(self.parents, self.radices):
+                cells = cells * radix + chunk.column(parent)[mask]
+            cells = cells * self.r_xi + value_codes[mask]
+            if self.dense:
+                self.counts += weighted_bincount(cells, weights, len(self.counts))
+                return
+            keys, inverse = np.unique(cells, return_inverse=True)
+        else:
+            rows = np.column_stack([chunk.column(parent)[mask] for parent in self.parents] + [value_codes[mask]])
+            keys, inverse = np.unique(rows.astype(np.int64), axis=0, return_inverse=True)
+        # ? The chunk is reduced to its distinct cells before merging, so the merge never grows with the chunk
+        counts = weighted_bincount(inverse.ravel(), weights, len(keys))
+        keys, inverse = np.unique(np.concatenate([self.keys, keys]), axis=None if self.coded else 0, return_inverse=True)
+        self.counts = weighted_bincount(inverse.ravel(), np.concatenate([self.counts, counts]), len(keys))
+        self.keys = keys
+
+    def table(self):
+        """
+        The (q x r_xi) table of counts, its rows in no particular order (as in contingency_table with ordered=False).
+        """
+        if self.dense:
+            return self.counts.reshape(-1, self.r_xi)
+        if self.coded:
+            _, instantiations = np.unique(self.keys // self.r_xi, return_inverse=True)
+            value_codes = self.keys % self.r_xi
+        else:
+            _, instantiations = np.unique(self.keys[:, :-1], axis=0, return_inverse=True)
+            value_codes = self.keys[:, -1]
+        instantiations = instantiations.ravel()
+        table = np.zeros((instantiations.max(initial=-1) + 1, self.r_xi), dtype=np.int64)
+        np.add.at(table, (instantiations, value_codes), self.counts)
+        return table
+
+    def cells(self):
+        """
+        The number of integers held by the table.
+        """
+        return self.counts.size + (0 if self.dense else self.keys.size)
+
+
+def table_cells(parents, cardinalities, r_xi, dense_limit, sample_size):
+    """
+    The largest number of cells a TableAccumulator of the family can hold, computed without allocating it:
+    the whole table in dense mode, otherwise a key and a count for each observed cell, of which there are at
+    most as many as the samples.
+    """
+    size = math.prod(int(cardinalities[parent]) for parent in parents) * r_xi
+    if size <= dense_limit:
+        return size
+    width = 2 if size <= CODE_LIMIT else len(parents) + 2
+    return min(size, sample_size) * width
+
+
+def stream_tables(families, data, r, dense_limit=DENSE_TABLE_LIMIT, max_cells=STREAM_TABLE_CELLS, stats=None):
+    """
+    Counts the tables of many families over a streamed dataset. The families are counted together, with a single
+    pass over the source for as many of them as fit in max_cells cells; the others wait for the next pass.
+    So the memory in use is one chunk of rows plus at most max_cells counts: the tables whose dense form exceeds
+    max_cells are kept sparse, and a family whose sparse table can still exceed it is counted alone.
+
+    Parameters:
+        families (list of tuple): The families to count, as (xi, parents) pairs.
+        data (StreamingDataset): The streamed dataset.
+        r (list of int): The number of possible values for each node.
+        dense_limit (int): The largest table, in cells, counted in dense mode (see TableAccumulator).
+        max_cells (int): The largest number of cells counted in a single pass.
+        stats (dict): Optional, "passes" is increased by the number of passes and "peak_cells" receives the
+            largest number of cells held at once.
+
+    Returns:
+        list of np.ndarray: The table of counts of each family, in the order of families.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("passes", 0)
+    stats.setdefault("peak_cells", 0)
+    tables = [None] * len(families)
+    pending = list(range(len(families)))
+    dense_limit = min(dense_limit, max_cells) # A dense table larger than a whole pass is kept sparse instead
+    while pending:
+        batch, batch_cells = [], 0
+        for f in pending:
+            xi, parents = families[f]
+            estimate = table_cells(parents, data.cardinalities, int(r[xi]), dense_limit, data.sample_size)
+            if batch and batch_cells + estimate > max_cells:
+                continue # Allocated in a later pass only
+            batch.append((f, TableAccumulator(xi, parents, data.cardinalities, int(r[xi]), dense_limit)))
+            batch_cells += estimate
+        for chunk in data.chunks():
+            for _, accumulator in batch:
+                accumulator.add(chunk)
+            stats["peak_cells"] = max(stats["peak_cells"], sum(accumulator.cells() for _, accumulator in batch))
+        stats["passes"] += 1
+        for f, accumulator in batch:
+            tables[f] = accumulator.table()
+        done = set(f for f, _ in batch)
+        pending = [f for f in pending if f not in done]
+    return tables
+
+
+def k2_streaming(upper_bound, nodes, source, r, V, backend=None, cache=None, chunk_rows=STREAM_CHUNK_ROWS,
+                 max_cells=STREAM_TABLE_CELLS, ordering=None, candidate_pools=None, stats=None):
+    """
+    Executes the K2 algorithm on a dataset read in chunks, without holding its rows in memory.
+    The greedy searches of all the nodes advance in lockstep: at every step the extensions parents_xi + [z] of
+    every node still searching are counted together, with one pass over the source (more if their tables do not
+    fit in max_cells), then every node adds its best candidate. So the number of passes grows with upper_bound,
+    not with the number of nodes. The learned structure is the same as the one of k2_algorithm.
+
+    Parameters:
+        upper_bound (int): The maximum number of parents allowed for any node.
+        nodes (list of dict): A list of nodes in the Bayesian network, each represented as a dictionary with 'id' and 'parents'.
+        source (str, callable, list or StreamingDataset): The source of the rows (see StreamingDataset).
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend, "mpmath" or "float", defaults to SCORE_BACKEND.
+        cache (FamilyScoreCache): Cache of family scores, a new one is used if not given.
+        chunk_rows (int): The number of rows read at once from a CSV file.
+        max_cells (int): The largest number of cells counted in a single pass (see stream_tables).
+        ordering (list of int): The topological order of the node IDs, as in k2_algorithm.
+        candidate_pools (dict): Optional candidate parents of each node ID, as in k2_algorithm.
+        stats (dict): Optional, receives "passes" (the passes over the source that count tables, the first one that
+            fixes the codes is not included), "evaluated" (the candidate families scored) and "peak_cells" (the
+            largest number of counts held at once).
+
+    Returns:
+        None
+    """
+    data = source if isinstance(source, StreamingDataset) else StreamingDataset(source, V, chunk_rows)
+    if backend is None:
+        backend = k2_core.SCORE_BACKEND # Resolved once, it is part of the keys of the cache
+    if cache is None:
+        cache = FamilyScoreCache()
+    cache.bind(data)
+    if stats is None:
+        stats = {}
+    stats.setdefault("evaluated", 0)
+    log_factorial_table(data.sample_size + int(max(r)))
+
+    def score_families(families):
+        """
+        The scores of the families, the ones missing from the cache counted together.
+        """
+        keys = [FamilyScoreCache.key(xi, parents, backend) for xi, parents in families]
+        scores = [cache.get(key) for key in keys]
+        missing = [f for f, score in enumerate(scores) if score is None]
+        tables = stream_tables([families[f] for f in missing], data, r, max_cells=max_cells, stats=stats)
+        for f, table in zip(missing, tables):
+            scores[f] = score_from_counts(table, r[families[f][0]], backend)
+            cache.put(keys[f], scores[f])
+        return scores
+
+    predecessors = {node["id"]: node_predecessors(node["id"], nodes, ordering, candidate_pools) for node in nodes}
+
+    # ? The scores of the starting parent sets are counted in the same pass as the first greedy step
+    searching = [node for node in nodes if len(node["parents"]) < upper_bound]
+    p_old = {node["id"]: None for node in nodes}
+    while searching:
+        families, steps = [], []
+        for node in searching:
+            xi, parents_xi = node["id"], node["parents"]
+            candidates = greedy_candidates(xi, parents_xi, predecessors[xi])
+            if p_old[xi] is None:
+                families.append((xi, list(parents_xi)))
+            families.extend((xi, list(parents_xi) + [z]) for z in candidates)
+            steps.append((node, candidates))
+            stats["evaluated"] += len(candidates)
+        scores = iter(score_families(families))
+
+        # ? Every node takes its best candidate with the rule of learn_parents, from its share of the scores
+        still_searching = []
+        for node, candidates in steps:
+            xi = node["id"]
+            if p_old[xi] is None:
+                p_old[xi] = next(scores)
+            best_z, p_old[xi] = best_candidate(candidates, [next(scores) for _ in candidates], p_old[xi])
+            if best_z is not None:
+                node["parents"].append(best_z)
+                if len(node["parents"]) < upper_bound:
+                    still_searching.append(node)
+        searching = still_searching
@@ -1,8 +1,27 @@
 import unittest
+import unittest.mock
 import pandas as pd
 import numpy as np
 from k2_core import *
+from k2_parallel import *
+from k2_dataset import SharedDataset, code_dtype
+from k2_screening import *
+from k2_restarts import k2_restarts, perturb_ordering
+from k2_mcmc import count_parent_sets, local_score_table, order_mcmc
+from k2_bootstrap import bootstrap_weights, k2_bootstrap
+from k2_streaming import STREAM_TABLE_CELLS, StreamingDataset, k2_streaming, stream_tables
+from k2_incremental import IncrementalK2
+import itertools
+from multiprocessing import shared_memory
+from utility_functions import run_trials, structure_difference, trial_seeds
+from synthetic_datasets.child_network_dataset import configure_child_dataset, V as V_child, r as r_child, expected_node_configuration_child
+import contextlib
+import gc
+import io
+import k2_core
+import os
 import random
+import tempfile
 
 class TestUniqueInstantiations(unittest.TestCase):
     @classmethod
@@ -405,4 +424,1093 @@ class TestParameter_R(unittest.TestCase):
         ]
         r = np.array([len(values) for values in V])
         expected = np.array([3, 2, 2, 2])
-        np.testing.assert_array_equal(r, expected)
\ No newline at end of file
+        np.testing.assert_array_equal(r, expected)
+
+class TestScoreBackends(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        data = pd.DataFrame(columns=["x1", "x2", "x3", "x4", "x5"])
+        data["x1"] = [5, 2, 1, 3, 2, 1, 1] 
+        data["x2"] = [1, 1, 1, 0, 1, 1, 1]
+        data["x3"] = [2, 0, 1, 2, 1, 1, 1]
+        data["x4"] = [3, 1, 2, 1, 1, 2, 1]
+        data["x5"] = [1, 1, 1, 1, 1, 1, 1]
+
+        V = [
+            [0, 1, 2, 3, 4, 5], # valori assumibili da x1
+            [0, 1], # valori assumibili da x2
+            [0, 1, 2], # valori assumibili da x3
+            [1, 2, 3], # valori assumibili da x4
+            [0, 1] # valori assumibili da x5
+        ]
+        r = np.array([len(values) for values in V])
+
+    def test_no_parents(self):
+        # With no parents the score is log((r-1)! * prod(N_k!) / (N + r - 1)!)
+        # x2 has r = 2 and counts [1, 6], so the score is log(1! * 1! * 6! / 8!) = -log(56)
+        result = cooper_herkovits_score(1, [], data, r, V, backend="float")
+        self.assertAlmostEqual(result, -np.log(56))
+
+    def test_float_matches_mpmath(self):
+        for xi, parents_xi in [(0, []), (2, [0]), (3, [0, 1]), (4, [0, 1, 2, 3])]:
+            expected = float(cooper_herkovits_score(xi, parents_xi, data, r, V, backend="mpmath"))
+            result = cooper_herkovits_score(xi, parents_xi, data, r, V, backend="float")
+            self.assertAlmostEqual(result, expected, places=9)
+
+    def test_same_structure(self):
+        # Both backends must take the same decisions on a random dataset
+        rng = np.random.default_rng(0)
+        random_data = pd.DataFrame(rng.integers(0, 3, size=(300, 6)))
+        random_data[3] = (random_data[0] + random_data[1]) % 3
+        random_data[5] = random_data[3] * (random_data[4] > 0)
+        random_V = [[0, 1, 2]] * 6
+        random_r = np.array([3] * 6)
+
+        structures = []
+        for backend in ("mpmath", "float"):
+            nodes = [{"id": idx, "name": col, "parents": []} for idx, col in enumerate(random_data.columns)]
+            k2_algorithm(3, nodes, random_data, random_r, random_V, backend=backend)
+            structures.append([node["parents"] for node in nodes])
+        self.assertEqual(structures[0], structures[1])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            cooper_herkovits_score(1, [], data, r, V, backend="decimal")
+
+
+class TestLogFactorialTable(unittest.TestCase):
+
+    def test_values(self):
+        table = log_factorial_table(10)
+        self.assertGreaterEqual(len(table), 10)
+        self.assertAlmostEqual(table[0], 0.0)
+        self.assertAlmostEqual(table[5], np.log(120))
+
+    def test_histogram_score(self):
+        # Many cells with the same counts: the score only depends on the histogram of the counts
+        table = np.array([[1, 0], [0, 1], [1, 0], [2, 1]])
+        shuffled = table[[3, 1, 0, 2]]
+        self.assertEqual(score_from_counts(table, 2, "float"), score_from_counts(shuffled, 2, "float"))
+        self.assertAlmostEqual(score_from_counts(table, 2, "float"), float(score_from_counts(table, 2, "mpmath")))
+
+
+class TestFamilyScoreCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        data = pd.DataFrame(columns=["x1", "x2", "x3", "x4", "x5"])
+        data["x1"] = [5, 2, 1, 3, 2, 1, 1] 
+        data["x2"] = [1, 1, 1, 0, 1, 1, 1]
+        data["x3"] = [2, 0, 1, 2, 1, 1, 1]
+        data["x4"] = [3, 1, 2, 1, 1, 2, 1]
+        data["x5"] = [1, 1, 1, 1, 1, 1, 1]
+
+        V = [
+            [0, 1, 2, 3, 4, 5], # valori assumibili da x1
+            [0, 1], # valori assumibili da x2
+            [0, 1, 2], # valori assumibili da x3
+            [1, 2, 3], # valori assumibili da x4
+            [0, 1] # valori assumibili da x5
+        ]
+        r = np.array([len(values) for values in V])
+
+    def test_parent_order_is_canonical(self):
+        cache = FamilyScoreCache()
+        first = cooper_herkovits_score(3, [0, 2], data, r, V, "float", cache)
+        second = cooper_herkovits_score(3, [2, 0], data, r, V, "float", cache)
+        self.assertEqual(first, second)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_lru_eviction(self):
+        cache = FamilyScoreCache(capacity=2)
+        cooper_herkovits_score(3, [0], data, r, V, "float", cache)
+        cooper_herkovits_score(3, [1], data, r, V, "float", cache)
+        cooper_herkovits_score(3, [0], data, r, V, "float", cache) # [0] becomes the most recently used
+        cooper_herkovits_score(3, [2], data, r, V, "float", cache) # evicts [1]
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertIsNone(cache.get(FamilyScoreCache.key(3, [1], "float")))
+        self.assertIsNotNone(cache.get(FamilyScoreCache.key(3, [0], "float")))
+
+    def test_repeated_run_hits(self):
+        cache = FamilyScoreCache()
+        structures = []
+        for _ in range(2):
+            nodes = [{"id": idx, "name": col, "parents": []} for idx, col in enumerate(data.columns)]
+            k2_algorithm(2, nodes, data, r, V, backend="float", cache=cache)
+            structures.append([node["parents"] for node in nodes])
+        misses = cache.stats()["misses"]
+        self.assertEqual(structures[0], structures[1])
+        self.assertEqual(cache.stats()["hits"], misses) # The second run finds every family in the cache
+
+    def test_new_dataset_clears(self):
+        cache = FamilyScoreCache()
+        cooper_herkovits_score(3, [0], data, r, V, "float", cache)
+        cooper_herkovits_score(3, [0], data.copy(), r, V, "float", cache)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+
+class TestParentCodeCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data
+        rng = np.random.default_rng(1)
+        data = pd.DataFrame(rng.integers(0, 4, size=(500, 6)))
+
+    def test_incremental_codes_match(self):
+        # Codes derived from a cached subset must be the same as the codes computed from scratch
+        code_cache = ParentCodeCache()
+        parent_configurations([1, 3], data, code_cache)
+        codes, q = parent_configurations([1, 3, 4], data, code_cache)
+        expected_codes, expected_q = parent_configurations([4, 1, 3], data)
+        self.assertEqual(q, expected_q)
+        np.testing.assert_array_equal(codes, expected_codes)
+        self.assertGreater(code_cache.stats()["hits"], 0)
+
+    def test_byte_budget(self):
+        one_vector = len(data) * np.dtype(np.int64).itemsize
+        code_cache = ParentCodeCache(max_bytes=3 * one_vector)
+        for parents_xi in ([0], [0, 1], [0, 1, 2], [0, 1, 2, 3]):
+            parent_configurations(parents_xi, data, code_cache)
+        self.assertLessEqual(code_cache.stats()["bytes"], 3 * one_vector)
+        self.assertGreater(code_cache.stats()["evictions"], 0)
+
+
+class TestEncodedDataset(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V, encoded
+        data = pd.DataFrame(columns=["x1", "x2", "x3", "x4", "x5"])
+        data["x1"] = [5, 2, 1, 3, 2, 1, 1] 
+        data["x2"] = [1, 1, 1, 0, 1, 1, 1]
+        data["x3"] = [2, 0, 1, 2, 1, 1, 1]
+        data["x4"] = [3, 1, 2, 1, 1, 2, 1]
+        data["x5"] = [0.5, 1, 1, 1, 1, 1, 7] # 7 is not one of the possible values of x5
+
+        V = [
+            [0, 1, 2, 3, 4, 5], # valori assumibili da x1
+            [0, 1], # valori assumibili da x2
+            [0, 1, 2], # valori assumibili da x3
+            [1, 2, 3], # valori assumibili da x4
+            [0.5, 1] # valori assumibili da x5
+        ]
+        r = np.array([len(values) for values in V])
+        encoded = EncodedDataset(data, V)
+
+    def test_codes(self):
+        self.assertEqual(encoded.codes.dtype, np.uint8)
+        self.assertTrue(encoded.codes.flags["F_CONTIGUOUS"])
+        np.testing.assert_array_equal(encoded.column(3), [2, 0, 1, 0, 0, 1, 0])
+        np.testing.assert_array_equal(encoded.column(4), [0, 1, 1, 1, 1, 1, 2]) # 7 gets the code after V
+        np.testing.assert_array_equal(encoded.r, r)
+
+    def test_unique_instantiations(self):
+        np.testing.assert_array_equal(unique_instantiations(3, [0, 1], encoded), unique_instantiations(3, [0, 1], data))
+
+    def test_counts_match_dataframe(self):
+        for xi, parents_xi in [(0, []), (2, [0]), (3, [0, 1]), (4, [0, 1, 2, 3]), (2, [4])]:
+            np.testing.assert_array_equal(
+                contingency_table(xi, parents_xi, encoded, V[xi]),
+                contingency_table(xi, parents_xi, data, V[xi])
+            )
+            self.assertEqual(Nij(xi, parents_xi, 0, encoded, r, V), Nij(xi, parents_xi, 0, data, r, V))
+        self.assertEqual(Nijk(4, 0, 1, [0], encoded), Nijk(4, 0, 1, [0], data))
+        self.assertEqual(Nijk(4, 0, 7, [], encoded), Nijk(4, 0, 7, [], data)) # Values outside of V can still be counted
+
+    def test_score_matches_dataframe(self):
+        for xi, parents_xi in [(1, []), (3, [0, 2]), (4, [1, 3])]:
+            self.assertEqual(
+                cooper_herkovits_score(xi, parents_xi, encoded, r, V, "float"),
+                cooper_herkovits_score(xi, parents_xi, data, r, V, "float")
+            )
+
+
+class TestCodeTypes(unittest.TestCase):
+
+    def test_large_columns_do_not_wrap(self):
+        frame = pd.DataFrame({"a": np.arange(70000), "b": np.arange(70000) % 2})
+        V = [list(range(70000)), [0, 1]]
+        encoded = EncodedDataset(frame, V)
+        self.assertEqual(encoded.codes.dtype, np.uint32)
+        self.assertEqual(len(np.unique(encoded.column(0))), 70000)
+        self.assertEqual(code_dtype([256]), np.uint8)
+        self.assertEqual(code_dtype([257]), np.uint16)
+
+    def test_incremental_codes_are_widened(self):
+        nodes = [{"id": 0, "parents": []}, {"id": 1, "parents": []}]
+        learner = IncrementalK2(1, nodes, np.array([2, 2]), [[0, 1], [0, 1]], backend="float")
+        learner.append(pd.DataFrame({"a": [0, 1], "b": [0, 1]}))
+        learner.append(pd.DataFrame({"a": np.arange(300), "b": np.arange(300) % 2})) # 300 values outgrow uint8
+        self.assertEqual(learner.data.codes.dtype, np.uint16)
+        self.assertEqual(len(np.unique(learner.data.column(0))), 300)
+        self.assertEqual(learner.data.sample_size, 302)
+
+
+class TestBatchedScores(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(2)
+        data = pd.DataFrame(rng.integers(0, 3, size=(400, 6)))
+        data[5] = (data[0] + data[2] + rng.integers(0, 2, size=400)) % 3
+        V = [[0, 1, 2]] * 6
+        r = np.array([3] * 6)
+
+    def test_scores_match_single_calls(self):
+        for parents_xi in ([], [0], [0, 2]):
+            candidates = [z for z in range(5) if z not in parents_xi]
+            scores = cooper_herkovits_scores(5, parents_xi, candidates, data, r, V, "float")
+            for z, score in zip(candidates, scores):
+                self.assertEqual(score, cooper_herkovits_score(5, parents_xi + [z], data, r, V, "float"))
+
+    def test_small_blocks_and_fallback(self):
+        candidates = [1, 3, 4]
+        expected = cooper_herkovits_scores(5, [0], candidates, data, r, V, "float")
+        tables = candidate_tables(5, [0], candidates, data, V[5], block_rows=7)
+        self.assertEqual([score_from_counts(table, 3, "float") for table in tables], expected)
+        tables = candidate_tables(5, [0], candidates, data, V[5], max_cells=1)
+        self.assertEqual([score_from_counts(table, 3, "float") for table in tables], expected)
+
+    def test_cache_is_filled(self):
+        cache = FamilyScoreCache()
+        cooper_herkovits_scores(5, [0], [1, 2], data, r, V, "float", cache)
+        cooper_herkovits_score(5, [2, 0], data, r, V, "float", cache)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_custom_score_families(self):
+        scored = []
+        def score_families(parent_sets):
+            scored.extend(parent_sets)
+            return [cooper_herkovits_score(5, parents, data, r, V, "float") for parents in parent_sets]
+        expected = learn_parents(5, [], list(range(5)), 3, data, r, V, "float")
+        self.assertEqual(learn_parents(5, [], list(range(5)), 3, None, r, V, score_families=score_families), expected)
+        self.assertIn([], scored)
+        with self.assertRaises(ValueError):
+            learn_parents(5, [], list(range(5)), 3, None, r, V, prune=True, score_families=score_families)
+
+
+class TestParallelK2(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(3)
+        data = pd.DataFrame(rng.integers(0, 3, size=(300, 7)))
+        data[4] = (data[0] + rng.integers(0, 2, size=300)) % 3
+        data[6] = (data[4] * data[1]) % 3
+        V = [[0, 1, 2]] * 7
+        r = np.array([3] * 7)
+
+    def test_schedule_most_predecessors_first(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(4)]
+        self.assertEqual([node["id"] for node in schedule_nodes(nodes)], [3, 2, 1, 0])
+
+    def test_schedule_follows_candidate_pools(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(4)]
+        pools = {3: [0], 2: [0, 1]}
+        predecessors = {node["id"]: node_predecessors(node["id"], nodes, candidate_pools=pools) for node in nodes}
+        self.assertEqual([node["id"] for node in schedule_nodes(nodes, predecessors)], [2, 1, 3, 0])
+
+    def test_same_result_as_serial(self):
+        serial_nodes = [{"id": idx, "parents": []} for idx in range(7)]
+        parallel_nodes = [{"id": idx, "parents": []} for idx in range(7)]
+        k2_algorithm(3, serial_nodes, data, r, V, backend="float")
+        k2_algorithm_parallel(3, parallel_nodes, data, r, V, n_jobs=2, backend="float")
+        self.assertEqual(serial_nodes, parallel_nodes)
+
+
+class TestSharedDataset(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, V
+        data = pd.DataFrame(columns=["x1", "x2", "x3"])
+        data["x1"] = [5, 2, 1, 3, 2, 1, 1]
+        data["x2"] = [1, 1, 1, 0, 1, 1, 1]
+        data["x3"] = [0.5, 1, 2, 1, 1, 2, 1]
+        V = [[1, 2, 3, 5], [0, 1], [0.5, 1, 2]]
+
+    def test_encoded_view(self):
+        encoded = EncodedDataset(data, V)
+        with SharedDataset(encoded) as shared:
+            attached = shared.handle.attach()
+            np.testing.assert_array_equal(attached.codes, encoded.codes)
+            self.assertFalse(attached.codes.flags["WRITEABLE"])
+            self.assertEqual(contingency_table(2, [0], attached, V[2]).tolist(), contingency_table(2, [0], data, V[2]).tolist())
+            del attached
+            shared.handle.detach()
+
+    def test_raw_view(self):
+        with SharedDataset(data) as shared:
+            attached = shared.handle.attach()
+            self.assertEqual(list(attached.columns), list(data.columns))
+            np.testing.assert_array_equal(attached.to_numpy(), data.to_numpy())
+            del attached
+            shared.handle.detach()
+
+    def test_object_columns_are_rejected(self):
+        strings = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+        with self.assertRaises(TypeError):
+            SharedDataset(strings)
+        encoded = EncodedDataset(strings, [[1, 2], ["x", "y"]])
+        with SharedDataset(encoded) as shared:
+            attached = shared.handle.attach()
+            self.assertEqual(attached.decode([1])["b"].tolist(), ["x", "y"])
+            del attached
+            shared.handle.detach()
+
+    def test_released_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with SharedDataset(EncodedDataset(data, V)) as shared:
+                name = shared.name
+                raise RuntimeError("failure while the segment is published")
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+class TestParallelTrials(unittest.TestCase):
+
+    def test_structure_difference(self):
+        expected = [{"id": 0, "parents": []}, {"id": 1, "parents": [0]}, {"id": 2, "parents": [0, 1]}]
+        actual = [{"id": 0, "parents": []}, {"id": 1, "parents": []}, {"id": 2, "parents": [1, 0]}]
+        self.assertEqual(structure_difference(expected, actual), 1)
+
+    def test_trial_seeds_are_independent(self):
+        seeds = trial_seeds(0, 3)
+        self.assertEqual(len({tuple(seed) for seed in seeds}), 3)
+        np.testing.assert_array_equal(seeds[2], trial_seeds(0, 3)[2])
+
+    def test_parallel_matches_serial(self):
+        results = []
+        for n_jobs in (1, 2):
+            network_counts, network_structure_difference = {}, {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_trials(configure_child_dataset, expected_node_configuration_child, network_counts,
+                           network_structure_difference, 3, 200, 2, r_child, V_child, n_jobs=n_jobs, seed=7, backend="float")
+            results.append((list(network_counts.items()), list(network_structure_difference.items())))
+        self.assertEqual(results[0], results[1])
+
+
+class TestOverflowSafeCounting(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(4)
+        data = pd.DataFrame(rng.integers(0, 4, size=(300, 41))) # 4^40 parent instantiations overflow int64
+        V = [[0, 1, 2, 3]] * 41
+        r = np.array([4] * 41)
+
+    def test_many_parents(self):
+        parents_xi = list(range(40))
+        table = contingency_table(40, parents_xi, data, V[40], ordered=False)
+        self.assertLessEqual(len(table), len(data)) # Only observed instantiations get a row
+        self.assertEqual(table.sum(), len(data))
+        # Every row is a different instantiation, so each one counts a single value
+        self.assertTrue((table.sum(axis=1) == 1).all())
+
+    def test_refactorized_codes(self):
+        codes, size = mixed_radix_codes(list(range(40)), data)
+        self.assertLessEqual(size, 2**62)
+        self.assertEqual(len(np.unique(codes)), len(data.iloc[:, :40].drop_duplicates()))
+
+    def test_dense_and_sparse_agree(self):
+        dense = contingency_table(5, [0, 1, 2], data, V[5], ordered=False)
+        sparse = contingency_table(5, [0, 1, 2], data, V[5], ordered=False, dense_limit=0)
+        self.assertEqual(len(dense), 4 ** 3) # Dense mode: one row per possible instantiation
+        self.assertEqual(score_from_counts(dense, 4, "float"), score_from_counts(sparse, 4, "float"))
+
+
+class TestParentConfigurationIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data
+        data = pd.DataFrame(columns=["x1", "x2", "x3", "x4", "x5"])
+        data["x1"] = [5, 2, 1, 3, 2, 1, 1] 
+        data["x2"] = [1, 1, 1, 0, 1, 1, 1]
+        data["x3"] = [2, 0, 1, 2, 1, 1, 1]
+        data["x4"] = [3, 1, 2, 1, 1, 2, 1]
+        data["x5"] = [1, 1, 1, 1, 1, 1, 1]
+
+    def test_index(self):
+        index = ParentConfigurationIndex([1, 0], data)
+        # Unique instantiations of x1 and x2: [5, 1], [2, 1], [1, 1], [3, 0]
+        self.assertEqual(len(index), 4)
+        np.testing.assert_array_equal(index.configurations, data.iloc[:, [0, 1]].drop_duplicates().values)
+        np.testing.assert_array_equal(index.instantiation(2), [1, 1])
+        np.testing.assert_array_equal(index.rows(1), [1, 4])
+        np.testing.assert_array_equal(index.rows(2), [2, 5, 6])
+        self.assertEqual(index.n_ij(2), 3)
+        self.assertEqual(index.row_instantiation(4), 1)
+        with self.assertRaises(IndexError):
+            index.rows(4)
+
+    def test_index_is_reused(self):
+        encoded = EncodedDataset(data, [sorted(data[column].unique()) for column in data.columns])
+        self.assertIs(parent_configuration_index([0, 1], encoded), parent_configuration_index([1, 0], encoded))
+        self.assertIsNot(parent_configuration_index([0, 1], encoded), parent_configuration_index([0, 1], EncodedDataset(data, encoded.V)))
+
+    def test_indices_dropped_with_dataset(self):
+        encoded = EncodedDataset(data, [sorted(data[column].unique()) for column in data.columns])
+        data_id = id(encoded)
+        parent_configuration_index([0, 1], encoded)
+        self.assertIn((data_id, (0, 1)), k2_core._configuration_indices)
+        del encoded
+        gc.collect()
+        self.assertFalse(any(key[0] == data_id for key in k2_core._configuration_indices))
+        self.assertNotIn(data_id, k2_core._configuration_finalizers)
+
+    def test_modified_dataframe(self):
+        frame = pd.DataFrame({"a": [0, 1, 0, 1], "b": [0, 1, 1, 1]})
+        Nijk(1, 0, 1, [0], frame)
+        frame["a"] = [2, 2, 2, 2] # Changed in place, no index may be served from before the change
+        np.testing.assert_array_equal(unique_instantiations(1, [0], frame), [[2]])
+        self.assertEqual(Nijk(1, 0, 1, [0], frame), 3)
+
+
+class TestScorePruning(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(5)
+        data = pd.DataFrame(rng.integers(0, 3, size=(60, 6)))
+        data[5] = data[0] # Once 0 is a parent of 5 its table is pure, no other parent can improve it
+        V = [[0, 1, 2]] * 6
+        r = np.array([3] * 6)
+
+    def test_bound_holds_for_supersets(self):
+        bound = family_upper_bound(5, [3], data, r, V)
+        for parents in ([3], [3, 1], [3, 2, 4], [3, 0]):
+            self.assertLessEqual(cooper_herkovits_score(5, parents, data, r, V, "float"), bound)
+        pure = contingency_table(5, [0], data, V[5])
+        self.assertAlmostEqual(score_upper_bound(pure, 3), score_from_counts(pure, 3, "float"))
+
+    def test_same_structure_as_exhaustive(self):
+        exhaustive_nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        pruned_nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        exhaustive_stats, pruned_stats = {}, {}
+        k2_algorithm(5, exhaustive_nodes, data, r, V, backend="float", stats=exhaustive_stats)
+        k2_algorithm(5, pruned_nodes, data, r, V, backend="float", prune=True, stats=pruned_stats)
+        self.assertEqual(exhaustive_nodes, pruned_nodes)
+        self.assertEqual(exhaustive_stats["pruned"], 0)
+        self.assertGreater(pruned_stats["pruned"], 0)
+        self.assertEqual(pruned_stats["evaluated"] + pruned_stats["pruned"], exhaustive_stats["evaluated"])
+
+    def test_floor_skips_useless_bounds(self):
+        table = contingency_table(5, [3], data, V[5])
+        bound = score_upper_bound(table, 3)
+        self.assertEqual(score_upper_bound(table, 3, floor=bound + 1), bound) # Computed, it could prune
+        self.assertEqual(score_upper_bound(table, 3, floor=-1e9), math.inf) # Surely above any such score
+
+    def test_prunes_partly_deterministic_network(self):
+        rng = np.random.default_rng(13)
+        network = pd.DataFrame(rng.integers(0, 3, size=(2000, 16)))
+        for i in range(4, 16):
+            a, b = rng.choice(i, 2, replace=False)
+            exact = (network[a] + network[b]) % 3 if i % 2 else network[a]
+            noise = rng.random(2000) < 0.1
+            # Two thirds of the nodes are functions of their parents, the others are noisy copies of them
+            network[i] = exact if i % 3 else np.where(noise, rng.integers(0, 3, 2000), exact)
+        exhaustive_nodes = [{"id": idx, "parents": []} for idx in range(16)]
+        pruned_nodes = [{"id": idx, "parents": []} for idx in range(16)]
+        exhaustive_stats, pruned_stats = {}, {}
+        k2_algorithm(3, exhaustive_nodes, network, [3] * 16, [[0, 1, 2]] * 16, backend="float", stats=exhaustive_stats)
+        k2_algorithm(3, pruned_nodes, network, [3] * 16, [[0, 1, 2]] * 16, backend="float", prune=True,
+                     stats=pruned_stats)
+        self.assertEqual(exhaustive_nodes, pruned_nodes)
+        self.assertGreater(pruned_stats["pruned"], 0.1 * exhaustive_stats["evaluated"])
+
+
+class TestCandidateScreening(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(6)
+        data = pd.DataFrame(rng.integers(0, 3, size=(500, 6)))
+        data[3] = (data[0] + (rng.random(500) < 0.1)) % 3
+        data[5] = np.where(rng.random(500) < 0.3, data[1], data[3])
+        V = [[0, 1, 2]] * 6
+        r = np.array([3] * 6)
+
+    def test_pairwise_counts(self):
+        counts, offsets = pairwise_counts(data, V, max_cells=100) # Many small blocks
+        expected = pd.crosstab(data[1], data[3]).values
+        np.testing.assert_array_equal(counts[offsets[1]:offsets[2], offsets[3]:offsets[4]], expected)
+
+    def test_mutual_information(self):
+        mi, df = mutual_information_matrix(*pairwise_counts(data, V))
+        joint = pd.crosstab(data[1], data[5]).values / len(data)
+        expected = np.sum(joint * np.log(joint / np.outer(joint.sum(axis=1), joint.sum(axis=0))))
+        self.assertAlmostEqual(mi[1, 5], expected)
+        self.assertAlmostEqual(mi[5, 1], expected)
+        self.assertEqual(df[0, 3], 4)
+        blocked, _ = mutual_information_matrix(*pairwise_counts(data, V), max_cells=20) # One column at a time
+        np.testing.assert_allclose(blocked, mi)
+
+    def test_screened_pools(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        stats = {}
+        pools = screen_candidates(nodes, data, V, alpha=0.001, stats=stats, upper_bound=2)
+        self.assertEqual(pools[3], [0])
+        self.assertEqual(stats["candidates"], 15)
+        self.assertLess(stats["kept"], stats["candidates"])
+        self.assertEqual(stats["removed"], stats["candidates"] - stats["kept"])
+        self.assertEqual(screen_candidates(nodes, data, V, top_k=1)[5], [3])
+
+        full_nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        full_stats, screened_stats = {}, {}
+        k2_algorithm(2, full_nodes, data, r, V, backend="float", stats=full_stats)
+        k2_algorithm(2, nodes, data, r, V, backend="float", candidate_pools=pools, stats=screened_stats)
+        self.assertEqual(nodes[3]["parents"], [0])
+        # The families the searches can score bound the ones they do score
+        self.assertLessEqual(full_stats["evaluated"], stats["families"])
+        self.assertLessEqual(screened_stats["evaluated"], stats["screened_families"])
+        self.assertLess(stats["screened_families"], stats["families"])
+
+
+class TestPairwiseTables(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(7)
+        data = pd.DataFrame(rng.integers(0, 3, size=(200, 5)))
+        data[2] = rng.integers(0, 4, size=200)
+        data.loc[5, 4] = 9 # A value missing from V
+        V = [[0, 1, 2], [0, 1, 2], [0, 1, 2, 3], [0, 1, 2], [0, 1, 2]]
+        r = np.array([3, 3, 4, 3, 3])
+
+    def test_tables_match_counting(self):
+        tables = PairwiseTables(EncodedDataset(data, V))
+        for xi in range(5):
+            for parents in ([], *[[z] for z in range(5) if z != xi]):
+                table = tables.family_table(xi, parents, V[xi])
+                counted = contingency_table(xi, parents, data, V[xi], ordered=False)
+                self.assertEqual(score_from_counts(table, r[xi], "float"), score_from_counts(counted, r[xi], "float"))
+        np.testing.assert_array_equal(tables.table(2, 0), tables.table(0, 2).T)
+        self.assertIsNone(tables.family_table(4, [0, 1], V[4]))
+        self.assertEqual(tables._cells.dtype, np.uint8) # 200 rows fit in a byte
+
+    def test_same_structure(self):
+        with_tables = [{"id": idx, "parents": []} for idx in range(5)]
+        without_tables = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(3, with_tables, data, r, V, backend="float")
+        k2_algorithm(3, without_tables, data, r, V, backend="float", pairwise_tables=False)
+        self.assertEqual(with_tables, without_tables)
+
+
+class TestLazyGreedy(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(8)
+        data = pd.DataFrame(rng.integers(0, 3, size=(400, 8)))
+        data[5] = (data[0] + (rng.random(400) < 0.2)) % 3
+        data[7] = np.where(rng.random(400) < 0.5, data[5], data[2])
+        V = [[0, 1, 2]] * 8
+        r = np.array([3] * 8)
+
+    def test_saved_evaluations(self):
+        exact_nodes = [{"id": idx, "parents": []} for idx in range(8)]
+        lazy_nodes = [{"id": idx, "parents": []} for idx in range(8)]
+        exact_stats, lazy_stats = {}, {}
+        k2_algorithm(3, exact_nodes, data, r, V, backend="float", stats=exact_stats)
+        k2_algorithm(3, lazy_nodes, data, r, V, backend="float", lazy=True, stats=lazy_stats)
+        self.assertEqual(exact_nodes, lazy_nodes) # Strong, clear dependencies: the lazy search agrees here
+        self.assertEqual(set(lazy_stats["saved"]), set(range(8)))
+        self.assertGreater(sum(lazy_stats["saved"].values()), 0)
+        self.assertEqual(lazy_stats["evaluated"] + sum(lazy_stats["saved"].values()), exact_stats["evaluated"])
+
+    def test_no_pruning(self):
+        with self.assertRaises(ValueError):
+            learn_parents(7, [], [6, 5, 4], 2, data, r, V, "float", prune=True, lazy=True)
+
+
+class TestRandomRestarts(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(9)
+        data = pd.DataFrame(rng.integers(0, 3, size=(300, 6)))
+        data[0] = (data[3] + (rng.random(300) < 0.1)) % 3 # 3 -> 0, against the order of the IDs
+        data[1] = (data[0] + data[3]) % 3
+        V = [[0, 1, 2]] * 6
+        r = np.array([3] * 6)
+
+    def test_ordering(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        self.assertEqual(ordering_predecessors(3, [3, 0, 5, 1, 2, 4]), [])
+        self.assertEqual(ordering_predecessors(1, [3, 0, 5, 1, 2, 4]), [5, 0, 3])
+        self.assertEqual(ordering_predecessors(4, list(range(6))), Pred(4, nodes))
+        self.assertEqual(node_predecessors(1, nodes, [3, 0, 5, 1, 2, 4], {1: [3, 5], 2: [0]}), [5, 3])
+        self.assertEqual(node_predecessors(4, nodes, candidate_pools={1: [0]}), Pred(4, nodes))
+        ordering = perturb_ordering(list(range(6)), np.random.default_rng(0), n_swaps=3)
+        self.assertEqual(sorted(ordering), list(range(6)))
+
+    def test_best_network_is_kept(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        stats = {}
+        ordering, score = k2_restarts(2, nodes, data, r, V, n_restarts=6, orderings=[list(range(6))], n_jobs=1,
+                                      seed=0, backend="float", round_size=2, stats=stats)
+        self.assertEqual(len(stats["scores"]), 6)
+        self.assertEqual(score, max(stats["scores"]))
+        id_nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        k2_algorithm(2, id_nodes, data, r, V, backend="float")
+        self.assertEqual(stats["scores"][0], network_score(id_nodes, data, r, V, "float")) # Supplied ordering first
+        self.assertEqual(score, network_score(nodes, data, r, V, "float"))
+        self.assertGreater(stats["cache"]["hits"], 0) # The restarts share their families
+
+    def test_parallel_matches_serial(self):
+        results = []
+        for n_jobs in (1, 2):
+            nodes = [{"id": idx, "parents": []} for idx in range(6)]
+            results.append((k2_restarts(2, nodes, data, r, V, n_restarts=4, strategy="perturb", n_jobs=n_jobs,
+                                        seed=1, backend="float", round_size=2), nodes))
+        self.assertEqual(results[0], results[1])
+
+    def test_entries_reach_every_worker(self):
+        first, second = list(range(6)), [3, 0, 5, 1, 2, 4]
+        for n_jobs in (1, 2):
+            nodes = [{"id": idx, "parents": []} for idx in range(6)]
+            stats = {}
+            k2_restarts(2, nodes, data, r, V, n_restarts=5, orderings=[first, second, first, second, first], n_jobs=n_jobs,
+                        backend="float", round_size=1, stats=stats)
+            # From the third round on every family was computed in an earlier round, by whichever worker
+            self.assertGreater(stats["computed"][0], 0)
+            self.assertGreater(stats["computed"][1], 0)
+            self.assertEqual(stats["computed"][2:], [0, 0, 0])
+
+
+class TestOrderMCMC(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(10)
+        data = pd.DataFrame(rng.integers(0, 2, size=(60, 3)))
+        data[1] = np.where(rng.random(60) < 0.3, data[2], data[0])
+        V = [[0, 1]] * 3
+        r = np.array([2] * 3)
+
+    def exact_marginals(self, upper_bound):
+        # Brute force: every ordering and every parent set, with a uniform prior over the orderings
+        total, edges = 0.0, np.zeros((3, 3))
+        for ordering in itertools.permutations(range(3)):
+            weight, ordering_edges = 1.0, np.zeros((3, 3))
+            for position, xi in enumerate(ordering):
+                sets = [s for size in range(upper_bound + 1) for s in itertools.combinations(ordering[:position], size)]
+                scores = np.exp([cooper_herkovits_score(xi, list(s), data, r, V, "float") for s in sets])
+                weight *= scores.sum()
+                for s, score in zip(sets, scores):
+                    for z in s:
+                        ordering_edges[z, xi] += score / scores.sum()
+            total += weight
+            edges += weight * ordering_edges
+        return edges / total
+
+    def test_local_scores(self):
+        masks, scores = local_score_table(1, [0, 2], 2, data, r, V, "float")
+        self.assertEqual(list(masks), [0, 1, 4, 5])
+        self.assertEqual(scores[3], cooper_herkovits_score(1, [0, 2], data, r, V, "float"))
+        self.assertEqual(count_parent_sets(19, 2), 1 + 19 + 171)
+
+    def test_matches_exact_posterior(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(3)]
+        stats = {}
+        edges = order_mcmc(2, nodes, data, r, V, n_samples=4000, burn_in=200, n_chains=2, n_jobs=2, seed=0,
+                           backend="float", stats=stats)
+        np.testing.assert_allclose(edges, self.exact_marginals(2), atol=0.05)
+        self.assertEqual(len(stats["chains"]), 2)
+        self.assertEqual(stats["local_scores"], 3 * 4)
+
+    def test_too_many_parent_sets(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(3)]
+        with unittest.mock.patch("k2_mcmc.MAX_PARENT_SETS", 5):
+            with self.assertRaises(ValueError):
+                order_mcmc(2, nodes, data, r, V)
+
+
+class TestExactParents(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        # All the combinations of five binary nodes, twice: 5 is their XOR, which no single parent explains,
+        # so the greedy search stops before adding 0 or 1
+        data = pd.DataFrame(list(itertools.product([0, 1], repeat=5)) * 2)
+        data[5] = data[0] ^ data[1]
+        V = [[0, 1]] * 6
+        r = np.array([2] * 6)
+
+    def test_matches_enumeration(self):
+        predecessors = Pred(5, [{"id": idx} for idx in range(6)])
+        for upper_bound in (1, 2, 3):
+            stats = {}
+            parents = exact_parents(5, [], predecessors, upper_bound, data, r, V, "float", stats=stats)
+            best = max(
+                (cooper_herkovits_score(5, list(s), data, r, V, "float"), -len(s))
+                for size in range(upper_bound + 1) for s in itertools.combinations(predecessors, size)
+            )
+            self.assertEqual(cooper_herkovits_score(5, parents, data, r, V, "float"), best[0])
+            self.assertEqual(stats["evaluated"] + stats["pruned"], count_parent_sets(5, upper_bound))
+        self.assertEqual(sorted(parents), [0, 1])
+        self.assertEqual(learn_parents(5, [], predecessors, 3, data, r, V, "float"), [])
+
+    def test_too_many_parent_sets(self):
+        predecessors = Pred(5, [{"id": idx} for idx in range(6)])
+        with unittest.mock.patch("k2_core.MAX_EXACT_PARENT_SETS", count_parent_sets(5, 2)):
+            exact_parents(5, [], predecessors, 2, data, r, V, "float")
+            with self.assertRaises(ValueError):
+                exact_parents(5, [], predecessors, 3, data, r, V, "float")
+            nodes = [{"id": idx, "parents": []} for idx in range(6)]
+            with self.assertRaises(ValueError):
+                k2_algorithm(3, nodes, data, r, V, backend="float", exact=True)
+            with self.assertRaises(ValueError):
+                k2_algorithm_parallel(3, nodes, data, r, V, n_jobs=2, backend="float", exact=True)
+            # Restricting the candidates keeps the enumeration small enough
+            k2_algorithm(3, nodes, data, r, V, backend="float", exact=True, candidate_pools={5: [0, 1, 2, 3]})
+        self.assertEqual(sorted(nodes[5]["parents"]), [0, 1])
+
+    def test_greedy_options_are_refused(self):
+        for options in ({"prune": True}, {"lazy": True}, {"removal": True}, {"initial_parents": {5: [0]}}):
+            nodes = [{"id": idx, "parents": []} for idx in range(6)]
+            with self.assertRaises(ValueError):
+                k2_algorithm(3, nodes, data, r, V, backend="float", exact=True, **options)
+            self.assertEqual(nodes[5]["parents"], [])
+
+    def test_parallel_matches_serial(self):
+        serial_nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        parallel_nodes = [{"id": idx, "parents": []} for idx in range(6)]
+        serial_stats, parallel_stats = {}, {}
+        k2_algorithm(3, serial_nodes, data, r, V, backend="float", exact=True, stats=serial_stats)
+        k2_algorithm_parallel(3, parallel_nodes, data, r, V, n_jobs=2, backend="float", exact=True, stats=parallel_stats)
+        self.assertEqual(serial_nodes, parallel_nodes)
+        self.assertEqual(serial_stats, parallel_stats)
+        self.assertGreater(serial_stats["pruned"], 0)
+
+
+class TestBootstrap(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(12)
+        data = pd.DataFrame(rng.integers(0, 3, size=(150, 5)))
+        data[3] = (data[0] + (rng.random(150) < 0.2)) % 3
+        data[4] = np.where(rng.random(150) < 0.6, data[3], data[1])
+        V = [[0, 1, 2]] * 5
+        r = np.array([3] * 5)
+
+    def test_weighted_counts_match_resampled_rows(self):
+        weights = bootstrap_weights(len(data), np.random.default_rng(0), "poisson")
+        weighted = EncodedDataset(data, V).with_weights(weights)
+        resampled = data.iloc[np.repeat(np.arange(len(data)), weights)]
+        self.assertEqual(weighted.sample_size, len(resampled))
+        expected = score_from_counts(contingency_table(4, [3, 1], resampled, V[4]), 3, "float")
+        self.assertEqual(score_from_counts(contingency_table(4, [3, 1], weighted, V[4]), 3, "float"), expected)
+        self.assertEqual(score_from_counts(candidate_tables(4, [3], [0, 1, 2], weighted, V[4])[1], 3, "float"), expected)
+        np.testing.assert_array_equal(pairwise_counts(weighted)[0], pairwise_counts(resampled, V)[0])
+
+        weighted_nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        resampled_nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(2, weighted_nodes, weighted, r, V, backend="float")
+        k2_algorithm(2, resampled_nodes, resampled, r, V, backend="float")
+        self.assertEqual(weighted_nodes, resampled_nodes)
+
+    def test_invalid_weights(self):
+        with self.assertRaises(ValueError):
+            EncodedDataset(data, V).with_weights(np.ones(3))
+        with self.assertRaises(ValueError):
+            EncodedDataset(data, V).with_weights(np.full(len(data), 0.5))
+
+    def test_edge_frequencies(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        serial = k2_bootstrap(2, nodes, data, r, V, n_replicates=6, n_jobs=1, seed=3, backend="float")
+        parallel = k2_bootstrap(2, nodes, data, r, V, n_replicates=6, n_jobs=2, seed=3, backend="float")
+        np.testing.assert_array_equal(serial, parallel)
+        self.assertEqual(serial[0, 3], 1.0) # The strong edge is found in every replicate
+        self.assertTrue(((serial >= 0) & (serial <= 1)).all())
+        self.assertEqual(nodes[3]["parents"], [])
+
+class TestDeduplication(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(21)
+        data = pd.DataFrame(rng.integers(0, 2, size=(400, 5)))
+        data[3] = data[0] ^ (rng.random(400) < 0.1).astype(int)
+        data[4] = data[1] & data[3]
+        V = [[0, 1]] * 5
+        r = np.array([2] * 5)
+
+    def test_distinct_rows_in_order_of_first_appearance(self):
+        encoded = EncodedDataset(data, V)
+        compressed = encoded.deduplicate()
+        distinct = data.drop_duplicates()
+        self.assertEqual(len(compressed), len(distinct))
+        self.assertEqual(compressed.sample_size, len(data))
+        np.testing.assert_array_equal(compressed.codes, distinct.to_numpy())
+        np.testing.assert_array_equal(compressed.weights, data.value_counts(sort=False).loc[
+            [tuple(row) for row in distinct.to_numpy()]].to_numpy())
+
+    def test_weighted_rows_are_merged(self):
+        weights = np.arange(len(data)) % 3 # Rows with weight 0 are dropped
+        compressed = EncodedDataset(data, V).with_weights(weights).deduplicate()
+        self.assertEqual(compressed.sample_size, weights.sum())
+        self.assertTrue((compressed.weights > 0).all())
+
+    def test_same_counts_and_structure(self):
+        encoded = EncodedDataset(data, V)
+        compressed = encoded.deduplicate()
+        for j in range(4):
+            self.assertEqual(Nij(4, [1, 3], j, compressed, r, V), Nij(4, [1, 3], j, encoded, r, V))
+            for k in range(2):
+                self.assertEqual(Nijk(4, j, k, [1, 3], compressed), Nijk(4, j, k, [1, 3], encoded))
+        np.testing.assert_array_equal(contingency_table(4, [1, 3], compressed, V[4]),
+                                      contingency_table(4, [1, 3], encoded, V[4]))
+        self.assertEqual(cooper_herkovits_score(3, [0, 2], compressed, r, V, "float"),
+                         cooper_herkovits_score(3, [0, 2], encoded, r, V, "float"))
+
+        nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        deduplicated_nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(2, nodes, data, r, V, backend="float")
+        k2_algorithm(2, deduplicated_nodes, data, r, V, backend="float", deduplicate=True)
+        self.assertEqual(nodes, deduplicated_nodes)
+
+class TestStreaming(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(22)
+        data = pd.DataFrame(rng.integers(0, 3, size=(500, 6)))
+        data[3] = (data[0] + (rng.random(500) < 0.2)) % 3
+        data[4] = np.where(rng.random(500) < 0.7, data[3], data[1])
+        data[5] = (data[4] + data[2]) % 3
+        V = [[0, 1, 2]] * 6
+        r = np.array([3] * 6)
+
+    def chunks(self):
+        return [data.iloc[start:start + 64] for start in range(0, len(data), 64)]
+
+    def test_tables_match_contingency_tables(self):
+        streamed = StreamingDataset(self.chunks, V)
+        self.assertEqual(len(streamed), len(data))
+        families = [(4, []), (4, [3]), (5, [4, 2]), (5, [0, 1, 2, 3])]
+        for dense_limit in (DENSE_TABLE_LIMIT, 1): # The sparse mode keeps only the observed cells
+            tables = stream_tables(families, streamed, r, dense_limit=dense_limit)
+            for (xi, parents), table in zip(families, tables):
+                self.assertEqual(score_from_counts(table, 3, "float"),
+                                 score_from_counts(contingency_table(xi, parents, data, V[xi]), 3, "float"))
+
+    def test_same_structure_as_k2(self):
+        expected = [{"id": idx, "parents": []} for idx in range(6)]
+        k2_algorithm(3, expected, data, r, V, backend="float")
+        for max_cells in (STREAM_TABLE_CELLS, 1): # With 1 cell, every family is counted in a pass of its own
+            nodes = [{"id": idx, "parents": []} for idx in range(6)]
+            stats = {}
+            k2_streaming(3, nodes, self.chunks(), r, V, backend="float", max_cells=max_cells, stats=stats)
+            self.assertEqual(nodes, expected)
+        self.assertEqual(stats["passes"], stats["evaluated"] + 6)
+
+    def test_csv_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "data.csv")
+            data.to_csv(path, index=False)
+            nodes = [{"id": idx, "parents": []} for idx in range(6)]
+            stats = {}
+            k2_streaming(3, nodes, path, r, V, backend="float", chunk_rows=100, stats=stats)
+        expected = [{"id": idx, "parents": []} for idx in range(6)]
+        k2_algorithm(3, expected, data, r, V, backend="float")
+        self.assertEqual(nodes, expected)
+        self.assertLessEqual(stats["passes"], 4) # One pass per greedy step
+
+    def test_peak_cells_are_bounded(self):
+        rng = np.random.default_rng(0)
+        wide = pd.DataFrame(rng.integers(0, 8, size=(100, 8)))
+        streamed = StreamingDataset([wide], [list(range(8))] * 8)
+        families = [(xi, [0, 1, 2, 3, 4]) for xi in (5, 6, 7)] # Dense tables of 8**6 cells each
+        stats = {}
+        tables = stream_tables(families, streamed, [8] * 8, max_cells=1000, stats=stats)
+        self.assertLessEqual(stats["peak_cells"], 1000)
+        for (xi, parents), table in zip(families, tables):
+            self.assertEqual(score_from_counts(table, 8, "float"),
+                             score_from_counts(contingency_table(xi, parents, wide, list(range(8))), 8, "float"))
+
+    def test_generator_is_rejected(self):
+        with self.assertRaises(TypeError):
+            StreamingDataset(iter(self.chunks()), V)
+
+class TestIncrementalK2(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(23)
+        data = pd.DataFrame(rng.integers(0, 3, size=(600, 5)))
+        data[2] = (data[0] + (rng.random(600) < 0.2)) % 3
+        data[4] = np.where(rng.random(600) < 0.7, data[2], data[3])
+        V = [[0, 1, 2]] * 5
+        r = np.array([3] * 5)
+
+    def test_same_structure_as_k2_on_all_rows(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        learner = IncrementalK2(2, nodes, r, V, backend="float")
+        for start in range(0, 600, 150):
+            learner.append(data.iloc[start:start + 150])
+            expected = [{"id": idx, "parents": []} for idx in range(5)]
+            k2_algorithm(2, expected, data.iloc[:start + 150], r, V, backend="float")
+            self.assertEqual(nodes, expected)
+        self.assertEqual(learner.stats["rows"], 600)
+        self.assertEqual(learner.data.sample_size, 600)
+        self.assertEqual(len(learner.data), len(data.drop_duplicates()))
+        self.assertGreater(learner.stats["updated"], 0)
+
+    def test_reports_changes(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        learner = IncrementalK2(2, nodes, r, V, backend="float")
+        self.assertTrue(learner.append(data))
+        self.assertFalse(learner.append(data.iloc[:5])) # A few rows do not move the strong dependencies
+        counted = learner.stats["counted"]
+        learner.append(data.iloc[5:10])
+        self.assertEqual(learner.stats["counted"], counted) # Every family was scored from its updated table
+        # The distinct rows are a view of the storage, appending does not copy them
+        self.assertTrue(np.shares_memory(learner.data.codes, learner._codes))
+        self.assertTrue(np.shares_memory(learner.data.weights, learner._weights))
+
+    def test_new_values(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        learner = IncrementalK2(2, nodes, r, V, backend="float")
+        learner.append(data)
+        extra = data.iloc[:20].copy()
+        extra[0] = 7 # A value missing from V, which becomes a new instantiation of the parent sets with node 0
+        learner.append(extra)
+        expected = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(2, expected, pd.concat([data, extra]), r, V, backend="float")
+        self.assertEqual(nodes, expected)
+
+class TestWarmStart(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(24)
+        data = pd.DataFrame(rng.integers(0, 3, size=(800, 5)))
+        data[3] = (data[1] + (rng.random(800) < 0.2)) % 3
+        data[4] = np.where(rng.random(800) < 0.7, data[3], data[2])
+        V = [[0, 1, 2]] * 5
+        r = np.array([3] * 5)
+
+    def test_warm_start_from_the_learned_structure(self):
+        cold = [{"id": idx, "parents": []} for idx in range(5)]
+        cold_stats = {}
+        k2_algorithm(2, cold, data, r, V, backend="float", stats=cold_stats)
+        warm = [{"id": idx, "parents": []} for idx in range(5)]
+        warm_stats = {}
+        k2_algorithm(2, warm, data, r, V, backend="float", stats=warm_stats,
+                     initial_parents={node["id"]: node["parents"] for node in cold})
+        self.assertEqual(warm, cold)
+        self.assertLess(warm_stats["evaluated"], cold_stats["evaluated"])
+
+    def test_removal_check(self):
+        expected = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(2, expected, data, r, V, backend="float")
+        prior = {4: [0]} # Node 0 is independent of node 4
+        kept = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(2, kept, data, r, V, backend="float", initial_parents=prior)
+        self.assertIn(0, kept[4]["parents"])
+        removed = [{"id": idx, "parents": []} for idx in range(5)]
+        stats = {}
+        k2_algorithm(2, removed, data, r, V, backend="float", initial_parents=prior, removal=True, stats=stats)
+        self.assertNotIn(0, removed[4]["parents"])
+        self.assertEqual(removed, expected)
+        self.assertGreaterEqual(stats["removed"], 1)
+
+    def test_invalid_priors(self):
+        nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        for prior in ({2: [3]}, {2: [1, 1]}, {4: [0, 1, 2]}, {7: []}):
+            with self.assertRaises(ValueError):
+                seed_parents(nodes, prior, 2)
+        self.assertEqual(nodes, [{"id": idx, "parents": []} for idx in range(5)])
+        seed_parents(nodes, {2: [3]}, 2, ordering=[0, 1, 3, 2, 4]) # Node 3 comes before node 2 in this ordering
+        self.assertEqual(nodes[2]["parents"], [3])
+
+class TestADTree(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global data, r, V
+        rng = np.random.default_rng(25)
+        data = pd.DataFrame(rng.integers(0, 3, size=(700, 5)))
+        data[2] = (data[0] + (rng.random(700) < 0.15)) % 3
+        data[4] = np.where(rng.random(700) < 0.6, data[2], data[3])
+        V = [[0, 1, 2]] * 5
+        r = np.array([3] * 5)
+
+    def test_count_queries(self):
+        encoded = EncodedDataset(data, V)
+        tree = ADTree(encoded, leaf_threshold=8)
+        self.assertEqual(tree.count({}), len(data))
+        for conditions in ({0: 1}, {2: 0, 4: 0}, {0: 2, 1: 1, 3: 0}, {0: 0, 2: 2, 3: 1, 4: 2}, {1: 5}):
+            expected = np.ones(len(data), dtype=bool)
+            for column, value in conditions.items():
+                expected &= data[column].to_numpy() == value
+            self.assertEqual(tree.count(conditions), expected.sum())
+
+    def test_family_tables(self):
+        encoded = EncodedDataset(data, V)
+        weighted = encoded.with_weights(np.arange(len(data)) % 4)
+        for dataset in (encoded, weighted):
+            for leaf_threshold in (1, 32, 10**6):
+                tree = ADTree(dataset, leaf_threshold)
+                for xi, parents in ((4, []), (4, [2]), (4, [3, 0, 2]), (1, [4, 0])):
+                    self.assertEqual(
+                        score_from_counts(tree.family_table(xi, parents, V[xi]), 3, "float"),
+                        score_from_counts(contingency_table(xi, parents, dataset, V[xi]), 3, "float")
+                    )
+        self.assertIsNone(ADTree(encoded, dense_limit=10).family_table(4, [2, 3], V[4]))
+
+    def test_leaf_threshold_bounds_the_tree(self):
+        encoded = EncodedDataset(data, V)
+        small, large = ADTree(encoded, leaf_threshold=1), ADTree(encoded, leaf_threshold=64)
+        self.assertLess(large.n_nodes, small.n_nodes)
+        self.assertLess(large.nbytes, small.nbytes)
+        # The internal nodes keep no rows, so a single leaf list holds all the bytes of the rows once
+        nodes, row_bytes = [large.root], 0
+        while nodes:
+            node = nodes.pop()
+            if node.rows is not None:
+                self.assertIsNone(node.vary)
+                row_bytes += node.rows.nbytes
+            else:
+                nodes.extend(child for _, children in node.vary for child in children if child is not None)
+        self.assertLessEqual(row_bytes, 4 * len(encoded) * len(V))
+        single = ADTree(encoded, leaf_threshold=10**6)
+        self.assertEqual(single.n_nodes, 1)
+        self.assertEqual(single.root.rows.nbytes, 4 * len(encoded.deduplicate()))
+
+    def test_repeated_rows_are_stored_once(self):
+        encoded = EncodedDataset(data, V)
+        repeated = EncodedDataset(pd.concat([data] * 10, ignore_index=True), V)
+        tree, repeated_tree = ADTree(encoded), ADTree(repeated)
+        self.assertEqual(repeated_tree.nbytes, tree.nbytes)
+        self.assertEqual(repeated_tree.count({0: 1, 2: 1}), 10 * tree.count({0: 1, 2: 1}))
+
+    def test_same_structure_as_k2(self):
+        expected = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(3, expected, data, r, V, backend="float")
+        nodes = [{"id": idx, "parents": []} for idx in range(5)]
+        k2_algorithm(3, nodes, data, r, V, backend="float", adtree=True)
+        self.assertEqual(nodes, expected)
@@ -1,3 +1,9 @@
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from k2_core import k2_algorithm
+
 def prepare_to_write_on_file(network_counts, network_structure_difference):
     differences = {}
 
@@ -8,4 +14,163 @@ def prepare_to_write_on_file(network_counts, network_structure_difference):
                 differences[difference] = 0
             differences[difference] += count
 
-    return differences
\ No newline at end of file
+    return differences
+
+
+def structure_difference(expected_nodes, nodes, verbose=False):
+    """
+    Counts the differences between the expected parent sets and the learned ones.
+    A node counts as one difference if its number of parents is wrong, otherwise each wrong parent counts as one.
+
+    Parameters:
+        expected_nodes (list of dict): The nodes of the true network, with their 'parents'.
+        nodes (list of dict): The nodes of the learned network, with their 'parents'.
+        verbose (bool): If True, prints the expected and the learned parents of every node.
+
+    Returns:
+        int: The number of differences.
+    """
+    differences = 0
+    for expected, actual in itertools.zip_longest(expected_nodes, nodes):
+
+        if expected is None or actual is None:
+            # Gestisci il caso in cui una delle liste è più corta
+            differences += 1
+            continue
+
+        parents_expected = sorted(expected["parents"])
+        parents_actual = sorted(actual["parents"])
+        # Note: Sorting ensures the order is consistent for comparison.
+
+        if verbose:
+            print(f"Expected: {parents_expected}, Actual: {parents_actual}")
+
+        if len(parents_expected) != len(parents_actual):
+            differences += 1
+            continue
+
+        for parent_expected, parent_actual in itertools.zip_longest(parents_expected, parents_actual):
+            if parent_expected != parent_actual:
+                differences += 1
+
+    return differences
+
+
+def trial_seeds(seed, n_tests):
+    """
+    Derives an independent random stream for each trial from a single seed.
+
+    Parameters:
+        seed (int): The seed of the whole experiment.
+        n_tests (int): The number of trials.
+
+    Returns:
+        list of np.ndarray: The seed of each trial, the same whether the trials run serially or in parallel.
+    """
+    return [sequence.generate_state(4) for sequence in np.random.SeedSequence(seed).spawn(n_tests)]
+
+
+def run_trial(i, trial_seed, configure_dataset, n_samples, upper_bound, r, V, backend=None):
+    """
+    Runs a single trial: generates a dataset with its own random stream and learns its structure with K2.
+
+    Parameters:
+        i (int): The index of the trial.
+        trial_seed (np.ndarray): The seed of the trial, from trial_seeds.
+        configure_dataset (function): The generator of the dataset, called as configure_dataset(i, n_samples).
+        n_samples (int): The number of rows of the dataset.
+        upper_bound (int): The maximum number of parents allowed for any node.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        backend (str): The score backend, defaults to SCORE_BACKEND.
+
+    Returns:
+        tuple: (nodes, execution time of K2) of the trial.
+    """
+    np.random.seed(trial_seed) # The generators draw from the global NumPy random state
+    data = configure_dataset(i, n_samples)
+    # Creazione della lista di nodi con id, nome e lista di genitori inizialmente vuota
+    nodes = [{"id": idx, "name": col, "parents": []} for idx, col in enumerate(data.columns)]
+
+    start_time = time.time()
+    k2_algorithm(upper_bound, nodes, data, r, V, backend=backend)
+    return nodes, time.time() - start_time
+
+
+def run_trials(configure_dataset, expected_nodes, network_counts, network_structure_difference, n_tests, n_samples,
+               upper_bound, r, V, n_jobs=1, seed=0, backend=None, label="", verbose=False):
+    """
+    Runs the repeated trials of an experiment, possibly over several worker processes, and merges their results.
+    Every trial has its own random stream (see trial_seeds) and the results are merged in trial order,
+    so the counts and the differences are the same for any number of processes.
+
+    Parameters:
+        configure_dataset (function): The generator of the dataset, called as configure_dataset(i, n_samples).
+        expected_nodes (list of dict): The nodes of the true network.
+        network_counts (dict): Occurrences of each learned structure, updated in place.
+        network_structure_difference (dict): Differences of each learned structure from the true one, updated in place.
+        n_tests (int): The number of trials.
+        n_samples (int): The number of rows of each dataset.
+        upper_bound (int): The maximum number of parents allowed for any node.
+        r (list of int): The number of possible values for each node.
+        V (list of list of int): The possible values for each node.
+        n_jobs (int): The number of worker processes, 1 runs the trials in this process.
+        seed (int): The seed of the experiment.
+        backend (str): The score backend, defaults to SCORE_BACKEND.
+        label (str): The name of the network, used in the printed messages.
+        verbose (bool): If True, prints the expected and learned parents of every node.
+
+    Returns:
+        None
+    """
+    seeds = trial_seeds(seed, n_tests)
+    arguments = [(i, seeds[i], configure_dataset, n_samples, upper_bound, r, V, backend) for i in range(n_tests)]
+
+    if n_jobs == 1:
+        results = (run_trial(*trial) for trial in arguments)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+        results = executor.map(run_trial, *zip(*arguments)) # Yields the results in trial order
+
+    try:
+        for nodes, execution_time in results:
+            print(f"Time to execute dataset {label}: ", execution_time)
+
+            # Create a hashable representation of the network structure
+            network_structure = tuple(tuple(sorted(node["parents"])) for node in nodes)
+            network_counts[network_structure] = network_counts.get(network_structure, 0) + 1
+
+            # Count differences between the expected nodes and the learned ones
+            differences = structure_difference(expected_nodes, nodes, verbose)
+            print(f"Differences between expected and actual nodes: {differences}")
+
+            if network_structure not in network_structure_difference:
+                network_structure_difference[network_structure] = differences
+
+            print(f"Current network structure occurred {network_counts[network_structure]} time(s)")
+            print(f"Total unique structures so far: {len(network_counts)}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def write_results(path, network_counts, network_structure_difference):
+    """
+    Writes the occurrences of each number of differences to a .txt file.
+
+    Parameters:
+        path (str): The path of the file.
+        network_counts (dict): Occurrences of each learned structure.
+        network_structure_difference (dict): Differences of each learned structure from the true one.
+
+    Returns:
+        None
+    """
+    with open(path, "w") as file:
+        differences = prepare_to_write_on_file(network_counts, network_structure_difference)
+
+        for difference, count in differences.items():
+            file.write(f"Difference: {difference}\n")
+            file.write(f"Occurrences: {count}\n")
+            file.write("\n")